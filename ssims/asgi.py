@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
+
+AI 对话（xx.views.chat_view）是异步视图，在 ASGI 下运行时等待模型回复不占用线程，例如：
+    uvicorn ssims.asgi:application --workers 4
 """
 
 import os
@@ -14,3 +17,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ssims.settings')
 
 application = get_asgi_application()
+
+# 预先启动 AI 代码沙箱的子进程，第一个对话不必等待进程启动
+from xx.sandbox import pool  # noqa: E402
+
+pool.start()
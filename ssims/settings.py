@@ -75,6 +75,23 @@ DATABASES = {
         'CONN_MAX_AGE': 6000,  # 连接保持时间（秒）
     }
 }
+# 缓存：默认使用文件缓存，web 进程与 runjobs worker 共享数据版本号（见 xx/cache.py）
+# 需要更快的后端时可换成 Redis / Memcached，或单进程部署时用 LocMemCache
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+        'TIMEOUT': 600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    'local': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+# xx/cache.py 使用的缓存别名
+SSIMS_CACHE = 'default'
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -105,6 +122,15 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AI_API_KEY = "your-api-key"
 AI_BASE_URL = "your base url"
 AI_MODEL = "your model"
+# AI 查询代价控制的拒绝、截断、估计计数等决定记到控制台（logger: xx.governor）
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {'console': {'class': 'logging.StreamHandler'}},
+    'loggers': {'xx.governor': {'handlers': ['console'], 'level': 'INFO'}},
+}
+# 后台任务（runjobs）上传文件与结果文件的存放目录
+JOB_ROOT = BASE_DIR / 'jobs'
 
 STATIC_URL = 'static/'
 STATICFILES_DIRS = [
@@ -23,6 +23,11 @@ urlpatterns = [
     path('students/<str:sno>/edit/', views.StudentEditView.as_view(), name='student_edit'),
     path('students/<str:sno>/delete/', views.StudentDeleteView.as_view(), name='student_delete'),
 
+    # ==================== 后台任务 ====================
+    path('jobs/<int:pk>/', views.JobDetailView.as_view(), name='job_detail'),
+    path('jobs/<int:pk>/status/', views.JobStatusView.as_view(), name='job_status'),
+    path('jobs/<int:pk>/download/', views.JobDownloadView.as_view(), name='job_download'),
+
     # ==================== 班级管理 ====================
     path('classes/', views.ClassListView.as_view(), name='class_list'),
     path('classes/add/', views.ClassAddView.as_view(), name='class_add'),
@@ -41,12 +46,25 @@ urlpatterns = [
     path('courses/<str:cno>/edit/', views.CourseEditView.as_view(), name='course_edit'),
     path('courses/<str:cno>/delete/', views.CourseDeleteView.as_view(), name='course_delete'),
     path('courses/<str:cno>/students/', views.CourseStudentsView.as_view(), name='course_students'),
+    path('courses/grades/', views.CourseGradeStatsView.as_view(), name='course_grade_stats'),
 
     # ==================== 选课与成绩管理 ====================
     path('select/<str:sno>/', views.SelectCourseView.as_view(), name='select_course'),
+    path('enroll/', views.BulkEnrollView.as_view(), name='bulk_enroll'),
     path('sc/<str:sno>/', views.StudentCourseView.as_view(), name='student_course'),
     path('sc/<str:sno>/<str:cno>/grade/', views.UpdateGradeView.as_view(), name='update_grade'),
 
+    # ==================== 缓存 ====================
+    path('cache/stats/', views.CacheStatsView.as_view(), name='cache_stats'),
+
+    # ==================== 搜索 ====================
+    path('search/suggest/', views.SearchSuggestView.as_view(), name='search_suggest'),
+
     # ==================== AI助手 ====================
-    path('chat/', views.chat_view, name='chat')
+    path('chat/', views.chat_view, name='chat'),
+    path('chat/stream/', views.chat_stream_view, name='chat_stream'),
+    path('chat/history/', views.chat_history_view, name='chat_history'),
+    path('chat/result/<str:handle>/', views.ChatResultPageView.as_view(), name='chat_result'),
+    path('chat/sandbox/stats/', views.SandboxStatsView.as_view(), name='sandbox_stats'),
+    path('chat/llm/stats/', views.LLMStatsView.as_view(), name='llm_stats'),
 ]
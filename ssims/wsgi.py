@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ssims.settings')
 
 application = get_wsgi_application()
+
+# 预先启动 AI 代码沙箱的子进程，第一个对话不必等待进程启动（runserver 也从这里加载）
+from xx.sandbox import pool  # noqa: E402
+
+pool.start()
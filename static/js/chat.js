@@ -65,33 +65,87 @@ function makeSafe(value) {
     return value;
 }
 
-// 递归生成表格
+// 列式结果生成表格：columns 为列名，rows 为按列顺序排列的值数组
+function buildColumnarTable(columns, rows) {
+    if (!columns || !rows || rows.length === 0) {
+        return '<div class="text-muted">无数据</div>';
+    }
+
+    const parts = ['<div class="table-responsive"><table class="table table-bordered table-sm mb-2"><thead><tr>'];
+
+    columns.forEach(k => {
+        const label = FIELD_LABEL_MAP[k] || String(k).replace(/_/g, ' ');
+        parts.push(`<th>${escapeHtml(label)}</th>`);
+    });
+
+    parts.push('</tr></thead><tbody>', buildRowsHTML(rows), '</tbody></table></div>');
+    return parts.join('');
+}
+
+function buildRowsHTML(rows) {
+    const parts = [];
+    rows.forEach(row => {
+        parts.push('<tr>');
+        row.forEach(value => parts.push(`<td>${escapeHtml(makeSafe(value))}</td>`));
+        parts.push('</tr>');
+    });
+    return parts.join('');
+}
+
+// 对象数组生成表格（旧格式的结果）
 function buildTableHTML(data) {
     if (!data || !Array.isArray(data) || data.length === 0) {
         return '<div class="text-muted">无数据</div>';
     }
 
     const keys = Object.keys(data[0]);
-    let html = `<div class="table-responsive"><table class="table table-bordered table-sm mb-2"><thead><tr>`;
+    return buildColumnarTable(keys, data.map(row => keys.map(k => row[k])));
+}
 
-    keys.forEach(k => {
-        const label = FIELD_LABEL_MAP[k] || k.replace(/_/g, ' ');
-        html += `<th>${escapeHtml(label)}</th>`;
-    });
+// 总数多于显示的行数时给出提示
+function countText(count, exact, shown) {
+    return `共 ${exact === false ? '至少 ' : ''}${count} 条，显示前 ${shown} 条`;
+}
 
-    html += `</tr></thead><tbody>`;
+function buildCountHTML(step) {
+    if (typeof step.count !== 'number' || !Array.isArray(step.rows) || step.count <= step.rows.length) return '';
+    return `<div class="ai-row-count text-muted small mb-2" data-count="${step.count}" data-exact="${step.count_exact !== false}">`
+        + `${escapeHtml(countText(step.count, step.count_exact, step.rows.length))}</div>`;
+}
 
-    data.forEach(row => {
-        html += '<tr>';
-        keys.forEach(k => {
-            const value = makeSafe(row[k]);
-            html += `<td>${escapeHtml(value)}</td>`;
-        });
-        html += '</tr>';
-    });
+// 还有下一页时的“加载更多”按钮（结果句柄见 /chat/result/<句柄>/）
+function buildMoreHTML(step) {
+    if (!step.handle || !step.next) return '';
+    return `<button type="button" class="btn btn-outline-secondary btn-sm ai-load-more"`
+        + ` data-handle="${escapeHtml(step.handle)}" data-cursor="${escapeHtml(step.next)}">加载更多</button>`;
+}
 
-    html += '</tbody></table></div>';
-    return html;
+async function loadMore(btn) {
+    const step = btn.closest('.ai-step');
+    const tbody = step && step.querySelector('tbody');
+    if (!tbody) return;
+    btn.disabled = true;
+    try {
+        const url = `/chat/result/${encodeURIComponent(btn.dataset.handle)}/?cursor=${encodeURIComponent(btn.dataset.cursor)}`;
+        const res = await fetch(url, { headers: { 'X-Requested-With': 'XMLHttpRequest' } });
+        const data = await res.json();
+        if (!res.ok) throw new Error(data.error || `HTTP ${res.status}`);
+        tbody.insertAdjacentHTML('beforeend', buildRowsHTML(data.rows));
+
+        const countEl = step.querySelector('.ai-row-count');
+        if (countEl) {
+            countEl.textContent = countText(countEl.dataset.count, countEl.dataset.exact === 'true', tbody.rows.length);
+        }
+        if (data.next) {
+            btn.dataset.cursor = data.next;
+            btn.disabled = false;
+        } else {
+            btn.remove();
+        }
+    } catch (err) {
+        console.error(err);
+        btn.outerHTML = `<div class="ai-error-result mb-2 text-danger"><i class="bi bi-x-circle-fill me-1"></i>${escapeHtml(err.message)}</div>`;
+    }
 }
 
 // 从文本中提取 JSON 数组（支持 ```json ... ``` 或直接 [...]）
@@ -128,12 +182,21 @@ function formatAIResult(content) {
             // 多表处理
             if (step.type === 'multi' && Array.isArray(step.data)) {
                 step.data.forEach(tbl => {
-                    if (tbl.title && Array.isArray(tbl.data)) {
+                    if (tbl.title && Array.isArray(tbl.rows)) {
+                        html += `<h5 class="mt-2 mb-2">${escapeHtml(tbl.title)}</h5>`;
+                        html += buildColumnarTable(tbl.columns, tbl.rows);
+                    } else if (tbl.title && Array.isArray(tbl.data)) {
                         html += `<h5 class="mt-2 mb-2">${escapeHtml(tbl.title)}</h5>`;
                         html += buildTableHTML(tbl.data);
                     }
                 });
             }
+            // 列式表格
+            else if (Array.isArray(step.columns) && Array.isArray(step.rows)) {
+                html += buildColumnarTable(step.columns, step.rows);
+                html += buildCountHTML(step);
+                html += buildMoreHTML(step);
+            }
             // 单表或普通对象数组
             else if (step.data && Array.isArray(step.data) && typeof step.data[0] === 'object') {
                 html += buildTableHTML(step.data);
@@ -188,10 +251,172 @@ function scrollBottom() {
     }, 50);
 }
 
+// ===================== 流式对话（SSE） =====================
+
+// 一条消息的节点，结构与 chat.html 中服务端渲染的一致
+function buildMessageNode(role) {
+    const isUser = role === 'user';
+    const node = document.createElement('div');
+    node.className = `message mb-4 ${isUser ? 'text-end' : ''}`;
+    node.innerHTML = `
+        <div class="d-flex align-items-start ${isUser ? 'flex-row-reverse' : ''}">
+            <div class="avatar flex-shrink-0">
+                <div class="rounded-circle d-flex align-items-center justify-content-center ${isUser ? 'bg-primary' : 'bg-success'}"
+                    style="width: 40px; height: 40px;">
+                    <i class="bi ${isUser ? 'bi-person-fill' : 'bi-robot'} text-white"></i>
+                </div>
+            </div>
+            <div class="message-content mx-3" style="max-width: 75%;">
+                <div class="d-flex align-items-center mb-1 ${isUser ? 'justify-content-end' : ''}">
+                    <span class="badge ${isUser ? 'bg-primary' : 'bg-success'} rounded-pill px-3 py-1">${isUser ? '用户' : 'AI助手'}</span>
+                </div>
+                <div class="card border-0 rounded-3 ${isUser ? 'bg-primary text-white' : 'bg-light'}">
+                    <div class="card-body p-3">
+                        ${isUser ? '<p class="mb-0 text-white"></p>' : '<div class="ai-result-container"></div>'}
+                    </div>
+                </div>
+            </div>
+        </div>`;
+    return node;
+}
+
+function messageBody(node, role) {
+    return node.querySelector(role === 'user' ? 'p' : '.ai-result-container');
+}
+
+// 追加一条消息；返回内容容器
+function appendMessage(role) {
+    const chatMessages = document.getElementById('chatMessages');
+    const emptyState = document.getElementById('emptyState');
+    if (emptyState) emptyState.remove();
+
+    const node = buildMessageNode(role);
+    chatMessages.appendChild(node);
+    return messageBody(node, role);
+}
+
+// 加载更早的一页对话记录，插在顶部并保持当前可见位置不动
+async function loadEarlier(btn) {
+    const chatMessages = document.getElementById('chatMessages');
+    const wrapper = document.getElementById('loadEarlier');
+    btn.disabled = true;
+    try {
+        const params = new URLSearchParams({ conversation: btn.dataset.conversation, before: btn.dataset.before });
+        const res = await fetch(`${btn.dataset.url}?${params}`, { headers: { 'X-Requested-With': 'XMLHttpRequest' } });
+        const data = await res.json();
+        if (!res.ok) throw new Error(data.error || `HTTP ${res.status}`);
+
+        const fragment = document.createDocumentFragment();
+        data.messages.forEach(m => {
+            const node = buildMessageNode(m.role);
+            const body = messageBody(node, m.role);
+            if (m.role === 'user') body.textContent = m.content;
+            else renderReply(body, m.content);
+            fragment.appendChild(node);
+        });
+        const height = chatMessages.scrollHeight;
+        wrapper.after(fragment);
+        chatMessages.scrollTop += chatMessages.scrollHeight - height;
+
+        if (data.has_more && data.messages.length) {
+            btn.dataset.before = data.messages[0].id;
+            btn.disabled = false;
+        } else {
+            wrapper.remove();
+        }
+    } catch (err) {
+        console.error(err);
+        btn.disabled = false;
+        alert('加载失败：' + err.message);
+    }
+}
+
+// 最终回复：能格式化成表格就用表格，否则按原文换行显示（对应模板中的 linebreaks）
+function renderReply(container, reply) {
+    const formatted = formatAIResult(reply);
+    container.innerHTML = formatted !== reply
+        ? formatted
+        : escapeHtml(reply).replace(/\n/g, '<br>');
+}
+
+// 解析一个 SSE 事件块（event: xxx / data: {...}）
+function parseSSE(block) {
+    let event = 'message';
+    const data = [];
+    block.split('\n').forEach(line => {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data.push(line.slice(5).trim());
+    });
+    return data.length ? { event, data: JSON.parse(data.join('\n')) } : null;
+}
+
+async function streamChat(url, formData) {
+    appendMessage('user').textContent = formData.get('message') || '';
+    const container = appendMessage('assistant');
+    container.innerHTML = '<pre class="ai-stream-code mb-2"></pre><div class="ai-stream-rows"></div>';
+    const codeEl = container.querySelector('.ai-stream-code');
+    const rowsEl = container.querySelector('.ai-stream-rows');
+    let columns = [];
+    const rows = [];
+    scrollBottom();
+
+    try {
+        const res = await fetch(url, {
+            method: 'POST',
+            body: formData,
+            headers: { 'X-Requested-With': 'XMLHttpRequest', 'Accept': 'text/event-stream' }
+        });
+        if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
+
+        const reader = res.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let sep;
+            while ((sep = buffer.indexOf('\n\n')) !== -1) {
+                const msg = parseSSE(buffer.slice(0, sep));
+                buffer = buffer.slice(sep + 2);
+                if (!msg) continue;
+                if (msg.event === 'token') {
+                    // 模型输出逐段显示（代码随生成出现）
+                    codeEl.textContent += msg.data.text;
+                } else if (msg.event === 'code') {
+                    codeEl.textContent = msg.data.code;
+                } else if (msg.event === 'columns') {
+                    columns = msg.data.columns;
+                } else if (msg.event === 'rows') {
+                    rows.push(...msg.data.rows);
+                    rowsEl.innerHTML = buildColumnarTable(columns, rows);
+                } else if (msg.event === 'done') {
+                    renderReply(container, msg.data.reply);
+                }
+                scrollBottom();
+            }
+        }
+    } catch (err) {
+        console.error(err);
+        container.innerHTML = `<div class="ai-error-result mb-2 text-danger"><i class="bi bi-x-circle-fill me-1"></i>${escapeHtml('提交失败：' + err.message)}</div>`;
+    }
+}
+
 document.addEventListener('DOMContentLoaded', function () {
     applyAIFormatting();
     scrollBottom();
 
+    // 加载更多（流式回复的表格是后插入的，用事件委托）
+    const chatMessagesEl = document.getElementById('chatMessages');
+    if (chatMessagesEl) {
+        chatMessagesEl.addEventListener('click', function (e) {
+            const btn = e.target.closest('.ai-load-more');
+            if (btn) loadMore(btn);
+            const earlier = e.target.closest('#loadEarlier button');
+            if (earlier) loadEarlier(earlier);
+        });
+    }
+
     // 清空聊天
     const clearChatBtn = document.getElementById('clearChat');
     if (clearChatBtn) {
@@ -200,7 +425,7 @@ document.addEventListener('DOMContentLoaded', function () {
         });
     }
 
-    // 表单提交：保持你原逻辑（fetch -> reload）
+    // 表单提交：支持流式时走 /chat/stream/（SSE），否则保持原逻辑（fetch -> reload）
     const chatForm = document.getElementById('chatForm');
     const sendBtn = document.getElementById('sendBtn');
 
@@ -211,6 +436,15 @@ document.addEventListener('DOMContentLoaded', function () {
             if (sendBtn) sendBtn.disabled = true;
 
             const formData = new FormData(chatForm);
+            const streamUrl = chatForm.dataset.streamUrl;
+            if (streamUrl && window.ReadableStream && window.TextDecoder) {
+                const input = document.getElementById('messageInput');
+                if (input) input.value = '';
+                streamChat(streamUrl, formData).finally(() => {
+                    if (sendBtn) sendBtn.disabled = false;
+                });
+                return;
+            }
             fetch(chatForm.action || window.location.href, {
                 method: 'POST',
                 body: formData,
@@ -0,0 +1,397 @@
+"""
+AI 接口客户端：复用长连接，不再每次请求新建 TCP/TLS 连接。
+AI 对话是异步视图，每个事件循环共享一个 httpx.AsyncClient，
+并用信号量限制同时发往 AI 接口的请求数，等待模型回复期间不占用工作线程。
+
+可配置多个上游（AI_ENDPOINTS，按顺序优先）：
+- 对冲：请求超过该上游最近耗时的 AI_HEDGE_PERCENTILE 分位仍未返回，就向下一个上游再发一份，先成功的为准，其余取消；
+- 失败转移：正在进行的请求都失败后立即改用下一个上游；
+- 熔断：上游连续失败 AI_BREAKER_FAILURES 次后 AI_BREAKER_RESET 秒内不再发请求，到时放一个探测请求，成功则恢复。
+流式调用按首段文本到达的时间对冲，首段到达后就固定用这个上游。
+每个上游的请求数、错误数和耗时直方图见 /chat/llm/stats/（当前 web 进程）。
+"""
+import asyncio
+import json
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from collections import Counter, deque
+from itertools import accumulate
+
+import httpx
+from django.conf import settings
+
+AI_TIMEOUT = getattr(settings, 'AI_TIMEOUT', 30)
+# 单个进程同时发往 AI 接口的最大请求数，超出的请求在信号量上排队
+AI_MAX_CONCURRENCY = getattr(settings, 'AI_MAX_CONCURRENCY', 64)
+AI_KEEPALIVE = getattr(settings, 'AI_KEEPALIVE', 20)
+AI_HEDGE_PERCENTILE = getattr(settings, 'AI_HEDGE_PERCENTILE', 95)
+AI_HEDGE_DELAY = getattr(settings, 'AI_HEDGE_DELAY', 3)  # 秒，耗时样本不足时的对冲等待时间
+AI_HEDGE_MIN_DELAY = getattr(settings, 'AI_HEDGE_MIN_DELAY', 0.5)
+AI_HEDGE_MAX = getattr(settings, 'AI_HEDGE_MAX', 1)  # 每次调用最多额外对冲几份（失败转移不计）
+AI_BREAKER_FAILURES = getattr(settings, 'AI_BREAKER_FAILURES', 5)
+AI_BREAKER_RESET = getattr(settings, 'AI_BREAKER_RESET', 30)  # 秒
+
+LATENCY_WINDOW = 200  # 分位数按最近多少次请求计算
+MIN_SAMPLES = 20  # 样本少于此数时对冲等待 AI_HEDGE_DELAY
+BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 32)  # 耗时直方图的桶上界（秒），另有 +Inf 桶
+
+
+# ==================== 熔断与耗时 ====================
+
+class CircuitBreaker:
+    """连续失败 failures 次后打开；reset 秒后半开，只放行一个探测请求，成功则关闭，失败则重新打开"""
+
+    def __init__(self, failures=AI_BREAKER_FAILURES, reset=AI_BREAKER_RESET):
+        self.failures = failures
+        self.reset = reset
+        self.trips = 0
+        self._lock = threading.Lock()
+        self._count = 0
+        self._opened = None
+        self._probing = False
+
+    def _state(self):
+        if self._opened is None:
+            return 'closed'
+        return 'half_open' if time.monotonic() - self._opened >= self.reset else 'open'
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            return state == 'closed'
+
+    def success(self):
+        with self._lock:
+            self._count = 0
+            self._opened = None
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self._count += 1
+            if self._probing or self._count >= self.failures:
+                if self._state() != 'open':
+                    self.trips += 1
+                self._opened = time.monotonic()
+            self._probing = False
+
+    def release(self):
+        """请求被取消（对冲时没被采用），不算成功也不算失败"""
+        with self._lock:
+            self._probing = False
+
+
+class Latency:
+    """耗时直方图（累计）和最近 LATENCY_WINDOW 次的耗时（算分位数）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(BUCKETS) + 1)
+        self._recent = deque(maxlen=LATENCY_WINDOW)
+
+    def observe(self, seconds):
+        with self._lock:
+            self._counts[bisect_left(BUCKETS, seconds)] += 1
+            self._recent.append(seconds)
+
+    def percentile(self, p):
+        """最近耗时的 p 分位（秒）；样本不足 MIN_SAMPLES 时返回 None"""
+        with self._lock:
+            recent = sorted(self._recent)
+        if len(recent) < MIN_SAMPLES:
+            return None
+        return recent[min(int(len(recent) * p / 100), len(recent) - 1)]
+
+    def snapshot(self):
+        with self._lock:
+            recent = sorted(self._recent)
+            counts = list(accumulate(self._counts))
+
+        def pct(p):
+            return round(recent[min(int(len(recent) * p), len(recent) - 1)] * 1000, 1) if recent else None
+
+        return {
+            'count': counts[-1],
+            # 与 Prometheus 的 histogram 一样按上界累计
+            'buckets': {**{f'le_{b}': n for b, n in zip(BUCKETS, counts)}, 'le_inf': counts[-1]},
+            'latency_ms': {'p50': pct(0.5), 'p95': pct(0.95), 'p99': pct(0.99), 'max': pct(1)},
+        }
+
+
+# ==================== 上游 ====================
+
+class Endpoint:
+    """一个 OpenAI 兼容的上游：地址、密钥、模型，以及它的熔断器和耗时（reply 为整次回复，stream 为首段文本）"""
+
+    def __init__(self, name, base_url, api_key, model):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.model = model
+        self.breaker = CircuitBreaker()
+        self.latency = {'reply': Latency(), 'stream': Latency()}
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def request(self, messages, stream=False):
+        url = f"{self.base_url}/v1/chat/completions"
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}",
+        }
+        payload = {
+            "model": self.model,  # 比如 'deepseek-chat'
+            "messages": messages,
+        }
+        if stream:
+            payload["stream"] = True
+        return url, headers, payload
+
+    def count(self, key):
+        with self._lock:
+            self._counts[key] += 1
+
+    def succeeded(self, kind, started):
+        self.breaker.success()
+        self.latency[kind].observe(time.monotonic() - started)
+
+    def failed(self):
+        self.count('errors')
+        self.breaker.failure()
+
+    def cancelled(self):
+        self.count('cancelled')
+        self.breaker.release()
+
+    def hedge_delay(self, kind):
+        """超过这个时间（秒）还没返回就对冲"""
+        p = self.latency[kind].percentile(AI_HEDGE_PERCENTILE)
+        if p is None:
+            return AI_HEDGE_DELAY
+        return min(max(p, AI_HEDGE_MIN_DELAY), AI_TIMEOUT)
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        return {
+            'name': self.name,
+            'model': self.model,
+            'state': self.breaker.state,
+            'trips': self.breaker.trips,
+            **{key: counts.get(key, 0) for key in ('requests', 'errors', 'cancelled', 'hedges')},
+            'hedge_delay_ms': {kind: round(self.hedge_delay(kind) * 1000) for kind in self.latency},
+            'latency': {kind: latency.snapshot() for kind, latency in self.latency.items()},
+        }
+
+
+def _configured():
+    """AI_ENDPOINTS 中每项可省略 api_key / model（沿用 AI_API_KEY / AI_MODEL）；未配置时只有 AI_BASE_URL 一个上游"""
+    entries = getattr(settings, 'AI_ENDPOINTS', None) or [{'name': 'default', 'base_url': settings.AI_BASE_URL}]
+    return [
+        Endpoint(
+            name=entry.get('name') or entry['base_url'],
+            base_url=entry['base_url'],
+            api_key=entry.get('api_key', settings.AI_API_KEY),
+            model=entry.get('model', settings.AI_MODEL),
+        )
+        for entry in entries
+    ]
+
+
+ENDPOINTS = _configured()
+
+
+def stats():
+    return {
+        'endpoints': [endpoint.stats() for endpoint in ENDPOINTS],
+        'hedge': {'percentile': AI_HEDGE_PERCENTILE, 'max': AI_HEDGE_MAX},
+    }
+
+
+def _check(response):
+    """流式响应需先读出正文"""
+    if response.status_code == 401:
+        raise RuntimeError(
+            "AI接口返回 401 未认证：请检查 DeepSeek API Key 是否配置正确、是否带在 Authorization 头里。"
+        )
+    if not 200 <= response.status_code < 300:
+        raise RuntimeError(
+            f"AI接口返回非成功状态码 {response.status_code}，内容: {response.text[:200]}"
+        )
+
+
+def _reply(response):
+    _check(response)
+    return response.json()["choices"][0]["message"]["content"]
+
+
+# ==================== 调用 ====================
+
+# AsyncClient 和 Semaphore 都绑定在创建它们的事件循环上，按循环分别保存；循环结束后随之回收
+_loops = weakref.WeakKeyDictionary()
+
+
+def _async_state():
+    loop = asyncio.get_running_loop()
+    state = _loops.get(loop)
+    if state is None:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(AI_TIMEOUT, connect=10),
+            limits=httpx.Limits(
+                max_connections=AI_MAX_CONCURRENCY,
+                max_keepalive_connections=AI_KEEPALIVE,
+            ),
+        )
+        state = _loops[loop] = (client, asyncio.Semaphore(AI_MAX_CONCURRENCY))
+    return state
+
+
+async def _attempt(endpoint, kind, call):
+    endpoint.count('requests')
+    started = time.monotonic()
+    try:
+        result = await call(endpoint)
+    except asyncio.CancelledError:
+        endpoint.cancelled()
+        raise
+    except Exception:
+        endpoint.failed()
+        raise
+    endpoint.succeeded(kind, started)
+    return result
+
+
+async def _hedged(kind, call, endpoints=None, discard=None):
+    """
+    按顺序向未熔断的上游发请求，返回最先成功的结果，其余请求取消；全部失败时抛出 RuntimeError。
+    call(endpoint) 是发一次请求的协程函数；discard(result) 处理同时成功但没被采用的结果。
+    """
+    pending = iter(endpoints or ENDPOINTS)
+    running = {}
+    hedges = 0
+    error = "所有AI接口都处于熔断状态，请稍后再试"
+    latest = None  # (上游, 发出时刻)，对冲等待时间从最近发出的一份算起
+
+    def launch():
+        nonlocal latest
+        for endpoint in pending:
+            if endpoint.breaker.allow():
+                running[asyncio.ensure_future(_attempt(endpoint, kind, call))] = endpoint
+                latest = (endpoint, time.monotonic())
+                return endpoint
+        return None
+
+    launch()
+    try:
+        while running:
+            timeout = None
+            if hedges < AI_HEDGE_MAX:
+                timeout = max(latest[0].hedge_delay(kind) - (time.monotonic() - latest[1]), 0)
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                hedge = launch()
+                if hedge is None:
+                    hedges = AI_HEDGE_MAX  # 没有可用的上游了，不再对冲
+                else:
+                    hedges += 1
+                    hedge.count('hedges')
+                continue
+            results = []
+            for task in done:
+                endpoint = running.pop(task)
+                if task.exception() is None:
+                    results.append(task.result())
+                else:
+                    error = f"{endpoint.name}: {task.exception()}"
+            if results:
+                for result in results[1:]:
+                    if discard is not None:
+                        await discard(result)
+                return results[0]
+            if not running:
+                launch()
+        raise RuntimeError(f"AI调用失败: {error}")
+    finally:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+
+async def aget_ai_response(messages, endpoints=None):
+    """一次性取得完整回复（带对冲和失败转移），都失败时抛出 RuntimeError"""
+    client, semaphore = _async_state()
+
+    async def call(endpoint):
+        url, headers, payload = endpoint.request(messages)
+        async with semaphore:
+            response = await client.post(url, headers=headers, json=payload)
+        return _reply(response)
+
+    return await _hedged('reply', call, endpoints)
+
+
+async def _stream(endpoint, messages):
+    """
+    一个上游的流式调用（stream=True）：逐段产出模型生成的文本。
+    接口按 SSE 返回 `data: {...}` 行，以 `data: [DONE]` 结束；整个流式过程占用一个并发名额。
+    """
+    url, headers, payload = endpoint.request(messages, stream=True)
+    client, semaphore = _async_state()
+    async with semaphore, client.stream('POST', url, headers=headers, json=payload) as response:
+        if not 200 <= response.status_code < 300:
+            await response.aread()
+            _check(response)
+        async for line in response.aiter_lines():
+            if not line.startswith('data:'):
+                continue
+            data = line[len('data:'):].strip()
+            if data == '[DONE]':
+                break
+            delta = json.loads(data)["choices"][0].get("delta") or {}
+            if delta.get("content"):
+                yield delta["content"]
+
+
+async def astream_ai_response(messages, endpoints=None):
+    """流式调用：按首段文本到达的时间对冲和失败转移，之后逐段产出同一个上游的文本"""
+
+    async def first(endpoint):
+        chunks = _stream(endpoint, messages)
+        try:
+            return chunks, await chunks.__anext__()
+        except StopAsyncIteration:
+            return chunks, None
+        except BaseException:
+            await chunks.aclose()
+            raise
+
+    async def discard(result):
+        await result[0].aclose()
+
+    chunks, text = await _hedged('stream', first, endpoints, discard)
+    try:
+        if text is not None:
+            yield text
+        async for text in chunks:
+            yield text
+    except Exception as e:
+        raise RuntimeError(f"AI调用失败: {str(e)}")
+    finally:
+        await chunks.aclose()
+
+
+async def aclose():
+    """关闭当前事件循环上的连接池（测试或进程退出时）"""
+    state = _loops.pop(asyncio.get_running_loop(), None)
+    if state is not None:
+        await state[0].aclose()
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class XxConfig(AppConfig):
     name = 'xx'
+
+    def ready(self):
+        from . import prompt, signals  # noqa: F401
+        prompt.warm()
@@ -0,0 +1,133 @@
+"""
+按数据版本号缓存：每张业务表有一个版本号，表有写入时版本号 +1（见 signals.py），
+缓存键里带上依赖表的版本号，所以数据变化后旧缓存自然失效，不需要逐个删除。
+
+使用的缓存后端由 settings.SSIMS_CACHE 指定（CACHES 中的别名），
+默认是 settings 中配置的文件缓存，多个进程（web、runjobs）之间共享版本号。
+"""
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+TRACKED_MODELS = ('student', 'cl', 'depart', 'course', 'sc')
+DEFAULT_TIMEOUT = 600
+
+
+def get_cache():
+    return caches[getattr(settings, 'SSIMS_CACHE', 'default')]
+
+
+def _version_key(name):
+    return f'dataver:{name}'
+
+
+def data_versions(*names):
+    """一次取出多张表的版本号"""
+    cache = get_cache()
+    keys = [_version_key(name) for name in names]
+    found = cache.get_many(keys)
+    versions = []
+    for name, key in zip(names, keys):
+        version = found.get(key)
+        if version is None:
+            # 版本号被淘汰后不能从 1 重新开始，否则可能撞上旧缓存；用当前时间作为新起点
+            cache.add(key, time.time_ns(), None)
+            version = cache.get(key)
+        versions.append(version)
+    return tuple(versions)
+
+
+def data_version(name):
+    return data_versions(name)[0]
+
+
+def _bump_now(names):
+    cache = get_cache()
+    for name in names:
+        try:
+            cache.incr(_version_key(name))
+        except ValueError:
+            cache.set(_version_key(name), time.time_ns(), None)
+
+
+def bump(*names):
+    """
+    表有写入后调用，使依赖这些表的缓存全部失效。
+    在事务中时等提交后再加版本号：提交前加的话，并发请求可能读到提交前的数据并存到新版本号下，一直留到下次写入。
+    事务回滚时不加。
+    """
+    transaction.on_commit(lambda: _bump_now(names))
+
+
+def _count(name, outcome):
+    cache = get_cache()
+    key = f'cachestat:{name}:{outcome}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def make_key(*parts):
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def lookup(name, depends, key_parts=()):
+    """cached() 拆成两步：返回 (缓存键, 值)，未命中时值为 None，算出结果后调用 store()"""
+    key = f'view:{name}:{make_key(data_versions(*depends), key_parts)}'
+    value = get_cache().get(key)
+    _count(name, 'miss' if value is None else 'hit')
+    return key, value
+
+
+def store(key, value, timeout=DEFAULT_TIMEOUT):
+    get_cache().set(key, value, timeout)
+
+
+def cached(name, depends, builder, key_parts=(), timeout=DEFAULT_TIMEOUT):
+    """
+    name 用于统计命中率；depends 为依赖的表名；
+    key_parts 区分同一 name 下的不同参数（筛选条件、主键等）。
+    """
+    key, value = lookup(name, depends, key_parts)
+    if value is None:
+        value = builder()
+        store(key, value, timeout)
+    return value
+
+
+def cache_stats(names):
+    cache = get_cache()
+    keys = [f'cachestat:{name}:{outcome}' for name in names for outcome in ('hit', 'miss')]
+    found = cache.get_many(keys)
+    result = {}
+    for name in names:
+        hit = found.get(f'cachestat:{name}:hit', 0)
+        miss = found.get(f'cachestat:{name}:miss', 0)
+        total = hit + miss
+        result[name] = {'hit': hit, 'miss': miss, 'hit_rate': round(hit / total, 3) if total else None}
+    return result
+
+
+class VersionedCacheMixin:
+    """
+    视图缓存：cache_depends 为依赖的表名，cache_params 为参与缓存键的 GET 参数。
+    只缓存数据（查询结果），不缓存整页 HTML，避免把 csrf_token / 消息提示等缓存进去。
+    """
+    cache_depends = ()
+    cache_params = ()
+
+    def cache_name(self):
+        return type(self).__name__
+
+    def cached(self, builder, *key_parts):
+        params = {p: self.request.GET.get(p, '').strip() for p in self.cache_params}
+        return cached(
+            self.cache_name(), self.cache_depends, builder,
+            key_parts=(params, self.kwargs, key_parts),
+        )
@@ -0,0 +1,114 @@
+"""
+AI 助手对话记录：每条消息一行（chatmsg），只追加，不再把整段历史写回会话。
+页面只加载当前对话最近一页，更早的消息按 id 倒序分页加载；“清空对话”只是开始一个新的对话编号，旧记录保留。
+较早的助手回复会被精简：结果表格只保留前 AI_CHAT_COMPACT_ROWS 行、去掉已失效的翻页句柄，过长的文本截断。
+"""
+import json
+
+from django.conf import settings
+
+from .models import chatmsg
+
+PAGE_SIZE = getattr(settings, 'AI_CHAT_HISTORY_PAGE', 20)
+KEEP_FULL = getattr(settings, 'AI_CHAT_KEEP_FULL', 10)  # 最近多少条助手回复保持原样
+COMPACT_ROWS = getattr(settings, 'AI_CHAT_COMPACT_ROWS', 10)
+COMPACT_CHARS = getattr(settings, 'AI_CHAT_COMPACT_CHARS', 2000)
+GREETING = "你好我是你的AI助手，我可以帮助你完成查询工作！"
+
+
+async def _last_conversation(user_id):
+    return await (
+        chatmsg.objects.filter(user_id=user_id)
+        .order_by('-conversation').values_list('conversation', flat=True).afirst()
+    ) or 0
+
+
+async def current_conversation(user_id):
+    return await _last_conversation(user_id) or 1
+
+
+async def start_conversation(user_id):
+    """清空对话：开始一个新的对话，放一条问候语"""
+    await chatmsg.objects.acreate(
+        user_id=user_id, conversation=await _last_conversation(user_id) + 1, role='assistant', content=GREETING,
+    )
+
+
+async def import_session(session, user_id):
+    """旧版本把对话存在会话的 chat_messages 里：搬进 chatmsg 作为一个新对话，并从会话中删除"""
+    messages = await session.apop('chat_messages', None)
+    messages = [m for m in messages or () if m.get('role') in ('user', 'assistant')]
+    if not messages:
+        return
+    conversation = await _last_conversation(user_id) + 1
+    await chatmsg.objects.abulk_create([
+        chatmsg(user_id=user_id, conversation=conversation, role=m['role'], content=m['content'])
+        for m in messages
+    ])
+    await compact(user_id, conversation)
+
+
+async def page(user_id, conversation, before=None):
+    """对话中 id 小于 before 的最近一页消息（按时间正序）和是否还有更早的消息"""
+    queryset = chatmsg.objects.filter(user_id=user_id, conversation=conversation)
+    if before:
+        queryset = queryset.filter(id__lt=before)
+    rows = [m async for m in queryset.order_by('-id').only('id', 'role', 'content')[:PAGE_SIZE + 1]]
+    more = len(rows) > PAGE_SIZE
+    rows = rows[:PAGE_SIZE]
+    rows.reverse()
+    return rows, more
+
+
+async def append(user_id, conversation, question, reply):
+    """追加一问一答，然后精简较早的回复"""
+    await chatmsg.objects.abulk_create([
+        chatmsg(user_id=user_id, conversation=conversation, role='user', content=question),
+        chatmsg(user_id=user_id, conversation=conversation, role='assistant', content=reply),
+    ])
+    await compact(user_id, conversation)
+
+
+# ==================== 精简 ====================
+
+def _compact_table(table):
+    for key in ('rows', 'data'):
+        rows = table.get(key)
+        if isinstance(rows, list) and len(rows) > COMPACT_ROWS:
+            table.setdefault('count', len(rows))
+            table[key] = rows[:COMPACT_ROWS]
+    # 翻页句柄早已过期
+    table.pop('handle', None)
+    table.pop('next', None)
+
+
+def compact_reply(content):
+    """结果 JSON 中的表格只保留前几行；其他回复过长时截断"""
+    try:
+        steps = json.loads(content)
+    except ValueError:
+        steps = None
+    if isinstance(steps, list) and steps and all(isinstance(step, dict) for step in steps):
+        for step in steps:
+            _compact_table(step)
+            if step.get('type') == 'multi' and isinstance(step.get('data'), list):
+                for table in step['data']:
+                    if isinstance(table, dict):
+                        _compact_table(table)
+        return json.dumps(steps, ensure_ascii=False, separators=(',', ':'))
+    if len(content) > COMPACT_CHARS:
+        return content[:COMPACT_CHARS] + '\n……（较早的消息已截断）'
+    return content
+
+
+async def compact(user_id, conversation):
+    """最近 KEEP_FULL 条之前、还没精简过的助手回复逐条精简；每次追加通常只有一条新变“旧”的回复"""
+    replies = chatmsg.objects.filter(user_id=user_id, conversation=conversation, role='assistant')
+    boundary = await replies.order_by('-id').values_list('id', flat=True)[KEEP_FULL:KEEP_FULL + 1].afirst()
+    if boundary is None:
+        return
+    stale = [m async for m in replies.filter(id__lte=boundary, compacted=False)]
+    for m in stale:
+        m.content = compact_reply(m.content)
+        m.compacted = True
+    await chatmsg.objects.abulk_update(stale, ['content', 'compacted'])
@@ -0,0 +1,129 @@
+"""
+AI 助手的“问题 -> 生成代码”缓存：同一个（规范化后的）问题直接复用上次校验、执行成功的代码，不再请求大模型。
+进程内 LRU + TTL；键里带上提示词和模型结构的指纹，提示词或 xx/models.py 的字段变化后旧条目不再命中，随 LRU 淘汰。
+命中率和省下的大模型耗时由 stats() 给出（见 CacheStatsView）。
+"""
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.apps import apps
+from django.conf import settings
+
+from .prompt import SCHEMA_MODELS
+
+CODE_CACHE_SIZE = getattr(settings, 'AI_CODE_CACHE_SIZE', 512)
+CODE_CACHE_TTL = getattr(settings, 'AI_CODE_CACHE_TTL', 3600)  # 秒
+
+
+def normalize_query(text):
+    """全角转半角、统一大小写、合并空白、去掉句末标点：“查询所有男生？” 与 “查询所有男生” 视为同一问题"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text.rstrip('?？。.!！~ ')
+
+
+@lru_cache(maxsize=1)
+def schema_signature():
+    """AI 可用模型的字段、类型和取值范围；字段有增删改时变化"""
+    parts = []
+    for name in SCHEMA_MODELS:
+        meta = apps.get_model('xx', name)._meta
+        for field in meta.get_fields():
+            parts.append('|'.join(map(str, (
+                name, field.name, type(field).__name__,
+                getattr(field, 'related_model', None) and field.related_model._meta.model_name,
+                getattr(field, 'choices', None),
+            ))))
+    return '\n'.join(parts)
+
+
+@lru_cache(maxsize=8)
+def fingerprint(prompt):
+    return hashlib.sha1(f'{prompt}\n{schema_signature()}'.encode('utf-8')).hexdigest()[:16]
+
+
+class CodeCache:
+    def __init__(self, capacity=CODE_CACHE_SIZE, ttl=CODE_CACHE_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._entries = OrderedDict()  # 键 -> (代码, 过期时间)
+        # 事件循环线程和线程池里的执行线程都会访问
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self.llm_calls = 0
+        self.llm_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def _key(self, prompt, query):
+        return fingerprint(prompt), normalize_query(query)
+
+    def get(self, prompt, query):
+        """命中返回代码，否则 None"""
+        key = self._key(prompt, query)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= now:
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            # 省下的时间按目前观测到的大模型平均耗时估算
+            if self.llm_calls:
+                self.saved_seconds += self.llm_seconds / self.llm_calls
+            return entry[0]
+
+    def put(self, prompt, query, code):
+        """只应放入校验并执行成功的代码"""
+        key = self._key(prompt, query)
+        with self._lock:
+            self._entries[key] = (code, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, prompt, query):
+        """命中的代码执行出错（例如数据结构已变）时移除"""
+        with self._lock:
+            self._entries.pop(self._key(prompt, query), None)
+
+    def record_llm(self, seconds):
+        with self._lock:
+            self.llm_calls += 1
+            self.llm_seconds += seconds
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'capacity': self.capacity,
+                'ttl': self.ttl,
+                'hit': self.hits,
+                'miss': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else None,
+                'evictions': self.evictions,
+                'expired': self.expired,
+                'avg_llm_ms': round(self.llm_seconds / self.llm_calls * 1000, 1) if self.llm_calls else None,
+                'saved_ms': round(self.saved_seconds * 1000, 1),
+            }
+
+
+code_cache = CodeCache()
@@ -0,0 +1,90 @@
+"""
+AI 助手查询结果的列式格式：{'columns': [列名, ...], 'rows': [[值, ...], ...]}，列名只出现一次。
+查询集改用 values_list 直接从数据库游标取元组，不实例化模型、不逐行建字典；
+日期、Decimal 等非 JSON 类型不预先遍历转换，只在最后 dumps 时由 default 钩子逐个处理，一次编码完成。
+"""
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.db import models
+from django.db.models.query import (
+    FlatValuesListIterable, ModelIterable, NamedValuesListIterable, QuerySet, ValuesIterable, ValuesListIterable,
+)
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+DATE_FORMAT = '%Y-%m-%d'
+VALUES_ITERABLES = (ValuesIterable, ValuesListIterable, FlatValuesListIterable, NamedValuesListIterable)
+
+
+def _model_columns(model):
+    return [f.attname for f in model._meta.concrete_fields]
+
+
+def tuples(queryset):
+    """
+    返回 (列名, 产出元组的查询集)。
+    values() / values_list() 沿用原来的字段，只换成按元组取；模型查询集取全部字段和 annotate 的列。
+    """
+    query = queryset.query
+    if queryset._iterable_class is ModelIterable:
+        columns = [*_model_columns(queryset.model), *query.annotation_select]
+        return columns, queryset.values_list(*columns)
+    if queryset._fields:
+        # 与 ValuesListIterable 的列顺序一致
+        columns = [*queryset._fields, *(f for f in query.annotation_select if f not in queryset._fields)]
+    else:
+        columns = [*query.extra_select, *query.values_select, *query.annotation_select]
+    queryset = queryset._chain()
+    queryset._iterable_class = ValuesListIterable
+    return columns, queryset
+
+
+def supports(queryset):
+    return queryset._iterable_class is ModelIterable or queryset._iterable_class in VALUES_ITERABLES
+
+
+def from_queryset(queryset):
+    columns, rows = tuples(queryset)
+    return {'columns': columns, 'rows': list(rows)}
+
+
+def from_records(records):
+    """字典或模型实例组成、且各行字段相同的列表转成列式，否则返回 None"""
+    if not records or not isinstance(records, (list, tuple)):
+        return None
+    first = records[0]
+    if isinstance(first, models.Model):
+        model = type(first)
+        if not all(type(r) is model for r in records):
+            return None
+        columns = _model_columns(model)
+        # annotate 出来的属性也在 __dict__ 里
+        columns += [k for k in first.__dict__ if not k.startswith('_') and k not in columns]
+        return {'columns': columns, 'rows': [[getattr(r, c, None) for c in columns] for r in records]}
+    if isinstance(first, dict):
+        columns = list(first)
+        if not all(isinstance(r, dict) and len(r) == len(columns) and all(c in r for c in columns) for r in records):
+            return None
+        return {'columns': columns, 'rows': [[r[c] for c in columns] for r in records]}
+    return None
+
+
+def _default(obj):
+    if isinstance(obj, datetime):
+        return obj.strftime(DATETIME_FORMAT)
+    if isinstance(obj, date):
+        return obj.strftime(DATE_FORMAT)
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, models.Model):
+        return {k: v for k, v in obj.__dict__.items() if not k.startswith('_')}
+    if isinstance(obj, QuerySet):
+        return list(obj[:100])
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    return str(obj)
+
+
+def dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, default=_default, separators=(',', ':'))
@@ -0,0 +1,109 @@
+"""
+整班 / 整系批量选课：按学生分块，每块一条 INSERT ... SELECT 把 学生 × 课程 中缺少的组合直接在数据库里插入，
+不在 Python 里逐个构造 sc 对象；插入语句带上后端的“冲突忽略”写法（与 bulk_create(ignore_conflicts=True) 相同），
+并发选课撞上 (sno, cno) 唯一约束时跳过而不是报错。整个操作在一个事务里完成。
+后端支持 RETURNING 时，统计增量按语句实际插入的行计算，不依赖插入前的快照。
+"""
+import time
+
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.db.models.constants import OnConflict
+
+from .models import course, sc, student
+from .signals import sc_bulk_added
+
+STUDENT_CHUNK_SIZE = 1000
+
+
+class EnrollResult:
+    def __init__(self):
+        self.students = 0
+        self.courses = 0
+        self.inserted = 0
+        self.skipped = 0
+        self.elapsed = 0.0
+
+    def as_dict(self):
+        return {
+            'students': self.students,
+            'courses': self.courses,
+            'pairs': self.inserted + self.skipped,
+            'inserted': self.inserted,
+            'skipped': self.skipped,
+            'elapsed_ms': round(self.elapsed * 1000, 1),
+        }
+
+
+def target_students(classnos=(), dnos=()):
+    """选中班级的学生 + 选中系部下所有班级的学生"""
+    return student.objects.filter(Q(classno_id__in=classnos) | Q(classno__dno_id__in=dnos))
+
+
+def _insert_sql(n_students, n_courses, returning=False):
+    qn = connection.ops.quote_name
+    sc_table, stu_table, course_table = sc._meta.db_table, student._meta.db_table, course._meta.db_table
+    sno_col, cno_col = sc._meta.get_field('sno').column, sc._meta.get_field('cno').column
+    stu_pk, course_pk = student._meta.pk.column, course._meta.pk.column
+    marks = lambda n: ', '.join(['%s'] * n)
+    return (
+        f'{connection.ops.insert_statement(on_conflict=OnConflict.IGNORE)} {qn(sc_table)} ({qn(sno_col)}, {qn(cno_col)}) '
+        f'SELECT s.{qn(stu_pk)}, c.{qn(course_pk)} FROM {qn(stu_table)} s CROSS JOIN {qn(course_table)} c '
+        f'WHERE s.{qn(stu_pk)} IN ({marks(n_students)}) AND c.{qn(course_pk)} IN ({marks(n_courses)}) '
+        f'AND NOT EXISTS (SELECT 1 FROM {qn(sc_table)} x '
+        f'WHERE x.{qn(sno_col)} = s.{qn(stu_pk)} AND x.{qn(cno_col)} = c.{qn(course_pk)}) '
+        + connection.ops.on_conflict_suffix_sql(None, OnConflict.IGNORE, None, None)
+        + (f' RETURNING {qn(sno_col)}, {qn(cno_col)}' if returning else '')
+    )
+
+
+def enroll(classnos=(), dnos=(), cnos=()):
+    """为选中班级 / 系部的全部学生选上 cnos 中的全部课程，已选的组合跳过"""
+    started = time.perf_counter()
+    result = EnrollResult()
+    cnos = list(course.objects.filter(cno__in=cnos).values_list('cno', flat=True))
+    result.courses = len(cnos)
+
+    snos = target_students(classnos, dnos).order_by('sno').values_list('sno', flat=True)
+    with transaction.atomic():
+        chunk = []
+        for sno in snos.iterator(chunk_size=STUDENT_CHUNK_SIZE):
+            chunk.append(sno)
+            if len(chunk) >= STUDENT_CHUNK_SIZE:
+                _enroll_chunk(chunk, cnos, result)
+                chunk = []
+        if chunk:
+            _enroll_chunk(chunk, cnos, result)
+
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def _enroll_chunk(snos, cnos, result):
+    result.students += len(snos)
+    if not cnos:
+        return
+    # 按学号顺序锁住这批学生：并发的批量选课对同一批人排队执行，不会互相把对方插入的行算成自己的
+    list(student.objects.select_for_update().filter(sno__in=snos).order_by('sno').values_list('sno', flat=True))
+    returning = connection.features.can_return_rows_from_bulk_insert
+    if not returning:
+        # 不支持 RETURNING 的后端：插入前读出这批学生已有的选课，差集即新增
+        existing = set(sc.objects.filter(sno_id__in=snos).values_list('sno_id', 'cno_id'))
+    with connection.cursor() as cursor:
+        cursor.execute(_insert_sql(len(snos), len(cnos), returning), [*snos, *cnos])
+        if returning:
+            rows = cursor.fetchall()
+            inserted = len(rows)
+        else:
+            rows = [(sno, cno) for sno in snos for cno in cnos if (sno, cno) not in existing]
+            inserted = cursor.rowcount
+    added = {}
+    for sno, cno in rows:
+        added.setdefault(sno, []).append(cno)
+    if added:
+        # 与 stats.sc_added 同一判据：插入后该生的选课数等于本次新增数，即第一次选课
+        counts = sc.objects.filter(sno_id__in=added).order_by().values_list('sno_id').annotate(n=Count('id'))
+        first = [sno for sno, n in counts if n == len(added[sno])]
+        sc_bulk_added({sno: tuple(new) for sno, new in added.items()}, first)
+    result.inserted += inserted
+    result.skipped += len(snos) * len(cnos) - inserted
@@ -0,0 +1,89 @@
+"""
+学生列表筛选统计（分面计数）：一次条件聚合查询得到总数、男女人数、涉及的班级数以及系部 / 学期分布，
+结果按规范化后的筛选条件缓存，student 表有写入时通过版本号整体失效（见 cache.py）。
+"""
+import hashlib
+import json
+
+from django.db.models import Count, Q
+
+from .cache import data_versions, get_cache
+from .models import cl
+
+FACET_TIMEOUT = 300
+FACET_FIELDS = ('sno', 'sname', 'sex', 'classno')
+
+
+def filter_signature(params):
+    """把筛选参数规范化成稳定的签名：去空白、忽略空值，模糊匹配字段不区分大小写"""
+    normalized = {}
+    for name in FACET_FIELDS:
+        value = (params.get(name) or '').strip()
+        if not value:
+            continue
+        if name in ('sno', 'sname'):
+            value = value.casefold()
+        normalized[name] = value
+    raw = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def class_options():
+    """班级下拉框及 班级 -> 系部 映射，cl / depart 不变时不再查库"""
+    cache = get_cache()
+    key = 'facets:classes:{}:{}'.format(*data_versions('cl', 'depart'))
+    options = cache.get(key)
+    if options is None:
+        options = list(
+            cl.objects.order_by('classno').values('classno', 'classname', 'dno_id', 'dno__dname')
+        )
+        cache.set(key, options, FACET_TIMEOUT)
+    return options
+
+
+def _compute(queryset):
+    # 按 (班级, 学期) 分组，组内用条件聚合区分男女；系部由缓存的班级映射换算，其余维度在内存里汇总
+    rows = queryset.order_by().values('classno_id', 'semester').annotate(
+        boy=Count('sno', filter=Q(sex='boy')),
+        girl=Count('sno', filter=Q(sex='girl')),
+        total=Count('sno'),
+    )
+    depart_of = {c['classno']: (c['dno_id'], c['dno__dname']) for c in class_options()}
+
+    facets = {'total': 0, 'sex': {'boy': 0, 'girl': 0}, 'departs': {}, 'semesters': {}}
+    classes = set()
+    for row in rows:
+        total = row['total']
+        facets['total'] += total
+        facets['sex']['boy'] += row['boy']
+        facets['sex']['girl'] += row['girl']
+        classes.add(row['classno_id'])
+
+        dno, dname = depart_of.get(row['classno_id'], (None, None))
+        dep = facets['departs'].setdefault(dno, {'dname': dname, 'count': 0})
+        dep['count'] += total
+
+        semester = row['semester']
+        facets['semesters'][semester] = facets['semesters'].get(semester, 0) + total
+
+    facets['class_count'] = len(classes)
+    # 页面按人数从多到少列系部、按学期先后列学期（未填的排最后）
+    facets['departs'] = dict(sorted(facets['departs'].items(), key=lambda item: -item[1]['count']))
+    facets['semesters'] = dict(
+        sorted(facets['semesters'].items(), key=lambda item: (item[0] is None, item[0] or 0))
+    )
+    return facets
+
+
+def student_facets(queryset, params):
+    """queryset 为已按 params 筛选的学生查询集"""
+    # 系部名称来自班级映射，所以 cl / depart 的版本号也参与缓存键
+    cache = get_cache()
+    key = 'facets:student:{}:{}:{}:{}'.format(
+        *data_versions('student', 'cl', 'depart'), filter_signature(params)
+    )
+    facets = cache.get(key)
+    if facets is None:
+        facets = _compute(queryset)
+        cache.set(key, facets, FACET_TIMEOUT)
+    return facets
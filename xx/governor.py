@@ -0,0 +1,256 @@
+"""
+AI 生成查询的代价控制：
+- 生成代码执行期间，每条 SELECT 先 EXPLAIN，估计扫描行数超过 AI_QUERY_MAX_COST 的直接拒绝；
+- 代码里求值的查询集（list()、len()、遍历、iterator() 等）自动加 LIMIT，超过 AI_QUERY_MAX_ROWS 行时报错，
+  不静默截断（否则 len()、求和、平均等结果是错的）；作为 result 返回的查询集分页显示，不受此限；
+- AI 代码拿不到模型上以下划线开头的属性（_default_manager、_base_manager 等），绕不过上面的限制；
+- count() 的代价估计超过 AI_COUNT_EXACT_MAX 行时只数到这个上限，结果标记为不精确。
+每个决定都写日志（logger: xx.governor）。
+"""
+import contextlib
+import json
+import logging
+import re
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import QuerySet
+from django.db.models.manager import BaseManager
+
+logger = logging.getLogger(__name__)
+
+MAX_COST = getattr(settings, 'AI_QUERY_MAX_COST', 10_000_000)  # 估计扫描行数上限
+MAX_ROWS = getattr(settings, 'AI_QUERY_MAX_ROWS', 1000)
+COUNT_EXACT_MAX = getattr(settings, 'AI_COUNT_EXACT_MAX', 1_000_000)
+TABLE_ROWS_TTL = 60
+
+
+class QueryCostError(Exception):
+    """估计代价超过上限、或代码中求值的行数超过上限，查询被拒绝"""
+
+
+# ==================== 代价估计 ====================
+
+_table_rows = {}
+
+
+def _sqlite_table_rows(cursor, table):
+    cached = _table_rows.get(table)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    # rowid 表的 MAX(rowid) 只读 B 树最右端，近似行数
+    cursor.execute(f'SELECT MAX(rowid) FROM {connection.ops.quote_name(table)}')
+    rows = cursor.fetchone()[0] or 0
+    _table_rows[table] = (rows, time.monotonic() + TABLE_ROWS_TTL)
+    return rows
+
+
+def _sqlite_loop_rows(cursor, detail, aliases):
+    """
+    EXPLAIN QUERY PLAN 中一行 SCAN / SEARCH 的估计行数，假设与 SQLite 查询规划器一致：
+    全表 / 全索引扫描为表行数，主键或唯一索引等值为 1，普通索引等值为 10，范围条件每个边界缩小 4 倍；
+    自动索引另算（见下）。
+    """
+    m = re.match(r'(SCAN|SEARCH) (\w+)', detail)
+    table = aliases.get(m.group(2), m.group(2))
+    rows = _sqlite_table_rows(cursor, table)
+    if m.group(1) == 'SCAN':
+        return rows
+    if 'INTEGER PRIMARY KEY' in detail:
+        return 1
+    cond = re.search(r'\((.*)\)$', detail)
+    cond = cond.group(1) if cond else ''
+    ranges = len(re.findall(r'[<>]', cond))
+    if '=' in cond.replace('<=', '').replace('>=', '') and 'sqlite_autoindex' in detail and not ranges:
+        return 1
+    if ranges:
+        return max(rows // (4 ** ranges), 1)
+    if 'AUTOMATIC' in detail:
+        # 临时自动索引建在没有索引的列上（如籍贯、家庭住址），重复值多，按每次命中 1/10 的行估计
+        return max(rows // 10, 1)
+    return 10
+
+
+def _sqlite_cost(cursor, sql, params):
+    # 计划里出现的是别名（U0、T3 等），换回表名
+    aliases = {
+        alias: table
+        for table, alias in re.findall(r'(?:FROM|JOIN|,)\s+"?(\w+)"?\s+(?:AS\s+)?"?(\w+)"?', sql, re.IGNORECASE)
+    }
+    cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+    children = {}
+    derived = set()  # FROM 子句里的子查询，扫描它们不读表，代价算在子查询节点上
+    for node, parent, _, detail in cursor.fetchall():
+        children.setdefault(parent, []).append((node, detail))
+        if detail.startswith(('CO-ROUTINE ', 'MATERIALIZE ')):
+            derived.add(detail.split(' ', 1)[1])
+
+    def cost(parent):
+        loops = 1
+        extra = 0
+        for node, detail in children.get(parent, ()):
+            if detail.startswith(('SCAN ', 'SEARCH ')) and not detail.startswith('SCAN CONSTANT'):
+                if detail.split()[1] not in derived:
+                    loops *= _sqlite_loop_rows(cursor, detail, aliases)
+            elif node in children:
+                # 子查询：关联子查询对外层每行执行一次，其余只执行一次
+                sub = cost(node)
+                extra += sub * loops if 'CORRELATED' in detail else sub
+        return loops + extra
+
+    return cost(0)
+
+
+def _mysql_cost(cursor, sql, params):
+    cursor.execute(f'EXPLAIN {sql}', params)
+    columns = [c[0] for c in cursor.description]
+    selects = {}
+    for row in cursor.fetchall():
+        row = dict(zip(columns, row))
+        selects[row['id']] = selects.get(row['id'], 1) * (row['rows'] or 1)
+    return sum(selects.values())
+
+
+def _postgresql_cost(cursor, sql, params):
+    cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    def scanned(node):
+        own = node.get('Plan Rows', 0) if node.get('Node Type', '').endswith('Scan') else 0
+        return own + sum(scanned(child) for child in node.get('Plans', ()))
+
+    return scanned(plan[0]['Plan'])
+
+
+def estimate(sql, params):
+    """估计一条 SELECT 需要扫描的行数；不支持的数据库返回 None"""
+    handler = {
+        'sqlite': _sqlite_cost,
+        'mysql': _mysql_cost,
+        'postgresql': _postgresql_cost,
+    }.get(connection.vendor)
+    if handler is None:
+        return None
+    with connection.cursor() as cursor:
+        return int(handler(cursor, sql, params))
+
+
+def _short(sql):
+    return sql if len(sql) <= 300 else sql[:300] + '...'
+
+
+# ==================== 执行期间的检查 ====================
+
+class CostGuard:
+    """connection.execute_wrapper：每条 SELECT 执行前先估计代价"""
+
+    def __init__(self):
+        self._estimating = False
+
+    def __call__(self, execute, sql, params, many, context):
+        # 估计本身执行的查询（EXPLAIN、表行数）不再检查
+        if not many and not self._estimating and sql.lstrip()[:6].upper() == 'SELECT':
+            self._estimating = True
+            try:
+                cost = estimate(sql, params or ())
+            finally:
+                self._estimating = False
+            if cost is not None and cost > MAX_COST:
+                logger.warning('reject cost=%s limit=%s sql=%s', cost, MAX_COST, _short(sql))
+                raise QueryCostError(f'查询代价过高（估计需扫描约 {cost} 行，上限 {MAX_COST}），请增加筛选条件')
+            logger.info('allow cost=%s sql=%s', cost, _short(sql))
+        return execute(sql, params, many, context)
+
+
+@contextlib.contextmanager
+def guard():
+    with connection.execute_wrapper(CostGuard()):
+        yield
+
+
+def count(queryset):
+    """
+    返回 (数量, 是否精确)。估计扫描行数不超过 AI_COUNT_EXACT_MAX 时直接 COUNT；
+    否则只数到 AI_COUNT_EXACT_MAX 行（COUNT 套 LIMIT 子查询），数满时返回这个下限并标记为不精确。
+    """
+    queryset = queryset.order_by()
+    sql, params = queryset.query.sql_with_params()
+    cost = estimate(sql, params)
+    if cost is None or cost <= COUNT_EXACT_MAX or queryset.query.is_sliced:
+        return QuerySet.count(queryset), True
+    total = QuerySet.count(queryset[:COUNT_EXACT_MAX])
+    if total < COUNT_EXACT_MAX:
+        return total, True
+    logger.info('approximate count>=%s cost=%s sql=%s', total, cost, _short(sql))
+    return total, False
+
+
+def _too_many(model):
+    logger.warning('reject rows>%s model=%s', MAX_ROWS, model._meta.model_name)
+    return QueryCostError(
+        f'查询结果超过 {MAX_ROWS} 行：统计数量、总和、平均值请用 count() / aggregate() / annotate() 在数据库中计算；'
+        f'列出数据请直接把查询集赋给 result（分页显示），或增加筛选条件'
+    )
+
+
+class GovernedQuerySet(QuerySet):
+    """AI 代码中使用的查询集：求值时自动加 LIMIT，超过 MAX_ROWS 行时报错；count() 走代价判断"""
+
+    def _fetch_all(self):
+        if self._result_cache is None:
+            # 在副本上加 LIMIT（已切片的在切片范围内再限制，set_limits 取两者较小的上界）：
+            # 原查询集求值后还可能作为 result 返回，不能被切片，否则分页只能退回 OFFSET
+            limited = self._chain()
+            limited.query.set_limits(high=MAX_ROWS + 1)
+            QuerySet._fetch_all(limited)
+            if len(limited._result_cache) > MAX_ROWS:
+                raise _too_many(self.model)
+            self._result_cache = limited._result_cache
+            self._prefetch_done = limited._prefetch_done
+            return
+        super()._fetch_all()
+
+    def iterator(self, chunk_size=None):
+        queryset = self._chain()
+        queryset.query.set_limits(high=MAX_ROWS + 1)
+        for i, row in enumerate(QuerySet.iterator(queryset, chunk_size)):
+            if i == MAX_ROWS:
+                raise _too_many(self.model)
+            yield row
+
+    def __bool__(self):
+        # if 查询集：只判断有没有，不取出全部行
+        if self._result_cache is None:
+            return self.exists()
+        return bool(self._result_cache)
+
+    def count(self):
+        if self._result_cache is not None:
+            return len(self._result_cache)
+        return count(self)[0]
+
+
+class _Model:
+    """提供给 AI 代码的模型替身：objects 返回 GovernedQuerySet，其余公开属性转给真实模型"""
+
+    def __init__(self, model):
+        self._model = model
+        self.objects = BaseManager.from_queryset(GovernedQuerySet)()
+        self.objects.model = model
+        self.objects.name = 'objects'
+
+    def __getattr__(self, name):
+        # _default_manager / _base_manager 等真实管理器返回普通查询集，不受行数限制
+        if name.startswith('_'):
+            raise AttributeError(f'AI 代码不能访问模型属性 {name}')
+        value = getattr(self._model, name)
+        if isinstance(value, BaseManager):
+            raise AttributeError(f'AI 代码不能访问模型属性 {name}')
+        return value
+
+
+def governed(model):
+    return _Model(model)
@@ -0,0 +1,176 @@
+"""
+整门课批量录入成绩：网格表单 / CSV / XLSX / JSON 统一转成 (位置, 学号, 成绩) 列表，
+先在内存里逐条校验，再用一次 bulk_update 在同一事务中写入，返回逐条错误和耗时。
+"""
+import csv
+import io
+import json
+import math
+import time
+
+from django.db import transaction
+from openpyxl import load_workbook
+
+from .models import sc
+from .signals import sc_bulk_regraded
+
+GRADE_MIN = 0
+GRADE_MAX = 100
+UPDATE_BATCH_SIZE = 500
+HEADER_ALIASES = {'sno': 'sno', '学号': 'sno', 'grade': 'grade', '成绩': 'grade'}
+
+
+class GradeFormatError(Exception):
+    """表头、JSON 结构等整体格式问题，整份数据不录入"""
+
+
+class GradeEntryResult:
+    def __init__(self):
+        self.updated = 0
+        self.unchanged = 0
+        self.errors = []
+        self.elapsed = 0.0
+
+    def as_dict(self):
+        return {
+            'updated': self.updated,
+            'unchanged': self.unchanged,
+            'error_count': len(self.errors),
+            'errors': self.errors,
+            'elapsed_ms': round(self.elapsed * 1000, 1),
+        }
+
+
+def _sno(value):
+    if value is None:
+        return ''
+    # Excel 中的纯数字学号会被读成 float
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _grade(value):
+    if value is None or (isinstance(value, str) and not value.strip()):
+        raise ValueError('成绩不能为空')
+    if isinstance(value, bool):
+        raise ValueError('成绩必须是数字')
+    try:
+        grade = float(value)
+    except (TypeError, ValueError):
+        raise ValueError('成绩必须是数字')
+    if math.isnan(grade) or not GRADE_MIN <= grade <= GRADE_MAX:
+        raise ValueError(f'成绩必须在{GRADE_MIN}-{GRADE_MAX}之间')
+    return grade
+
+
+# ==================== 输入解析 ====================
+
+def _table_entries(rows):
+    """rows 第一行为表头，需包含 sno/学号 和 grade/成绩 两列"""
+    headers = [HEADER_ALIASES.get(str(h).strip().lower()) if h is not None else None for h in next(rows, ())]
+    if 'sno' not in headers or 'grade' not in headers:
+        raise GradeFormatError('表头应包含 sno（学号）和 grade（成绩）两列')
+    sno_col, grade_col = headers.index('sno'), headers.index('grade')
+
+    entries = []
+    for line, row in enumerate(rows, start=2):
+        row = list(row)
+        sno = row[sno_col] if sno_col < len(row) else None
+        grade = row[grade_col] if grade_col < len(row) else None
+        # 跳过空行
+        if _sno(sno) == '' and _sno(grade) == '':
+            continue
+        entries.append((f'第{line}行', sno, grade))
+    return entries
+
+
+def read_csv(file):
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    try:
+        return _table_entries(csv.reader(text))
+    except UnicodeDecodeError:
+        raise GradeFormatError('CSV 文件须为 UTF-8 编码')
+    finally:
+        text.detach()
+
+
+def read_xlsx(file):
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        return _table_entries(wb.active.iter_rows(values_only=True))
+    finally:
+        wb.close()
+
+
+def read_upload(file):
+    name = file.name.lower()
+    if name.endswith('.csv'):
+        return read_csv(file)
+    if name.endswith('.xlsx'):
+        return read_xlsx(file)
+    raise GradeFormatError('仅支持 .csv 或 .xlsx 文件')
+
+
+def read_json(body):
+    """[{"sno": ..., "grade": ...}, ...] 或 {"grades": [...]}"""
+    try:
+        data = json.loads(body)
+    except (ValueError, UnicodeDecodeError):
+        raise GradeFormatError('JSON 格式错误')
+    if isinstance(data, dict):
+        data = data.get('grades')
+    if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+        raise GradeFormatError('JSON 应为 [{"sno": ..., "grade": ...}] 或 {"grades": [...]}')
+    return [(f'第{i}条', item.get('sno'), item.get('grade')) for i, item in enumerate(data, start=1)]
+
+
+def read_grid(post):
+    """网格表单：每个学生一个 grade_<学号> 输入框，留空表示不修改"""
+    return [
+        ('网格', key[len('grade_'):], value)
+        for key, value in post.items()
+        if key.startswith('grade_') and value.strip()
+    ]
+
+
+# ==================== 校验与写入 ====================
+
+def apply_grades(course_obj, entries):
+    """校验全部条目，合法且有变化的一次 bulk_update；不合法的逐条记入 errors"""
+    started = time.perf_counter()
+    result = GradeEntryResult()
+    records = {r.sno_id: r for r in sc.objects.filter(cno=course_obj).only('id', 'sno_id', 'cno_id', 'grade')}
+
+    seen = set()
+    changed = []
+    changes = []
+    for where, raw_sno, raw_grade in entries:
+        sno = _sno(raw_sno)
+        try:
+            if not sno:
+                raise ValueError('学号不能为空')
+            if sno in seen:
+                raise ValueError('学号重复')
+            record = records.get(sno)
+            if record is None:
+                raise ValueError('该生未选此课程')
+            grade = _grade(raw_grade)
+        except ValueError as e:
+            result.errors.append(f"{where}（学号 {sno or '未知'}）：{e}")
+            continue
+        seen.add(sno)
+        if record.grade == grade:
+            result.unchanged += 1
+            continue
+        changes.append((record.grade, grade))
+        record.grade = grade
+        changed.append(record)
+
+    if changed:
+        with transaction.atomic():
+            sc.objects.bulk_update(changed, ['grade'], batch_size=UPDATE_BATCH_SIZE)
+            sc_bulk_regraded([r.sno_id for r in changed], changes)
+    result.updated = len(changed)
+    result.elapsed = time.perf_counter() - started
+    return result
@@ -0,0 +1,99 @@
+"""
+成绩分布统计：成绩只从数据库读一次，在内存里一次算出分段人数、均值、标准差、中位数和 P90，
+不再对同一批选课记录分别 count() 多次。CourseStudentsView 和多课程统计接口共用。
+"""
+import math
+from bisect import bisect_left
+from itertools import groupby
+
+from .models import course, sc
+
+# 分段：(键, 下限)，下限含、上一段的下限为本段上限（不含）；下限为 None 表示“低于上一段”
+GRADE_BUCKETS = (
+    ('excellent', 90),
+    ('good', 80),
+    ('passed', 60),
+    ('failed', None),
+)
+
+
+def make_buckets(edges):
+    """由分数线生成分段，例如 [90, 75, 60] -> ≥90、75-90、60-75、<60"""
+    edges = sorted({float(e) for e in edges}, reverse=True)
+    if not edges:
+        raise ValueError('至少需要一条分数线')
+    buckets = [(f'>={edges[0]:g}', edges[0])]
+    buckets += [(f'{lower:g}-{upper:g}', lower) for upper, lower in zip(edges, edges[1:])]
+    buckets.append((f'<{edges[-1]:g}', None))
+    return tuple(buckets)
+
+
+def percentile(values, p):
+    """values 已升序；线性插值，与 numpy.percentile 默认算法一致"""
+    if not values:
+        return None
+    pos = (len(values) - 1) * p
+    lo = math.floor(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+def _round(value, digits=1):
+    return None if value is None else round(value, digits)
+
+
+def distribution(grades, buckets=GRADE_BUCKETS):
+    """grades 为一门课的全部成绩（None 表示未录入），返回统计结果 dict"""
+    total = 0
+    values = []
+    for grade in grades:
+        total += 1
+        if grade is not None:
+            values.append(grade)
+    values.sort()
+    n = len(values)
+
+    counts = {}
+    upper_count = 0  # 高于当前段的人数
+    for key, lower in buckets:
+        at_least = n - bisect_left(values, lower) if lower is not None else n
+        counts[key] = at_least - upper_count
+        upper_count = at_least
+
+    avg = std = None
+    if n:
+        avg = math.fsum(values) / n
+        std = math.sqrt(math.fsum((v - avg) ** 2 for v in values) / n)
+
+    return {
+        'total': total,
+        'graded': n,
+        'avg': _round(avg),
+        'std': _round(std, 2),
+        'min': values[0] if n else None,
+        'max': values[-1] if n else None,
+        'median': _round(percentile(values, 0.5)),
+        'p90': _round(percentile(values, 0.9)),
+        'counts': counts,
+    }
+
+
+def course_distributions(cnos=None, buckets=GRADE_BUCKETS):
+    """
+    多门课程的成绩分布，cnos 为空时统计全部课程。
+    按 (cno, grade) 索引顺序读出 (课程号, 成绩)，整批只查一次 sc。
+    """
+    courses = course.objects.order_by('cno')
+    rows = sc.objects.order_by('cno_id', 'grade').values_list('cno_id', 'grade')
+    if cnos:
+        courses = courses.filter(cno__in=cnos)
+        rows = rows.filter(cno_id__in=cnos)
+
+    result = {
+        cno: {'cname': cname, **distribution((), buckets)}
+        for cno, cname in courses.values_list('cno', 'cname')
+    }
+    for cno, group in groupby(rows.iterator(chunk_size=5000), key=lambda row: row[0]):
+        if cno in result:
+            result[cno].update(distribution((grade for _, grade in group), buckets))
+    return result
@@ -0,0 +1,227 @@
+"""
+AI 助手的规则快速通道：常见的模板化问题（按性别 / 班级 / 系部筛选学生、各班人数、各课程平均分、某个学生的选课等）
+用正则识别，直接编译成与大模型输出同样形式的只读 ORM 代码（`result = ...`），仍交给 AICodeExecutor 校验执行。
+没有匹配的问题才请求大模型。用户输入只以字面量（repr）进入代码。
+生成代码的函数返回 None 表示这条规则不适用（如课程不存在），继续尝试后面的规则，都不适用时交给大模型。
+"""
+import re
+import threading
+from collections import Counter
+
+from django.db.models import Q
+
+from .code_cache import normalize_query
+from .models import course
+
+STUDENT_FIELDS = ('sno', 'sname', 'sex', 'age', 'native', 'classno__classname', 'semester')
+SEX = {'男': 'boy', '女': 'girl'}
+COMPARE = {
+    '大于': 'gt', '超过': 'gt', '高于': 'gt', '以上': 'gte', '不小于': 'gte',
+    '小于': 'lt', '低于': 'lt', '以下': 'lte', '不大于': 'lte', '等于': 'exact', '为': 'exact',
+}
+
+# 不含“计算”“求”等容易和实体名开头混淆的词（“计算机系”）；
+# 原子组：“查询”匹配后不再回退成“查”，否则“询男生”会被当成姓名
+PREFIX = r'(?>(?:请|帮我|麻烦)?(?:查询|查找|查看|列出|显示|统计|找出|查)?(?:一下)?)'
+ALL = r'(?:所有|全部|全体)?'
+PEOPLE = r'(?:学生|同学|生)'
+SUFFIX = r'(?:的)?(?:信息|名单|列表|详情|资料)?'
+# 实体名（姓名、课程名、班级名等）不能以这些词开头，避免“每个班的学生”被当成名为“每个班”的班级
+ENTITY = r'(?!每|各|所有|全部|全体|男|女|学生|同学|生|询)'
+PEOPLE_WORDS = ('学生', '同学', '男生', '女生')
+
+
+def _fields(fields):
+    return ', '.join(repr(f) for f in fields)
+
+
+def _students(filters, sex=None):
+    filters = list(filters)
+    if sex:
+        filters.append(f'sex={SEX[sex]!r}')
+    return (
+        f"result = student.objects.filter({', '.join(filters)})"
+        f".values({_fields(STUDENT_FIELDS)}).order_by('sno')"
+    )
+
+
+def _names(text, suffix):
+    """“计算机科学系” 与 “计算机科学” 都能对上系部名称，班级同理"""
+    return [text, text[:-len(suffix)]] if text.endswith(suffix) else [text, text + suffix]
+
+
+# ==================== 规则 ====================
+# (规则名, 正则（接在 PREFIX 之后整句匹配）, 生成代码的函数)
+
+RULES = []
+
+
+def rule(pattern):
+    """按定义顺序匹配，靠前的规则优先；规则名即函数名"""
+    def register(build):
+        RULES.append((build.__name__, re.compile(f'{PREFIX}{pattern}'), build))
+        return build
+    return register
+
+
+@rule(rf'每个?班(?:级)?{PEOPLE}?的?{PEOPLE}?(?:人数|数量|数)')
+def student_count_by_class(m):
+    return (
+        "result = list(student.objects.values('classno__classname')"
+        ".annotate(count=Count('sno')).order_by('classno__classname'))"
+    )
+
+
+@rule(rf'每个?系(?:部)?{PEOPLE}?的?{PEOPLE}?(?:人数|数量|数)')
+def student_count_by_depart(m):
+    return (
+        "result = list(student.objects.values('classno__dno__dname')"
+        ".annotate(count=Count('sno')).order_by('classno__dno__dname'))"
+    )
+
+
+@rule(r'每个?系(?:部)?的?班级(?:数量|个数|数)')
+def class_count_by_depart(m):
+    return "result = list(cl.objects.values('dno__dname').annotate(count=Count('classno')).order_by('dno__dname'))"
+
+
+@rule(r'每(?:门|个)?课(?:程)?的?平均(?:成绩|分)')
+def avg_grade_by_course(m):
+    return (
+        "result = list(sc.objects.values('cno__cno', 'cno__cname')"
+        ".annotate(avg=Avg('grade')).order_by('cno__cno'))"
+    )
+
+
+@rule(rf'(?:{ALL}学生的?(?:总数|总人数|人数|数量)|(?:一共)?有多少(?:个|名)?学生)')
+def student_total(m):
+    return "result = student.objects.count()"
+
+
+@rule(rf'(?P<sex>[男女]){PEOPLE}的?(?:人数|数量|总数|有多少人?|有几人)')
+def student_count_by_sex(m):
+    return f"result = student.objects.filter(sex={SEX[m['sex']]!r}).count()"
+
+
+@rule(rf'{ALL}(?P<sex>[男女]){PEOPLE}{SUFFIX}')
+def students_by_sex(m):
+    return _students([], m['sex'])
+
+
+@rule(rf'年龄(?P<op>不小于|不大于|大于|小于|超过|高于|低于|等于|为)?(?P<age>\d+)岁?(?P<tail>以上|以下)?的?{ALL}(?:(?P<sex>[男女]))?{PEOPLE}{SUFFIX}')
+def students_by_age(m):
+    op = COMPARE[m['tail'] or m['op'] or '等于']
+    return _students([f"age__{op}={int(m['age'])}"], m['sex'])
+
+
+@rule(rf'学号(?:为|是)?(?P<sno>\w+?)的?(?:学生)?的?{ALL}(?:选课记录|选课|课程成绩|课程|成绩){SUFFIX}')
+def student_courses_by_sno(m):
+    return (
+        f"result = sc.objects.filter(sno_id={m['sno']!r})"
+        ".values('cno__cno', 'cno__cname', 'cno__credit', 'grade').order_by('cno__cno')"
+    )
+
+
+@rule(rf'学号(?:为|是)?(?P<sno>\w+?)的?(?:学生)?{SUFFIX}')
+def student_by_sno(m):
+    return _students([f"sno={m['sno']!r}"])
+
+
+@rule(rf'(?:姓名|名字)(?:为|是|叫)?(?P<name>\w+?)的?(?:学生)?{SUFFIX}')
+def student_by_name(m):
+    return _students([f"sname={m['name']!r}"])
+
+
+@rule(rf'(?:学生)?{ENTITY}(?P<name>[^\s的]{{2,4}}?)(?:同学|学生)?的{ALL}(?:选课记录|选课|课程成绩|课程|成绩){SUFFIX}')
+def student_courses_by_name(m):
+    return (
+        f"result = sc.objects.filter(sno__sname={m['name']!r})"
+        ".values('sno__sno', 'sno__sname', 'cno__cno', 'cno__cname', 'grade').order_by('sno__sno', 'cno__cno')"
+    )
+
+
+@rule(rf'(?:课程)?(?:编号)?(?:为|是)?{ENTITY}(?P<course>[^\s的]+?)(?:课程?)?的?平均(?:成绩|分)')
+def avg_grade_of_course(m):
+    # 只接受确实存在的课程编号或课程名；“张三”“计算机系学生”“各班级”等交给后面的规则或大模型
+    name = m['course']
+    if name.endswith(('系', '系部', '班', '班级')) or any(word in name for word in PEOPLE_WORDS):
+        return None
+    if not course.objects.filter(Q(cno__iexact=name) | Q(cname__iexact=name)).exists():
+        return None
+    return (
+        f"result = sc.objects.filter(Q(cno__cno__iexact={name!r}) | Q(cno__cname__iexact={name!r}))"
+        ".aggregate(avg=Avg('grade'), count=Count('grade'))"
+    )
+
+
+@rule(r'课程(?:编号|号)(?:为|是)?(?P<cno>\w+?)的?(?:课程)?(?:信息|详情)?')
+def course_by_cno(m):
+    return (
+        f"result = course.objects.filter(cno__iexact={m['cno']!r})"
+        ".values('cno', 'cname', 'credit', 'lecture', 'type')"
+    )
+
+
+@rule(r'班级(?:编号|号)(?:为|是)?(?P<classno>\w+?)的?(?:班级)?(?:信息|详情)?')
+def class_by_classno(m):
+    return (
+        f"result = cl.objects.filter(classno__iexact={m['classno']!r})"
+        ".values('classno', 'classname', 'dno__dname')"
+    )
+
+
+@rule(rf'{ENTITY}(?P<depart>[^\s的]+?系)(?:部)?的?{ALL}班级{SUFFIX}')
+def classes_of_depart(m):
+    return (
+        f"result = cl.objects.filter(dno__dname__in={_names(m['depart'], '系')!r})"
+        ".values('classno', 'classname').order_by('classno')"
+    )
+
+
+@rule(rf'{ENTITY}(?P<depart>[^\s的]+?系)(?:部)?的?{ALL}(?:(?P<sex>[男女]))?{PEOPLE}{SUFFIX}')
+def students_of_depart(m):
+    return _students([f"classno__dno__dname__in={_names(m['depart'], '系')!r}"], m['sex'])
+
+
+@rule(rf'(?:(?:班级)(?:编号|名称)?(?:为|是)?{ENTITY}(?P<cls>[^\s的]+?)|{ENTITY}(?P<cls_name>[^\s的]+?班))的?{ALL}(?:(?P<sex>[男女]))?{PEOPLE}{SUFFIX}')
+def students_of_class(m):
+    if m['cls']:
+        cls = m['cls']
+        cond = f"Q(classno__classno__iexact={cls!r}) | Q(classno__classname__in={_names(cls, '班')!r})"
+    else:
+        cond = f"classno__classname__in={_names(m['cls_name'], '班')!r}"
+    return _students([cond], m['sex'])
+
+
+# ==================== 匹配 ====================
+
+_lock = threading.Lock()
+_stats = Counter()
+
+
+def match(text):
+    """返回 (规则名, 代码)，没有匹配时返回 None；个别规则会查询数据库，异步视图中需放到线程里调用"""
+    query = normalize_query(text)
+    for name, pattern, build in RULES:
+        m = pattern.fullmatch(query)
+        code = m and build(m)
+        if code:
+            with _lock:
+                _stats['matched'] += 1
+                _stats[f'rule:{name}'] += 1
+            return name, code
+    with _lock:
+        _stats['unmatched'] += 1
+    return None
+
+
+def stats():
+    with _lock:
+        matched, unmatched = _stats['matched'], _stats['unmatched']
+        total = matched + unmatched
+        return {
+            'matched': matched,
+            'unmatched': unmatched,
+            'match_rate': round(matched / total, 3) if total else None,
+            'rules': {k[len('rule:'):]: v for k, v in _stats.items() if k.startswith('rule:')},
+        }
@@ -0,0 +1,306 @@
+"""
+本地后台任务：任务存放在 job 表中，由 `python manage.py runjobs` 启动的线程池 / 进程池执行，
+不依赖外部消息队列。网页端提交任务后轮询进度接口，完成后下载结果文件。
+可以同时运行多个 worker：认领任务时记下 worker 编号，worker 定期为自己的任务写心跳；
+只有心跳超过 JOB_STALE_AFTER 秒的任务（worker 已退出或卡死）才会被放回队列，不会抢走其他存活 worker 的任务。
+"""
+import csv
+import multiprocessing
+import os
+import socket
+import time
+import uuid
+from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from openpyxl import load_workbook
+
+from .models import job, student
+from .pagination import KeysetPaginator
+from .student_io import (
+    export_rows, filter_students, import_students, iter_csv, iter_ndjson, student_order, write_xlsx,
+)
+
+PROGRESS_INTERVAL = 0.5  # 进度最多每 0.5 秒写一次库
+HEARTBEAT_INTERVAL = getattr(settings, 'JOB_HEARTBEAT_INTERVAL', 10)  # 秒
+STALE_AFTER = getattr(settings, 'JOB_STALE_AFTER', 60)  # 秒，心跳超过这么久的任务视为无人执行
+
+EXPORT_SUFFIX = {'xlsx': 'xlsx', 'csv': 'csv', 'ndjson': 'ndjson'}
+
+
+def job_root():
+    root = Path(settings.JOB_ROOT)
+    root.mkdir(parents=True, exist_ok=True)
+    return root
+
+
+# ==================== 提交 ====================
+
+def submit(kind, owner, params=None, input_file=None):
+    return job.objects.create(kind=kind, owner=owner, params=params or {}, input_file=input_file or '')
+
+
+def save_upload(upload):
+    """把上传文件落盘，交给后台任务读取"""
+    path = job_root() / 'uploads' / f'{uuid.uuid4().hex}{Path(upload.name).suffix}'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as f:
+        for chunk in upload.chunks():
+            f.write(chunk)
+    return str(path)
+
+
+def job_status(j):
+    """轮询接口返回的数据：进度、耗时和预计剩余时间（秒）"""
+    elapsed = eta = None
+    if j.started:
+        end = j.finished or timezone.now()
+        elapsed = (end - j.started).total_seconds()
+        if j.status == 'running' and j.total and j.done:
+            rate = j.done / elapsed if elapsed > 0 else 0
+            eta = round((j.total - j.done) / rate, 1) if rate else None
+    return {
+        'id': j.pk,
+        'kind': j.kind,
+        'status': j.status,
+        'status_display': j.get_status_display(),
+        'done': j.done,
+        'total': j.total,
+        'percent': round(j.done * 100 / j.total, 1) if j.total else None,
+        'elapsed': round(elapsed, 1) if elapsed is not None else None,
+        'eta': eta,
+        'message': j.message,
+        'result': j.result,
+        'has_file': bool(j.result_file),
+    }
+
+
+# ==================== 执行 ====================
+
+class Progress:
+    """节流写进度，避免每行都 UPDATE"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.last = 0.0
+
+    def total(self, total):
+        job.objects.filter(pk=self.job_id).update(total=total)
+
+    def __call__(self, done, force=False):
+        now = time.monotonic()
+        if force or now - self.last >= PROGRESS_INTERVAL:
+            self.last = now
+            job.objects.filter(pk=self.job_id).update(done=done)
+
+
+class ImportCheckpoint:
+    """
+    导入的续跑位置，存在 job.result['checkpoint'] 里，随每批写入一起提交：
+    已处理行数、累计成功 / 失败数、前 20 条错误，以及错误清单 CSV 已写入的字节数。
+    任务被重新排队后从这里继续；CSV 截回记录的长度，丢掉上次提交之后多写的错误。
+    """
+
+    def __init__(self, j):
+        saved = (j.result or {}).get('checkpoint') or {}
+        self.job_id = j.pk
+        self.start_row = saved.get('rows', 0)
+        self.success = saved.get('success', 0)
+        self.error_count = saved.get('error_count', 0)
+        self.errors = saved.get('errors', [])
+        self.path = job_root() / 'results' / f'{j.pk}_import_errors.csv'
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if saved and self.path.exists():
+            self.file = open(self.path, 'r+', newline='', encoding='utf-8-sig')
+            self.file.truncate(saved.get('errors_size', 0))
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.file = open(self.path, 'w', newline='', encoding='utf-8-sig')
+            csv.writer(self.file).writerow(['错误信息'])
+        self.written = 0
+
+    def totals(self, result):
+        errors = result.errors
+        return self.success + result.success, self.error_count + len(errors), (self.errors + errors)[:20]
+
+    def __call__(self, result):
+        csv.writer(self.file).writerows([e] for e in result.errors[self.written:])
+        self.written = len(result.errors)
+        self.file.flush()
+        success, error_count, errors = self.totals(result)
+        job.objects.filter(pk=self.job_id).update(result={'checkpoint': {
+            'rows': result.rows, 'success': success, 'error_count': error_count, 'errors': errors,
+            'errors_size': self.file.tell(),
+        }})
+
+    def close(self):
+        self.file.close()
+
+
+def run_student_import(j, progress):
+    path = j.input_file
+    # 只读模式下 max_row 取自表格的 dimension 信息，不需要读完整个文件
+    wb = load_workbook(path, read_only=True)
+    max_row = wb.active.max_row
+    wb.close()
+    if max_row:
+        progress.total(max_row - 1)
+
+    checkpoint = ImportCheckpoint(j)
+    try:
+        result = import_students(path, progress=progress, start_row=checkpoint.start_row, checkpoint=checkpoint)
+    finally:
+        checkpoint.close()
+    progress(result.rows, force=True)
+
+    success, error_count, errors = checkpoint.totals(result)
+    data = {'success': success, 'error_count': error_count, 'errors': errors}
+    # 完整错误清单已随导入逐批写入 CSV 供下载
+    result_file = str(checkpoint.path)
+    if not error_count:
+        checkpoint.path.unlink(missing_ok=True)
+        result_file = ''
+    return f'成功导入 {success} 条，失败 {error_count} 条', data, result_file
+
+
+def run_student_export(j, progress):
+    params = j.params
+    fmt = params.get('format', 'xlsx')
+    if fmt not in EXPORT_SUFFIX:
+        fmt = 'xlsx'
+    order_field, descending = student_order(params)
+    queryset = filter_students(student.objects.all(), params)
+    progress.total(queryset.count())
+    queryset = KeysetPaginator(queryset, order_field, descending).ordered()
+
+    count = 0
+
+    def counted(rows):
+        nonlocal count
+        for count, row in enumerate(rows, start=1):
+            yield row
+            progress(count)
+
+    rows = counted(export_rows(queryset))
+    result_file = str(job_root() / 'results' / f'{j.pk}_students.{EXPORT_SUFFIX[fmt]}')
+    Path(result_file).parent.mkdir(parents=True, exist_ok=True)
+    if fmt == 'xlsx':
+        with open(result_file, 'wb') as f:
+            write_xlsx(rows, f)
+    else:
+        lines = iter_csv(rows) if fmt == 'csv' else iter_ndjson(rows)
+        with open(result_file, 'w', newline='', encoding='utf-8') as f:
+            f.writelines(lines)
+    progress(count, force=True)
+    return f'导出 {count} 条学生', {'rows': count}, result_file
+
+
+HANDLERS = {
+    'student_import': run_student_import,
+    'student_export': run_student_export,
+}
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+
+
+def finish(job_id, worker, **fields):
+    """写入任务结果；任务已被重新排队、由别的 worker 认领时不覆盖"""
+    return job.objects.filter(pk=job_id, worker=worker, status='running').update(finished=timezone.now(), **fields)
+
+
+def run_job(job_id, worker):
+    """执行一个已被认领的任务；线程池和进程池都调用这个函数"""
+    try:
+        j = job.objects.get(pk=job_id)
+        try:
+            message, result, result_file = HANDLERS[j.kind](j, Progress(j.pk))
+            finished = finish(j.pk, worker, status='done', message=message, result=result, result_file=result_file)
+        except Exception as e:
+            finished = finish(j.pk, worker, status='failed', message=f'任务失败：{e}')
+        # 成功或失败都删掉上传文件；任务已被别的 worker 接手时留给它续跑
+        if finished and j.input_file:
+            Path(j.input_file).unlink(missing_ok=True)
+    finally:
+        # 工作线程各自持有数据库连接，任务结束即释放
+        connection.close()
+
+
+def claim_next(worker):
+    """认领最早的等待任务；用条件 UPDATE 保证多个 worker 不会重复认领"""
+    for job_id in job.objects.filter(status='pending').order_by('id').values_list('id', flat=True)[:5]:
+        now = timezone.now()
+        claimed = job.objects.filter(pk=job_id, status='pending').update(
+            status='running', started=now, worker=worker, heartbeat=now,
+        )
+        if claimed:
+            return job_id
+    return None
+
+
+def heartbeat(worker):
+    """为本 worker 正在执行的任务续心跳"""
+    return job.objects.filter(status='running', worker=worker).update(heartbeat=timezone.now())
+
+
+def requeue_stale():
+    """心跳过期（worker 已退出或卡死）的执行中任务放回队列；存活 worker 的任务不动"""
+    deadline = timezone.now() - timedelta(seconds=STALE_AFTER)
+    return job.objects.filter(status='running').exclude(heartbeat__gte=deadline).update(
+        status='pending', done=0, started=None, worker='', heartbeat=None,
+    )
+
+
+def purge_uploads():
+    """删除没有等待中 / 执行中任务引用的上传文件（任务已结束，或落盘后没能提交任务）"""
+    uploads = job_root() / 'uploads'
+    if not uploads.is_dir():
+        return 0
+    in_use = set(job.objects.filter(status__in=['pending', 'running']).values_list('input_file', flat=True))
+    # 刚落盘、任务还没来得及提交的文件不动
+    deadline = time.time() - STALE_AFTER
+    removed = 0
+    for path in uploads.iterdir():
+        if str(path) not in in_use and path.stat().st_mtime < deadline:
+            path.unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+
+def work(workers=2, use_processes=False, poll=1.0, once=False, worker=None):
+    """
+    worker 主循环：有空闲槽位就认领任务；once=True 时队列清空后退出。
+    每 HEARTBEAT_INTERVAL 秒为自己的任务写心跳，把其他已失联 worker 的任务放回队列，并清理无人引用的上传文件。
+    """
+    worker = worker or worker_id()
+    if use_processes:
+        # spawn 启动的子进程不继承父进程的数据库连接，先 django.setup() 再执行任务
+        pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup,
+        )
+    else:
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+
+    running = set()
+    beat = time.monotonic()
+    with pool:
+        while True:
+            if time.monotonic() - beat >= HEARTBEAT_INTERVAL:
+                beat = time.monotonic()
+                heartbeat(worker)
+                requeue_stale()
+                purge_uploads()
+            running = {f for f in running if not f.done()}
+            job_id = claim_next(worker) if len(running) < workers else None
+            if job_id is not None:
+                running.add(pool.submit(run_job, job_id, worker))
+                continue
+            if once and not running:
+                break
+            time.sleep(poll)
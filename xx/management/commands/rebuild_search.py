@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from xx import search
+
+
+class Command(BaseCommand):
+    help = '全量重建学号 / 姓名 / 课程名 / 班级名的 n-gram 搜索索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'kinds', nargs='*',
+            help=f"只重建指定字段（{', '.join(search.SEARCH_FIELDS)}），默认全部",
+        )
+
+    def handle(self, *args, **options):
+        kinds = options['kinds']
+        unknown = set(kinds) - set(search.SEARCH_FIELDS)
+        if unknown:
+            raise CommandError(f"未知字段：{', '.join(sorted(unknown))}")
+        total = search.rebuild(kinds or None)
+        self.stdout.write(self.style.SUCCESS(f'搜索索引已重建：共 {total} 条 n-gram'))
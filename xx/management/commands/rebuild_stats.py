@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from xx import stats
+
+
+class Command(BaseCommand):
+    help = '全量重建仪表盘统计快照'
+
+    def handle(self, *args, **options):
+        stats.rebuild()
+        snap, departs = stats.snapshot()
+        self.stdout.write(self.style.SUCCESS(
+            f'统计快照已重建：学生 {snap.student_total}，课程 {snap.course_total}，'
+            f'班级 {snap.class_total}，系部 {snap.depart_total}'
+        ))
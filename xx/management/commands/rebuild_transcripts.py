@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from xx import transcripts
+
+
+class Command(BaseCommand):
+    help = '全量重建学生成绩汇总（transcript 表）'
+
+    def handle(self, *args, **options):
+        total = transcripts.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'成绩汇总已重建：共 {total} 名学生'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from xx.jobs import requeue_stale, work
+
+
+class Command(BaseCommand):
+    help = '启动后台任务 worker（Excel 导入导出等）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='并发执行的任务数')
+        parser.add_argument('--processes', action='store_true', help='使用进程池（默认线程池）')
+        parser.add_argument('--poll', type=float, default=1.0, help='空闲时轮询间隔（秒）')
+        parser.add_argument('--once', action='store_true', help='执行完当前队列后退出')
+
+    def handle(self, *args, **options):
+        # 只放回心跳过期的任务，其他仍在运行的 worker 的任务不动
+        requeued = requeue_stale()
+        if requeued:
+            self.stdout.write(f'重新排队 {requeued} 个失去心跳的任务')
+        self.stdout.write(self.style.SUCCESS(
+            f"后台任务 worker 已启动（{options['workers']} 个{'进程' if options['processes'] else '线程'}）"
+        ))
+        try:
+            work(
+                workers=options['workers'],
+                use_processes=options['processes'],
+                poll=options['poll'],
+                once=options['once'],
+            )
+        except KeyboardInterrupt:
+            self.stdout.write('worker 已停止')
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('xx', '0002_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='dashstat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('student_total', models.IntegerField(default=0)),
+                ('course_total', models.IntegerField(default=0)),
+                ('class_total', models.IntegerField(default=0)),
+                ('depart_total', models.IntegerField(default=0)),
+                ('graded_count', models.IntegerField(default=0)),
+                ('grade_sum', models.FloatField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='departstat',
+            fields=[
+                ('dno', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='xx.depart')),
+                ('students', models.IntegerField(default=0)),
+                ('enrolled', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
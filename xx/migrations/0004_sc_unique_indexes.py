@@ -0,0 +1,66 @@
+# 旧库里可能有同一学生重复选同一门课的记录，唯一约束建不起来：先去重，再建索引和约束
+# 每组 (学号, 课程号) 保留一条：优先有成绩的，其次最新录入的（id 最大）
+
+from django.db import migrations, models
+from django.db.models import Count, F
+
+
+def dedupe(apps, schema_editor):
+    sc = apps.get_model('xx', 'sc')
+    duplicates = (
+        sc.objects.order_by().values('sno_id', 'cno_id').annotate(n=Count('id')).filter(n__gt=1)
+        .values_list('sno_id', 'cno_id')
+    )
+    for sno, cno in duplicates.iterator():
+        ids = list(
+            sc.objects.filter(sno_id=sno, cno_id=cno)
+            .order_by(F('grade').desc(nulls_last=True), '-id').values_list('id', flat=True)
+        )
+        sc.objects.filter(id__in=ids[1:]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('xx', '0003_dashstat_departstat'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['type', 'semester'], name='course_type_semester_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['semester'], name='course_semester_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['classno', 'sex'], name='student_class_sex_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['sname', 'sno'], name='student_sname_sno_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['age', 'sno'], name='student_age_sno_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['semester', 'sno'], name='student_semester_sno_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sc',
+            index=models.Index(fields=['cno', 'grade'], name='sc_cno_grade_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sc',
+            index=models.Index(fields=['grade'], name='sc_grade_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='sc',
+            constraint=models.UniqueConstraint(fields=('sno', 'cno'), name='sc_sno_cno_uniq'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('xx', '0004_sc_unique_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='searchgram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=10)),
+                ('gram', models.CharField(max_length=2)),
+                ('key', models.CharField(max_length=10)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'key'], name='searchgram_kind_key_idx')],
+                'constraints': [models.UniqueConstraint(fields=('kind', 'gram', 'key'), name='searchgram_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('xx', '0005_searchgram'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='transcript',
+            fields=[
+                ('sno', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='xx.student')),
+                ('course_count', models.IntegerField(default=0)),
+                ('credit_total', models.FloatField(default=0)),
+                ('graded_count', models.IntegerField(default=0)),
+                ('graded_credit', models.FloatField(default=0)),
+                ('passed_credit', models.FloatField(default=0)),
+                ('grade_sum', models.FloatField(default=0)),
+                ('grade_point_credit', models.FloatField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('xx', '0006_transcript'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='chatmsg',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('conversation', models.IntegerField()),
+                ('role', models.CharField(choices=[('user', '用户'), ('assistant', 'AI助手')], max_length=10)),
+                ('content', models.TextField()),
+                ('compacted', models.BooleanField(default=False)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'conversation', 'id'], name='chatmsg_user_conv_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# 已有数据的库升级时 searchgram 表是空的，搜索会什么都查不到：这里按现有数据建好索引（同 rebuild_search）
+
+from django.db import migrations
+
+BATCH_SIZE = 5000
+# 建这个迁移时的索引规则（之后 xx/search.py 的改动不影响这里）：kind -> (模型, 字段, 是否索引单字)
+SEARCH_FIELDS = {
+    'sno': ('student', 'sno', False),
+    'sname': ('student', 'sname', True),
+    'cname': ('course', 'cname', True),
+    'classname': ('cl', 'classname', True),
+}
+
+
+def grams(text, unigrams):
+    text = (text or '').strip().lower()
+    result = set(text) if unigrams else set()
+    result.update(text[i:i + 2] for i in range(len(text) - 1))
+    return result
+
+
+def populate(apps, schema_editor):
+    searchgram = apps.get_model('xx', 'searchgram')
+    if searchgram.objects.exists():
+        return
+    for kind, (model, field, unigrams) in SEARCH_FIELDS.items():
+        historical = apps.get_model('xx', model)
+        batch = []
+        for key, value in historical.objects.order_by().values_list('pk', field).iterator(chunk_size=BATCH_SIZE):
+            batch.extend(searchgram(kind=kind, gram=g, key=key) for g in grams(value, unigrams))
+            if len(batch) >= BATCH_SIZE:
+                searchgram.objects.bulk_create(batch)
+                batch = []
+        searchgram.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('xx', '0008_job_worker_heartbeat'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate, migrations.RunPython.noop),
+    ]
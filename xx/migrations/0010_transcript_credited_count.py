@@ -0,0 +1,31 @@
+# 平均学分原来用 Avg('cno__credit')，不计没填学分的课程；汇总表补上这个分母，并按现有选课记录回填
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def populate(apps, schema_editor):
+    sc = apps.get_model('xx', 'sc')
+    transcript = apps.get_model('xx', 'transcript')
+    counts = (
+        sc.objects.filter(sno_id=OuterRef('pk'), cno__credit__isnull=False)
+        .order_by().values('sno_id').annotate(n=Count('id')).values('n')
+    )
+    transcript.objects.update(credited_count=Coalesce(Subquery(counts), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('xx', '0009_populate_searchgram'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transcript',
+            name='credited_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(populate, migrations.RunPython.noop),
+    ]
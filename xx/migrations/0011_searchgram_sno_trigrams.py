@@ -0,0 +1,39 @@
+# 学号的单字、二元组没有区分度：学号改建三元组索引，按现有数据重建（同 rebuild_search --kind sno）
+
+from django.db import migrations, models
+
+BATCH_SIZE = 5000
+
+
+def trigrams(text):
+    text = (text or '').strip().lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def reindex_sno(apps, schema_editor):
+    searchgram = apps.get_model('xx', 'searchgram')
+    student = apps.get_model('xx', 'student')
+    searchgram.objects.filter(kind='sno').delete()
+    batch = []
+    for sno in student.objects.order_by().values_list('sno', flat=True).iterator(chunk_size=BATCH_SIZE):
+        batch.extend(searchgram(kind='sno', gram=g, key=sno) for g in trigrams(sno))
+        if len(batch) >= BATCH_SIZE:
+            searchgram.objects.bulk_create(batch)
+            batch = []
+    searchgram.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('xx', '0010_transcript_credited_count'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='searchgram',
+            name='gram',
+            field=models.CharField(max_length=3),
+        ),
+        migrations.RunPython(reindex_sno, migrations.RunPython.noop),
+    ]
@@ -30,6 +30,16 @@ class student(models.Model):
     home = models.CharField(max_length=40, )
     telephone = models.CharField(max_length=20, )
 
+    class Meta:
+        indexes = [
+            # 学生列表：按班级 + 性别筛选
+            models.Index(fields=['classno', 'sex'], name='student_class_sex_idx'),
+            # 学生列表键集分页：(排序字段, 学号)
+            models.Index(fields=['sname', 'sno'], name='student_sname_sno_idx'),
+            models.Index(fields=['age', 'sno'], name='student_age_sno_idx'),
+            models.Index(fields=['semester', 'sno'], name='student_semester_sno_idx'),
+        ]
+
 
 class course(models.Model):
     coutype = (
@@ -45,8 +55,144 @@ class course(models.Model):
     credit = models.FloatField(null=True)
     type = models.CharField(max_length=10, null=True, choices=coutype, default='crc')
 
+    class Meta:
+        indexes = [
+            # 课程列表：按类型 / 类型 + 学期 / 学期筛选
+            models.Index(fields=['type', 'semester'], name='course_type_semester_idx'),
+            models.Index(fields=['semester'], name='course_semester_idx'),
+        ]
+
 
 class sc(models.Model):
     sno = models.ForeignKey(student, on_delete=models.CASCADE)
     cno = models.ForeignKey(course, on_delete=models.CASCADE)
     grade = models.FloatField(null=True)
+
+    class Meta:
+        constraints = [
+            # 同一学生不能重复选同一门课；唯一索引同时服务按学号查选课记录
+            models.UniqueConstraint(fields=['sno', 'cno'], name='sc_sno_cno_uniq'),
+        ]
+        indexes = [
+            # 课程成绩统计：按课程取已评分记录、按分数段计数
+            models.Index(fields=['cno', 'grade'], name='sc_cno_grade_idx'),
+            models.Index(fields=['grade'], name='sc_grade_idx'),
+        ]
+
+
+class job(models.Model):
+    """后台任务（导入 / 导出等），由 runjobs 管理命令执行"""
+    jobkind = (
+        ('student_import', '学生导入'),
+        ('student_export', '学生导出'),
+    )
+    jobstatus = (
+        ('pending', '等待中'),
+        ('running', '执行中'),
+        ('done', '已完成'),
+        ('failed', '失败'),
+    )
+    kind = models.CharField(max_length=20, choices=jobkind)
+    status = models.CharField(max_length=10, choices=jobstatus, default='pending')
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
+    params = models.JSONField(default=dict)
+    total = models.IntegerField(null=True)
+    done = models.IntegerField(default=0)
+    message = models.TextField(default='')
+    result = models.JSONField(null=True)
+    input_file = models.CharField(max_length=255, default='')
+    result_file = models.CharField(max_length=255, default='')
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True)
+    # 认领任务的 worker 及其最近一次心跳；心跳过期的任务才会被重新排队
+    worker = models.CharField(max_length=64, default='')
+    heartbeat = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            # worker 认领最早的等待任务
+            models.Index(fields=['status', 'id'], name='job_status_id_idx'),
+        ]
+
+
+class dashstat(models.Model):
+    """仪表盘统计快照（只有 id=1 一行），由 xx/stats.py 增量维护"""
+    student_total = models.IntegerField(default=0)
+    course_total = models.IntegerField(default=0)
+    class_total = models.IntegerField(default=0)
+    depart_total = models.IntegerField(default=0)
+    graded_count = models.IntegerField(default=0)
+    grade_sum = models.FloatField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+
+class departstat(models.Model):
+    """各系部的学生人数 / 选课学生人数快照"""
+    dno = models.OneToOneField(depart, on_delete=models.CASCADE, primary_key=True)
+    students = models.IntegerField(default=0)
+    enrolled = models.IntegerField(default=0)
+
+
+class searchgram(models.Model):
+    """子串搜索的 n-gram 倒排索引，由 xx/search.py 维护"""
+    kind = models.CharField(max_length=10)
+    gram = models.CharField(max_length=3)
+    key = models.CharField(max_length=10)
+
+    class Meta:
+        constraints = [
+            # 按 (kind, gram) 查候选主键
+            models.UniqueConstraint(fields=['kind', 'gram', 'key'], name='searchgram_uniq'),
+        ]
+        indexes = [
+            # 对象修改 / 删除时按主键清理旧索引
+            models.Index(fields=['kind', 'key'], name='searchgram_kind_key_idx'),
+        ]
+
+
+class transcript(models.Model):
+    """学生成绩汇总（每个学生一行），由 xx/transcripts.py 随选课 / 成绩 / 学分变化维护"""
+    sno = models.OneToOneField(student, on_delete=models.CASCADE, primary_key=True)
+    course_count = models.IntegerField(default=0)      # 已选课程门数
+    credit_total = models.FloatField(default=0)        # 已选课程学分合计
+    credited_count = models.IntegerField(default=0)    # 已选课程中填了学分的门数（平均学分的分母）
+    graded_count = models.IntegerField(default=0)      # 已录入成绩门数
+    graded_credit = models.FloatField(default=0)       # 已录入成绩课程的学分合计
+    passed_credit = models.FloatField(default=0)       # 及格课程学分合计
+    grade_sum = models.FloatField(default=0)           # 已录入成绩之和
+    grade_point_credit = models.FloatField(default=0)  # Σ 绩点 × 学分，用于计算 GPA
+    updated = models.DateTimeField(auto_now=True)
+
+    @property
+    def avg_grade(self):
+        return round(self.grade_sum / self.graded_count, 1) if self.graded_count else None
+
+    @property
+    def avg_credit(self):
+        # 与原来的 Avg('cno__credit') 一致：没填学分的课程不计入
+        return round(self.credit_total / self.credited_count, 1) if self.credited_count else 0
+
+    @property
+    def gpa(self):
+        return round(self.grade_point_credit / self.graded_credit, 2) if self.graded_credit else None
+
+
+class chatmsg(models.Model):
+    """AI 助手对话记录（只追加），由 xx/chat_history.py 读写；清空对话即开始新的 conversation"""
+    chatrole = (
+        ('user', '用户'),
+        ('assistant', 'AI助手'),
+    )
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    conversation = models.IntegerField()  # 每个用户各自从 1 开始编号
+    role = models.CharField(max_length=10, choices=chatrole)
+    content = models.TextField()
+    compacted = models.BooleanField(default=False)  # 旧回复已精简（结果表格只保留前几行）
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # 按对话倒序分页加载、找用户当前对话
+            models.Index(fields=['user', 'conversation', 'id'], name='chatmsg_user_conv_idx'),
+        ]
@@ -0,0 +1,120 @@
+"""
+键集（seek）分页：按 (排序字段, 主键) 定位下一页，不使用 OFFSET，翻到多深代价都一样。
+"""
+import base64
+import json
+
+from django.db.models import F, Q
+
+
+def encode_cursor(value, pk):
+    raw = json.dumps([value, pk], ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析游标，非法游标返回 None（当作第一页处理）"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, pk = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError, UnicodeError):
+        return None
+    return value, pk
+
+
+class KeysetPage:
+    """一页数据及前后页游标"""
+
+    def __init__(self, object_list, has_next, has_previous, next_cursor=None, prev_cursor=None):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    field 为排序字段（attname，例如 classno_id），主键作为并列时的决胜字段。
+    NULL 视为最小值：升序时排在最前，降序时排在最后。
+    """
+
+    def __init__(self, queryset, field, descending=False, per_page=20):
+        self.queryset = queryset
+        self.field = field
+        self.descending = descending
+        self.per_page = per_page
+        self.pk_name = queryset.model._meta.pk.attname
+        self.field_is_pk = field in ('pk', self.pk_name)
+
+    def _ordering(self, desc):
+        pk_order = F(self.pk_name).desc() if desc else F(self.pk_name).asc()
+        if self.field_is_pk:
+            return [pk_order]
+        if desc:
+            return [F(self.field).desc(nulls_last=True), pk_order]
+        return [F(self.field).asc(nulls_first=True), pk_order]
+
+    def _seek(self, value, pk, desc):
+        """按扫描方向取游标之后的行"""
+        pk_op = 'lt' if desc else 'gt'
+        pk_cond = Q(**{f'{self.pk_name}__{pk_op}': pk})
+        if self.field_is_pk:
+            return pk_cond
+
+        f = self.field
+        if value is None:
+            same = Q(**{f'{f}__isnull': True}) & pk_cond
+            return same if desc else same | Q(**{f'{f}__isnull': False})
+
+        beyond = Q(**{f'{f}__{pk_op}': value}) | (Q(**{f: value}) & pk_cond)
+        return beyond | Q(**{f'{f}__isnull': True}) if desc else beyond
+
+    def ordered(self):
+        """按分页使用的完整排序返回查询集（导出等需要与列表顺序一致的场景）"""
+        return self.queryset.order_by(*self._ordering(self.descending))
+
+    def _cursor(self, obj):
+        value = obj.pk if self.field_is_pk else getattr(obj, self.field)
+        return encode_cursor(value, obj.pk)
+
+    def page(self, after=None, before=None, last=False):
+        """after/before 为游标字符串；last=True 表示直接跳到最后一页"""
+        after_key = decode_cursor(after)
+        before_key = None if after_key else decode_cursor(before)
+        backwards = before_key is not None or (last and after_key is None)
+
+        # 向前翻页时反向扫描，取完再把结果倒回来
+        scan_desc = self.descending != backwards
+        qs = self.queryset
+        key = before_key if backwards else after_key
+        if key is not None:
+            qs = qs.filter(self._seek(key[0], key[1], scan_desc))
+
+        rows = list(qs.order_by(*self._ordering(scan_desc))[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if backwards:
+            rows.reverse()
+            has_next = before_key is not None
+            has_previous = more
+        else:
+            has_next = more
+            has_previous = after_key is not None
+
+        return KeysetPage(
+            rows,
+            has_next=has_next and bool(rows),
+            has_previous=has_previous and bool(rows),
+            next_cursor=self._cursor(rows[-1]) if has_next and rows else None,
+            prev_cursor=self._cursor(rows[0]) if has_previous and rows else None,
+        )
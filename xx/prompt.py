@@ -0,0 +1,232 @@
+"""
+生成代码用的提示词：模型结构部分由 _meta 自动生成（启动时生成一次并缓存），不再手抄 models.py。
+每次请求按问题里的关键词挑出相关的模型，再沿外键关系补上连接它们所需的中间模型和相邻模型，只把这些模型放进提示词：
+- 问题直接提到的模型给出全部字段；
+- 补上的模型只给出主键、外键和名称字段（按姓名、课程名等筛选时用得到）；
+- 一个模型都对不上时给出全部模型。
+提示词长度（估算的 token 数）、裁剪节省的比例和整次对话的耗时由 stats() 给出（见 CacheStatsView）。
+"""
+import re
+import threading
+from collections import deque
+from functools import lru_cache
+
+from django.apps import apps
+
+# AI 可用的模型，提示词和代码缓存的结构指纹（code_cache.schema_signature）都以此为准
+SCHEMA_MODELS = ('student', 'cl', 'depart', 'course', 'sc')
+MODEL_LABELS = {
+    'student': '学生',
+    'cl': '班级',
+    'depart': '系部',
+    'course': '课程',
+    'sc': '选课成绩',
+}
+FIELD_LABELS = {
+    'student': {
+        'sno': '学号', 'sname': '姓名', 'sex': '性别', 'native': '籍贯', 'age': '年龄', 'classno': '班级',
+        'entime': '入学时间', 'semester': '学期', 'home': '家庭住址', 'telephone': '电话',
+    },
+    'cl': {'classno': '班级编号', 'classname': '班级名称', 'dno': '所属系部'},
+    'depart': {'dno': '系部编号', 'dname': '系部名称', 'telephone': '电话'},
+    'course': {
+        'cno': '课程编号', 'cname': '课程名称', 'lecture': '学时', 'semester': '开课学期', 'credit': '学分',
+        'type': '课程类型',
+    },
+    'sc': {'sno': '学生', 'cno': '课程', 'grade': '成绩'},
+}
+# 问题中出现这些词时选中对应模型（字段中文名和 choices 的中文含义也会参与匹配，见 _keywords）
+MODEL_KEYWORDS = {
+    'student': ('学生', '同学', '男生', '女生', '男', '女', '人数', '名单'),
+    'cl': ('班级', '班'),
+    'depart': ('系部', '院系', '学院', '系'),
+    'course': ('课程', '课', '公共课', '专业课', '选修课'),
+    'sc': ('成绩', '分数', '选课', '平均分', '最高分', '最低分', '及格', '挂科', '考试'),
+}
+
+CHARS_PER_TOKEN = 4  # 非中文部分按 4 个字符 1 个 token 估算，中文按 1 字 1 token
+
+
+def estimate_tokens(text):
+    cjk = len(re.findall(r'[一-鿿]', text))
+    return cjk + (len(text) - cjk + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+# ==================== 模型结构 ====================
+
+def _model(name):
+    return apps.get_model('xx', name)
+
+
+def _field_line(model_name, field):
+    args = []
+    if field.is_relation:
+        args.append(field.related_model._meta.model_name)
+    elif getattr(field, 'max_length', None):
+        args.append(f'max_length={field.max_length}')
+    if field.primary_key:
+        args.append('primary_key=True')
+    if field.null:
+        args.append('null=True')
+    if field.choices:
+        args.append(f'choices={list(field.choices)!r}')
+    line = f'    {field.name} = {type(field).__name__}({", ".join(args)})'
+    label = FIELD_LABELS.get(model_name, {}).get(field.name)
+    return f'{line}  # {label}' if label else line
+
+
+def _summary_field(field):
+    return field.primary_key or field.is_relation or field.name.endswith('name')
+
+
+@lru_cache(maxsize=None)
+def model_block(name, summary=False):
+    """一个模型的定义；summary 时只有主键、外键和名称字段"""
+    meta = _model(name)._meta
+    lines = [f'class {name}(models.Model):  # {MODEL_LABELS.get(name, name)}']
+    for field in meta.concrete_fields:
+        if field.auto_created or (summary and not _summary_field(field)):
+            continue
+        lines.append(_field_line(name, field))
+    if summary and any(not _summary_field(f) for f in meta.concrete_fields if not f.auto_created):
+        lines.append('    ...  # 其余字段与本问题无关，从略')
+    return '\n'.join(lines)
+
+
+@lru_cache(maxsize=1)
+def relation_graph():
+    """模型之间的外键关系（无向）"""
+    graph = {name: set() for name in SCHEMA_MODELS}
+    for name in SCHEMA_MODELS:
+        for field in _model(name)._meta.concrete_fields:
+            target = field.related_model and field.related_model._meta.model_name
+            if target in graph:
+                graph[name].add(target)
+                graph[target].add(name)
+    return graph
+
+
+@lru_cache(maxsize=1)
+def _keywords():
+    """
+    (关键词, 模型名元组)，长词在前，避免“选修课”先被“课”匹配后再匹配不到别的；
+    多个模型共有的词（“电话”、telephone、semester 等）对应所有这些模型
+    """
+    models = {}
+    for name in SCHEMA_MODELS:
+        words = set(MODEL_KEYWORDS.get(name, ())) | {name}
+        words |= set(FIELD_LABELS.get(name, {}).values())
+        for field in _model(name)._meta.concrete_fields:
+            # 外键的中文名（“班级”“课程”）指的是关联的模型，不算本模型的关键词
+            if field.is_relation:
+                words.discard(FIELD_LABELS.get(name, {}).get(field.name))
+            else:
+                words.add(field.name)
+            words |= {str(label) for _, label in field.choices or ()}
+        for word in words:
+            if word:
+                models.setdefault(word.lower(), []).append(name)
+    return sorted(((word, tuple(names)) for word, names in models.items()), key=lambda p: -len(p[0]))
+
+
+def warm():
+    """启动时生成全部模型的定义（apps.ready 中调用）"""
+    for name in SCHEMA_MODELS:
+        model_block(name)
+        model_block(name, summary=True)
+    relation_graph()
+    _keywords()
+
+
+def _path(graph, start, goal):
+    previous = {start: None}
+    queue = deque([start])
+    while queue:
+        node = queue.popleft()
+        if node == goal:
+            break
+        for nxt in sorted(graph[node]):
+            if nxt not in previous:
+                previous[nxt] = node
+                queue.append(nxt)
+    path = []
+    while goal is not None:
+        path.append(goal)
+        goal = previous.get(goal)
+    return path
+
+
+def relevant_models(query):
+    """返回 (问题直接提到的模型, 补上的模型：连接它们的中间模型和它们的相邻模型)"""
+    text = query.lower()
+    direct = []
+    for word, names in _keywords():
+        # 英文字段名 / 模型名按整词匹配，避免 age 匹配到 average
+        found = re.search(rf'\b{word}\b', text, re.ASCII) if word.isascii() else word in text
+        if found:
+            # 已匹配的词从文本中去掉：“选修课”算课程之后，其中的“课”不再重复匹配
+            text = text.replace(word, ' ')
+            direct += [name for name in names if name not in direct]
+    graph = relation_graph()
+    extra = []
+    for name in direct[1:]:
+        for node in _path(graph, direct[0], name):
+            if node not in direct and node not in extra:
+                extra.append(node)
+    for name in direct:
+        for node in sorted(graph[name]):
+            if node not in direct and node not in extra:
+                extra.append(node)
+    return direct, extra
+
+
+def schema(query):
+    direct, extra = relevant_models(query)
+    if not direct:
+        return full_schema()
+    # 按 SCHEMA_MODELS 的顺序输出，同样的模型组合得到同样的文本
+    return '\n'.join(
+        model_block(name, summary=name not in direct)
+        for name in SCHEMA_MODELS if name in direct or name in extra
+    )
+
+
+def full_schema():
+    return '\n'.join(model_block(name) for name in SCHEMA_MODELS)
+
+
+# ==================== 统计 ====================
+
+_lock = threading.Lock()
+_stats = {'prompts': 0, 'tokens': 0, 'full_tokens': 0}
+_chats = {}  # 代码来源（rule / cache / llm，没得到代码记为 error）-> [次数, 总秒数]
+
+
+def record(prompt, full_prompt):
+    with _lock:
+        _stats['prompts'] += 1
+        _stats['tokens'] += estimate_tokens(prompt)
+        _stats['full_tokens'] += estimate_tokens(full_prompt)
+
+
+def record_chat(source, seconds):
+    """一次对话从收到问题到得出回复的耗时（含生成代码和执行），按代码来源分别统计"""
+    with _lock:
+        entry = _chats.setdefault(source or 'error', [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+
+def stats():
+    with _lock:
+        n = _stats['prompts']
+        return {
+            'prompts': n,
+            'avg_tokens': round(_stats['tokens'] / n) if n else None,
+            'avg_full_tokens': round(_stats['full_tokens'] / n) if n else None,
+            'saved_ratio': round(1 - _stats['tokens'] / _stats['full_tokens'], 3) if n else None,
+            'chat_ms': {
+                source: {'count': count, 'avg_ms': round(seconds / count * 1000, 1)}
+                for source, (count, seconds) in _chats.items()
+            },
+        }
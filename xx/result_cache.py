@@ -0,0 +1,63 @@
+"""
+AI 助手执行结果缓存：键为规范化后的代码 + 代码涉及的各表数据版本号（见 cache.py），
+同一段代码在相关表没有写入时直接返回上次序列化好的结果；任一相关表有写入，版本号变化，旧结果自然失效。
+涉及的表由 CodeValidator.inspect 收集的模型名和字段路径推出（沿外键 / 反向关联展开）。
+"""
+import ast
+
+from django.apps import apps
+from django.core.exceptions import FieldDoesNotExist
+
+from .cache import TRACKED_MODELS, lookup as cache_lookup, store as cache_store
+
+CACHE_NAME = 'AICodeResult'
+RESULT_TIMEOUT = 600
+
+
+def normalize_code(code):
+    """去掉注释、空白和引号风格的差异"""
+    return ast.unparse(ast.parse(code))
+
+
+def _model(name):
+    return apps.get_model('xx', name)
+
+
+def _walk(model, path):
+    """沿字段路径（classno__dno__dname、-sno__sname、属性名 classno 等）经过的模型名"""
+    visited = set()
+    for part in path.lstrip('-').split('__'):
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            break
+        if not field.is_relation or field.related_model is None:
+            break
+        model = field.related_model
+        visited.add(model._meta.model_name)
+    return visited
+
+
+def tables(names, lookups):
+    """代码直接引用的模型，加上经字段路径能关联到的模型；路径不知道属于哪个模型，取所有可能（宁多勿漏）"""
+    found = {name for name in names if name in TRACKED_MODELS}
+    pending = list(found)
+    while pending:
+        model = _model(pending.pop())
+        for path in lookups:
+            for name in _walk(model, path) - found:
+                if name in TRACKED_MODELS:
+                    found.add(name)
+                    pending.append(name)
+    return sorted(found)
+
+
+def lookup(code, names, lookups):
+    """返回 (缓存键, 结果)；未命中时结果为 None"""
+    return cache_lookup(CACHE_NAME, tables(names, lookups), (normalize_code(code),))
+
+
+def store(key, result):
+    """执行出错的结果不缓存"""
+    if 'error' not in result:
+        cache_store(key, result, RESULT_TIMEOUT)
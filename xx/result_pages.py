@@ -0,0 +1,150 @@
+"""
+AI 查询结果翻页：结果超过一页时，web 进程把已校验过的代码登记成一个短期的“结果句柄”；
+翻页请求凭句柄在沙箱里重新执行这段代码得到同一个查询集，不再请求大模型，也不再校验代码。
+翻页按键集（排序字段 + 主键）定位，与 pagination.KeysetPaginator 一样不用 OFFSET；
+分组、去重、已切片或按表达式排序的查询集没有可用的键，退回按 OFFSET 翻页。
+句柄放在共享缓存（cache.get_cache()）里，每次翻页续期，空闲 AI_RESULT_HANDLE_TTL 秒后过期，缓存满时由缓存后端淘汰。
+"""
+import base64
+import json
+import secrets
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+
+from . import columnar
+from .cache import get_cache
+
+PAGE_SIZE = getattr(settings, 'AI_RESULT_PAGE_SIZE', 100)
+HANDLE_TTL = getattr(settings, 'AI_RESULT_HANDLE_TTL', 600)  # 秒，空闲多久后句柄失效
+
+
+# ==================== 游标 ====================
+
+def encode_cursor(state):
+    # 日期时间按 ISO 格式（带时区）编码，作为过滤条件时能原样解析回来
+    raw = json.dumps(state, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """非法游标返回 None（当作第一页处理）"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        state = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError, UnicodeError):
+        return None
+    return state if isinstance(state, dict) else None
+
+
+# ==================== 翻页 ====================
+
+def _keys(queryset):
+    """键集翻页的排序键 [(字段, 是否降序), ...]，以主键结尾；不能按键集翻页时返回 None"""
+    query = queryset.query
+    if query.is_sliced or query.distinct or query.group_by is not None or query.combinator:
+        return None
+    ordering = query.order_by or (query.get_meta().ordering if query.default_ordering else ())
+    pk = query.get_meta().pk
+    keys = []
+    for item in ordering:
+        if not isinstance(item, str) or item == '?' or '.' in item:
+            return None
+        name = item.lstrip('-')
+        if name in ('pk', pk.name, pk.attname):
+            return keys + [('pk', item.startswith('-'))]
+        keys.append((name, item.startswith('-')))
+    return keys + [('pk', False)]
+
+
+def _ordering(keys):
+    # NULL 视为最小值，与 KeysetPaginator 一致
+    return [F(name).desc(nulls_last=True) if desc else F(name).asc(nulls_first=True) for name, desc in keys]
+
+
+def _after(keys, values):
+    """排在游标那一行之后的行：前几个键相等、当前键更靠后，逐个键取并集"""
+    branches = []
+    same = Q()
+    for (name, desc), value in zip(keys, values):
+        if value is None:
+            beyond = None if desc else Q(**{f'{name}__isnull': False})
+            equal = Q(**{f'{name}__isnull': True})
+        else:
+            beyond = Q(**{f'{name}__{"lt" if desc else "gt"}': value})
+            if desc:
+                beyond |= Q(**{f'{name}__isnull': True})
+            equal = Q(**{name: value})
+        if beyond is not None:
+            branches.append(same & beyond)
+        same &= equal
+    return reduce(or_, branches)
+
+
+class Pager:
+    """
+    查询集的一页（列式元组）。遍历得到本页各行；遍历完后 next 为下一页游标，没有下一页时为 None。
+    """
+
+    def __init__(self, queryset, cursor=None, per_page=PAGE_SIZE):
+        state = decode_cursor(cursor) or {}
+        self.per_page = per_page
+        self.columns, rows = columnar.tuples(queryset)
+        self.keys = _keys(queryset)
+        self.next = None
+        if self.keys is None:
+            offset = state.get('o')
+            self.offset = offset if isinstance(offset, int) and offset > 0 else 0
+            if not queryset.ordered:
+                # 没有排序时 OFFSET 翻页的结果不稳定，按各列排序
+                rows = columnar.tuples(queryset.order_by(*self.columns))[1]
+            self.rows = rows[self.offset:self.offset + per_page + 1]
+            return
+        after = state.get('k')
+        if isinstance(after, list) and len(after) == len(self.keys):
+            queryset = queryset.filter(_after(self.keys, after))
+        # 键放在每行末尾，取下一页游标用，遍历时去掉
+        self.rows = queryset.order_by(*_ordering(self.keys)).values_list(
+            *self.columns, *(name for name, _ in self.keys)
+        )[:per_page + 1]
+
+    def __iter__(self):
+        width = len(self.columns)
+        last = None
+        for i, row in enumerate(self.rows.iterator(chunk_size=min(self.per_page, 100))):
+            if i == self.per_page:
+                if self.keys is None:
+                    self.next = encode_cursor({'o': self.offset + self.per_page})
+                else:
+                    self.next = encode_cursor({'k': list(last[width:])})
+                return
+            last = row
+            yield row[:width]
+
+
+# ==================== 结果句柄 ====================
+
+def _handle_key(handle):
+    return f'airesult:{handle}'
+
+
+def create_handle(code, user_id):
+    """登记已校验的代码，返回句柄"""
+    handle = secrets.token_urlsafe(12)
+    get_cache().set(_handle_key(handle), {'code': code, 'user': user_id}, HANDLE_TTL)
+    return handle
+
+
+def handle_code(handle, user_id):
+    """句柄对应的代码并续期；句柄已过期、被淘汰或不属于该用户时返回 None"""
+    cache = get_cache()
+    entry = cache.get(_handle_key(handle))
+    if not entry or entry['user'] != user_id:
+        return None
+    cache.touch(_handle_key(handle), HANDLE_TTL)
+    return entry['code']
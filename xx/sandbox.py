@@ -0,0 +1,300 @@
+"""
+AI 代码沙箱：预先启动一组已完成 django.setup() 的子进程（spawn，不从 web 进程 fork），
+生成的代码在子进程里由 AICodeExecutor 校验并执行，web 进程只负责派发和收结果。
+
+每个任务有三道限制：
+- 墙钟超时：超时未返回，父进程直接杀掉子进程；
+- 内存上限：等待和接收结果期间父进程每轮都用 psutil 检查子进程 RSS，超限即杀；
+- 数据库语句超时：子进程连接上设置 MySQL max_execution_time / PostgreSQL statement_timeout，
+  SQLite 用进度回调中断，查询先于墙钟超时被数据库中止，子进程可以继续复用。
+被杀掉或执行满 max_tasks 次的子进程由新进程替换。AI_SANDBOX_WORKERS = 0 时不启用，直接在当前进程执行。
+
+子进程由 ssims/asgi.py、ssims/wsgi.py 在服务进程启动时拉起（runserver 也经过 wsgi.py）；
+管理命令和沙箱子进程自身不启动。其他入口在第一次执行时由 _acquire 懒启动，第一个请求要多等子进程就绪。
+"""
+import collections
+import multiprocessing
+import queue
+import threading
+import time
+
+import psutil
+from django.conf import settings
+
+SANDBOX_WORKERS = getattr(settings, 'AI_SANDBOX_WORKERS', 2)
+SANDBOX_TIMEOUT = getattr(settings, 'AI_SANDBOX_TIMEOUT', 10)  # 秒，单个任务的墙钟上限
+SANDBOX_MAX_RSS_MB = getattr(settings, 'AI_SANDBOX_MAX_RSS_MB', 512)
+SANDBOX_MAX_TASKS = getattr(settings, 'AI_SANDBOX_MAX_TASKS', 200)  # 执行这么多次后换新进程
+SANDBOX_QUEUE_TIMEOUT = getattr(settings, 'AI_SANDBOX_QUEUE_TIMEOUT', 30)  # 秒，等待空闲子进程的上限
+# 数据库语句超时比墙钟超时略短，让数据库先中止查询
+STATEMENT_TIMEOUT_RATIO = 0.8
+POLL_INTERVAL = 0.05
+LATENCY_WINDOW = 500
+
+
+class SandboxError(Exception):
+    """沙箱无法给出结果（排队超时等）"""
+
+
+# ==================== 子进程 ====================
+
+_deadline = None
+
+
+def _statement_timeout(sender, connection, **kwargs):
+    """子进程里每个新数据库连接都设置语句超时"""
+    ms = int(SANDBOX_TIMEOUT * STATEMENT_TIMEOUT_RATIO * 1000)
+    if connection.vendor == 'mysql':
+        with connection.cursor() as cursor:
+            cursor.execute('SET SESSION max_execution_time = %s', [ms])
+    elif connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SET statement_timeout = %s', [ms])
+    elif connection.vendor == 'sqlite':
+        # 每执行 1 万条虚拟机指令检查一次，过了截止时间返回非 0，SQLite 中止当前语句
+        connection.connection.set_progress_handler(
+            lambda: _deadline is not None and time.monotonic() > _deadline, 10000,
+        )
+
+
+def _worker_main(conn):
+    import django
+    django.setup()
+    from django.db import close_old_connections
+    from django.db.backends.signals import connection_created
+    from .views import AICodeExecutor
+
+    global _deadline
+    connection_created.connect(_statement_timeout)
+    executor = AICodeExecutor()
+    conn.send(('ready', None))
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        close_old_connections()
+        _deadline = time.monotonic() + SANDBOX_TIMEOUT * STATEMENT_TIMEOUT_RATIO
+        # 任务是代码字符串，或翻页任务 ('page', 代码, 游标)
+        if isinstance(task, tuple):
+            messages = executor.iter_page(*task[1:])
+        else:
+            messages = executor.iter_ai_code(task)
+        try:
+            for message in messages:
+                conn.send(message)
+        finally:
+            _deadline = None
+
+
+# ==================== 父进程 ====================
+
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child,), daemon=True, name='ssims-sandbox')
+        self.process.start()
+        child.close()
+        self.tasks = 0
+        self._ps = None
+
+    def rss_mb(self):
+        try:
+            if self._ps is None:
+                self._ps = psutil.Process(self.process.pid)
+            return self._ps.memory_info().rss / 1024 / 1024
+        except psutil.Error:
+            return 0
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(1)
+        self.conn.close()
+
+
+class SandboxPool:
+    def __init__(self, size=SANDBOX_WORKERS, timeout=SANDBOX_TIMEOUT,
+                 max_rss_mb=SANDBOX_MAX_RSS_MB, max_tasks=SANDBOX_MAX_TASKS):
+        self.size = size
+        self.timeout = timeout
+        self.max_rss_mb = max_rss_mb
+        self.max_tasks = max_tasks
+        self._ctx = multiprocessing.get_context('spawn')
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        self._workers = set()
+        self._waiting = 0
+        self._counts = collections.Counter()
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self._waits = collections.deque(maxlen=LATENCY_WINDOW)
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    def start(self):
+        """启动全部子进程（不等待就绪）；重复调用无副作用"""
+        with self._lock:
+            if self._started or not self.enabled:
+                return
+            self._started = True
+        for _ in range(self.size):
+            self._spawn()
+
+    def _spawn(self):
+        worker = _Worker(self._ctx)
+        with self._lock:
+            self._workers.add(worker)
+        # 子进程 django.setup() 需要一两秒，就绪后才放入空闲队列，不阻塞调用方
+        threading.Thread(target=self._wait_ready, args=(worker,), daemon=True).start()
+
+    def _wait_ready(self, worker):
+        try:
+            if worker.conn.poll(60) and worker.conn.recv()[0] == 'ready':
+                self._idle.put(worker)
+                return
+        except (EOFError, OSError):
+            pass
+        # 启动失败（多半是配置问题）不再重试，避免反复拉起进程
+        self._retire(worker, 'start_failed', respawn=False)
+
+    def _retire(self, worker, reason=None, respawn=True):
+        worker.kill()
+        with self._lock:
+            self._workers.discard(worker)
+            if reason:
+                self._counts[reason] += 1
+        if respawn:
+            self._spawn()
+
+    def _release(self, worker):
+        worker.tasks += 1
+        if worker.tasks >= self.max_tasks:
+            self._retire(worker, 'recycled')
+        else:
+            self._idle.put(worker)
+
+    def _acquire(self):
+        self.start()
+        started = time.monotonic()
+        with self._lock:
+            self._waiting += 1
+        try:
+            worker = self._idle.get(timeout=SANDBOX_QUEUE_TIMEOUT)
+        except queue.Empty:
+            with self._lock:
+                self._counts['queue_timeout'] += 1
+            raise SandboxError('查询繁忙，请稍后再试')
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        self._waits.append(time.monotonic() - started)
+        return worker
+
+    def iter_execute(self, task):
+        """
+        与 AICodeExecutor.iter_ai_code（task 为代码）或 iter_page（task 为 ('page', 代码, 游标)）
+        产出相同的消息，只是在子进程里执行
+        """
+        worker = self._acquire()
+        started = time.monotonic()
+        deadline = started + self.timeout
+        finished = False
+        outcome = 'abandoned'
+        try:
+            worker.conn.send(task)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    outcome = 'timeout'
+                    yield 'result', {'error': f'执行失败: 执行超时（超过 {self.timeout:g} 秒）'}
+                    return
+                # 每轮都检查内存：子进程边算边发送分页数据时 poll 不会超时，不能只在空闲时检查
+                if worker.rss_mb() > self.max_rss_mb:
+                    outcome = 'memory'
+                    yield 'result', {'error': f'执行失败: 内存占用超过 {self.max_rss_mb} MB'}
+                    return
+                if not worker.conn.poll(min(POLL_INTERVAL, remaining)):
+                    continue
+                try:
+                    kind, payload = worker.conn.recv()
+                except (EOFError, OSError):
+                    outcome = 'crashed'
+                    yield 'result', {'error': '执行失败: 执行进程异常退出'}
+                    return
+                if kind == 'result':
+                    finished = True
+                    outcome = 'ok'
+                yield kind, payload
+                if finished:
+                    return
+        finally:
+            self._latencies.append(time.monotonic() - started)
+            with self._lock:
+                self._counts['tasks'] += 1
+                if outcome != 'ok':
+                    self._counts[outcome] += 1
+            if finished:
+                self._release(worker)
+            else:
+                # 超时、超内存、崩溃，或调用方中途放弃（管道里可能还有残留消息）：换新进程
+                self._retire(worker)
+
+    def metrics(self):
+        latencies = sorted(self._latencies)
+        waits = list(self._waits)
+
+        def pct(p):
+            return round(latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000, 1) if latencies else None
+
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'workers': len(self._workers),
+                'idle': self._idle.qsize(),
+                'queue_depth': self._waiting,
+                'tasks': self._counts['tasks'],
+                'timeouts': self._counts['timeout'],
+                'memory_kills': self._counts['memory'],
+                'crashes': self._counts['crashed'],
+                'abandoned': self._counts['abandoned'],
+                'start_failures': self._counts['start_failed'],
+                'recycled': self._counts['recycled'],
+                'queue_timeouts': self._counts['queue_timeout'],
+                'latency_ms': {'p50': pct(0.5), 'p95': pct(0.95), 'max': pct(1)},
+                'avg_wait_ms': round(sum(waits) / len(waits) * 1000, 1) if waits else None,
+                'limits': {'timeout': self.timeout, 'max_rss_mb': self.max_rss_mb, 'max_tasks': self.max_tasks},
+            }
+
+
+pool = SandboxPool()
+
+
+def iter_execute(code):
+    """沙箱启用时在子进程执行，否则直接在当前进程执行"""
+    if pool.enabled:
+        return pool.iter_execute(code)
+    from .views import AICodeExecutor
+    return AICodeExecutor().iter_ai_code(code)
+
+
+def _result(messages):
+    result = None
+    for kind, payload in messages:
+        if kind == 'result':
+            result = payload
+    return result
+
+
+def execute(code):
+    return _result(iter_execute(code))
+
+
+def page(code, cursor):
+    """结果句柄的后续页，返回 {'columns', 'rows', 'next'} 或 {'error'}"""
+    if pool.enabled:
+        return _result(pool.iter_execute(('page', code, cursor)))
+    from .views import AICodeExecutor
+    return _result(AICodeExecutor().iter_page(code, cursor))
@@ -0,0 +1,168 @@
+"""
+子串搜索：为学生学号 / 姓名、课程名、班级名建立 n-gram 倒排索引（searchgram 表）。
+查询串拆成 n-gram，取其中最少命中的一个得到候选主键，再在候选集上用原来的 icontains 精确过滤，
+避免 LIKE '%...%' 全表扫描。单条写入由 signals.py 同步，批量写入调用 index_objects，
+`python manage.py rebuild_search` 可全量重建；已有数据的库在迁移 0009、0011 中建好索引。
+"""
+from django.db import transaction
+from django.db.models import Q
+
+from .models import cl, course, searchgram, student
+
+# kind -> (模型, 字段, 索引的 n-gram 长度)
+# 学号只有 0-9 十个字符，单字、二元组总共不过 110 种，每种都命中大半学生，没有区分度；
+# 学号只建三元组（1000 种），一两位的查询直接回退到 icontains
+SEARCH_FIELDS = {
+    'sno': (student, 'sno', (3,)),
+    'sname': (student, 'sname', (1, 2)),
+    'cname': (course, 'cname', (1, 2)),
+    'classname': (cl, 'classname', (1, 2)),
+}
+BATCH_SIZE = 5000
+COMMON_GRAM = 20000  # 命中超过这个数的 n-gram 视为没有区分度
+SUGGEST_LIMIT = 8
+
+
+def kinds_of(model):
+    return [kind for kind, (m, _, _) in SEARCH_FIELDS.items() if m is model]
+
+
+def normalize(text):
+    return (text or '').strip().lower()
+
+
+def _ngrams(text, size):
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def grams(text, sizes=(1, 2)):
+    """建索引用：text 中每种长度的全部 n-gram"""
+    text = normalize(text)
+    return set().union(*(_ngrams(text, size) for size in sizes))
+
+
+def query_grams(text, sizes=(1, 2)):
+    """查询用：不超过查询串长度的最长一种 n-gram；查询串比最短的还短时返回空集（无法用索引）"""
+    text = normalize(text)
+    usable = [size for size in sizes if size <= len(text)]
+    return _ngrams(text, max(usable)) if usable else set()
+
+
+def rarest_gram(kind, text):
+    """
+    查询串的 n-gram 中命中主键最少的一个，返回 (gram, 命中数)。
+    计数封顶 COMMON_GRAM，之后每个 n-gram 只数到目前最少的命中数为止，最多读一小段索引。
+    """
+    best = None
+    for gram in query_grams(text, SEARCH_FIELDS[kind][2]):
+        limit = COMMON_GRAM if best is None else best[1]
+        n = searchgram.objects.filter(kind=kind, gram=gram)[:limit].count()
+        if n == 0:
+            return gram, 0
+        if best is None or n < best[1]:
+            best = (gram, n)
+    return best
+
+
+def search_q(kind, text):
+    """
+    返回可直接 filter 的条件：以最少命中的 n-gram 取候选主键，再用原字段 icontains 校验。
+    所有 n-gram 都很常见、查询串比索引的 n-gram 还短、该字段的索引为空时，索引都用不上，直接用 icontains。
+    """
+    _, field, sizes = SEARCH_FIELDS[kind]
+    text = text.strip()
+    exact = Q(**{f'{field}__icontains': text})
+    if not query_grams(text, sizes):
+        return exact
+    gram, n = rarest_gram(kind, text)
+    if n == 0:
+        # 索引还没建（升级后未迁移 / 未重建）时不能当成“没有匹配”，退回 icontains
+        return Q(pk__in=[]) if searchgram.objects.filter(kind=kind).exists() else exact
+    if n >= COMMON_GRAM:
+        return exact
+    return Q(pk__in=searchgram.objects.filter(kind=kind, gram=gram).values('key')) & exact
+
+
+def match(queryset, kind, text):
+    if not text.strip():
+        return queryset
+    return queryset.filter(search_q(kind, text))
+
+
+# ==================== 维护索引 ====================
+
+def _rows(kind, key, value):
+    return [searchgram(kind=kind, gram=g, key=key) for g in grams(value, SEARCH_FIELDS[kind][2])]
+
+
+def index_objects(instances):
+    """为同一模型的一批对象重写索引（单条保存和 bulk_create 之后都用它）"""
+    instances = list(instances)
+    if not instances:
+        return
+    kinds = kinds_of(type(instances[0]))
+    if not kinds:
+        return
+    rows = [
+        row
+        for obj in instances
+        for kind in kinds
+        for row in _rows(kind, obj.pk, getattr(obj, SEARCH_FIELDS[kind][1]))
+    ]
+    with transaction.atomic():
+        searchgram.objects.filter(kind__in=kinds, key__in=[obj.pk for obj in instances]).delete()
+        searchgram.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+
+def unindex(instance):
+    kinds = kinds_of(type(instance))
+    if kinds:
+        searchgram.objects.filter(kind__in=kinds, key=instance.pk).delete()
+
+
+def rebuild(kinds=None):
+    """全量重建指定 kind（默认全部）的索引，返回写入的 n-gram 行数"""
+    total = 0
+    for kind in kinds or SEARCH_FIELDS:
+        model, field, _ = SEARCH_FIELDS[kind]
+        with transaction.atomic():
+            searchgram.objects.filter(kind=kind).delete()
+            batch = []
+            values = model.objects.order_by().values_list('pk', field).iterator(chunk_size=BATCH_SIZE)
+            for key, value in values:
+                batch.extend(_rows(kind, key, value))
+                if len(batch) >= BATCH_SIZE:
+                    searchgram.objects.bulk_create(batch)
+                    total += len(batch)
+                    batch = []
+            searchgram.objects.bulk_create(batch)
+            total += len(batch)
+    return total
+
+
+# ==================== 联想 ====================
+
+SUGGEST_KINDS = ('student', 'course', 'class')
+
+
+def suggest(text, kinds=SUGGEST_KINDS, limit=SUGGEST_LIMIT):
+    """输入联想：学生（学号或姓名）、课程、班级各取前 limit 条"""
+    result = {}
+    empty = not normalize(text)
+    if 'student' in kinds:
+        students = [] if empty else (
+            student.objects.filter(search_q('sno', text) | search_q('sname', text))
+            .order_by('sno').values('sno', 'sname', 'classno__classname')[:limit]
+        )
+        result['students'] = [
+            {'sno': s['sno'], 'sname': s['sname'], 'classname': s['classno__classname']} for s in students
+        ]
+    if 'course' in kinds:
+        result['courses'] = [] if empty else list(
+            match(course.objects.all(), 'cname', text).order_by('cno').values('cno', 'cname')[:limit]
+        )
+    if 'class' in kinds:
+        result['classes'] = [] if empty else list(
+            match(cl.objects.all(), 'classname', text).order_by('classno').values('classno', 'classname')[:limit]
+        )
+    return result
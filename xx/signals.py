@@ -0,0 +1,166 @@
+"""
+模型写入后的联动处理（缓存失效、统计快照等），在 XxConfig.ready() 中注册。
+bulk_create / bulk_update 不会发信号，批量写入的代码需显式调用下面的 *_bulk_changed。
+"""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import search, stats, transcripts
+from .cache import bump
+from .models import cl, course, depart, sc, student
+
+
+# ==================== 写入前：记下旧值，供增量统计使用 ====================
+
+@receiver(pre_save, sender=student)
+def student_before_save(sender, instance, **kwargs):
+    if not instance._state.adding:
+        instance._old_classno = sender.objects.filter(pk=instance.pk).values_list('classno_id', flat=True).first()
+
+
+@receiver(pre_save, sender=sc)
+def sc_before_save(sender, instance, **kwargs):
+    if not instance._state.adding:
+        instance._old_grade = sender.objects.filter(pk=instance.pk).values_list('grade', flat=True).first()
+
+
+# ==================== 写入后 ====================
+
+@receiver([post_save, post_delete], sender=student)
+@receiver([post_save, post_delete], sender=cl)
+@receiver([post_save, post_delete], sender=depart)
+@receiver([post_save, post_delete], sender=course)
+@receiver([post_save, post_delete], sender=sc)
+def data_changed(sender, **kwargs):
+    # 所有读缓存（视图、分面计数等）都以表版本号为键，这里统一 +1（事务提交后才生效，见 cache.bump）
+    bump(sender._meta.model_name)
+
+
+@receiver(post_save, sender=student)
+def student_saved(sender, instance, created, **kwargs):
+    if created:
+        stats.student_added(instance)
+        transcripts.create_for([instance.pk])
+    elif getattr(instance, '_old_classno', None) not in (None, instance.classno_id):
+        stats.student_moved(instance, instance._old_classno)
+
+
+@receiver(post_delete, sender=student)
+def student_deleted(sender, instance, **kwargs):
+    stats.student_removed(instance)
+
+
+@receiver(post_save, sender=sc)
+def sc_saved(sender, instance, created, **kwargs):
+    if created:
+        stats.sc_added(instance)
+    else:
+        stats.sc_regraded(instance, getattr(instance, '_old_grade', None))
+    transcripts.sc_changed(instance)
+
+
+@receiver(post_delete, sender=sc)
+def sc_deleted(sender, instance, origin=None, **kwargs):
+    stats.sc_removed(instance, origin)
+    transcripts.sc_changed(instance, origin)
+
+
+@receiver(post_save, sender=cl)
+def class_saved(sender, instance, created, **kwargs):
+    if created:
+        stats.class_added()
+    else:
+        # 班级可能换了系部，两个系部的人数都重算
+        for dno in {instance.dno_id, getattr(instance, '_old_dno', None)}:
+            stats.refresh_depart(dno)
+
+
+@receiver(pre_save, sender=cl)
+def class_before_save(sender, instance, **kwargs):
+    if not instance._state.adding:
+        instance._old_dno = sender.objects.filter(pk=instance.pk).values_list('dno_id', flat=True).first()
+
+
+@receiver(post_delete, sender=cl)
+def class_deleted(sender, instance, **kwargs):
+    stats.class_removed()
+
+
+@receiver(post_save, sender=depart)
+def depart_saved(sender, instance, created, **kwargs):
+    if created:
+        stats.depart_added(instance)
+
+
+@receiver(post_delete, sender=depart)
+def depart_deleted(sender, instance, **kwargs):
+    stats.depart_removed()
+
+
+@receiver(pre_save, sender=course)
+def course_before_save(sender, instance, **kwargs):
+    if not instance._state.adding:
+        instance._old_credit = sender.objects.filter(pk=instance.pk).values_list('credit', flat=True).first()
+
+
+@receiver(post_save, sender=course)
+def course_saved(sender, instance, created, **kwargs):
+    if created:
+        stats.course_added()
+    elif getattr(instance, '_old_credit', None) != instance.credit:
+        # 学分变了，选了这门课的学生汇总都要重算
+        transcripts.credit_changed(instance.pk)
+
+
+@receiver(post_delete, sender=course)
+def course_deleted(sender, instance, **kwargs):
+    stats.course_removed()
+
+
+@receiver(post_save, sender=student)
+@receiver(post_save, sender=course)
+@receiver(post_save, sender=cl)
+def search_indexed(sender, instance, **kwargs):
+    search.index_objects([instance])
+
+
+@receiver(post_delete, sender=student)
+@receiver(post_delete, sender=course)
+@receiver(post_delete, sender=cl)
+def search_unindexed(sender, instance, **kwargs):
+    search.unindex(instance)
+
+
+# ==================== 批量写入的显式钩子 ====================
+
+def students_bulk_created(instances):
+    """bulk_create student 后、在同一事务内调用（每批一次）"""
+    search.index_objects(instances)
+    transcripts.create_for([obj.pk for obj in instances])
+
+
+def students_bulk_changed():
+    """批量写入 student 后调用"""
+    bump('student')
+    stats.refresh_students()
+
+
+def sc_bulk_regraded(snos, changes):
+    """bulk_update sc 成绩后、在同一事务内调用；changes 为 (旧成绩, 新成绩) 列表"""
+    bump('sc')
+    stats.sc_regraded_many(changes)
+    transcripts.refresh_many(snos)
+
+
+def sc_bulk_added(added, first_enrolled):
+    """批量选课插入 sc 后、在同一事务内调用（每批一次）；added 为 {学号: 新增课程号元组}，新记录都没有成绩"""
+    bump('sc')
+    stats.students_enrolled(first_enrolled)
+    transcripts.courses_added(added)
+
+
+def sc_bulk_changed(snos=()):
+    """批量写入 sc 后调用；snos 为涉及的学生，用于重算成绩汇总"""
+    bump('sc')
+    stats.refresh_sc()
+    transcripts.refresh_many(snos)
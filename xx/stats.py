@@ -0,0 +1,291 @@
+"""
+仪表盘统计快照：dashstat（全局计数）+ departstat（各系部计数）。
+单条写入由 signals.py 中的信号增量更新：事务内的增量先在内存里累加，提交后每行合并成一次 F 表达式 UPDATE，
+全局只有一行的 dashstat 不会被每个写事务锁到提交为止；不在事务里时立即更新。
+批量写入调用 refresh_*；`python manage.py rebuild_stats` 可随时全量重建。
+"""
+import threading
+import weakref
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+
+from .models import cl, course, dashstat, depart, departstat, sc, student
+
+SNAPSHOT_ID = 1
+
+
+class _Deltas:
+    """一个事务（保存点）内累加的增量，{系部号或 None（dashstat）: {字段: 增量}}；作为 on_commit 回调执行"""
+
+    def __init__(self):
+        self.deltas = {}
+
+    def add(self, dno, deltas):
+        row = self.deltas.setdefault(dno, {})
+        for name, delta in deltas.items():
+            row[name] = row.get(name, 0) + delta
+
+    def __call__(self):
+        applied, self.deltas = self.deltas, {}
+        for dno, deltas in applied.items():
+            deltas = {name: delta for name, delta in deltas.items() if delta}
+            if not deltas:
+                continue
+            rows = dashstat.objects.filter(pk=SNAPSHOT_ID) if dno is None else departstat.objects.filter(pk=dno)
+            rows.update(**{name: F(name) + delta for name, delta in deltas.items()})
+
+
+_local = threading.local()
+
+
+def _pending_deltas():
+    """
+    当前保存点对应的累加器。回调按注册时的保存点登记，保存点回滚时 Django 连同回调一起丢弃，
+    所以只复用仍在回调队列里、且保存点相同的那一个。
+    """
+    callbacks = connection.run_on_commit
+    pending = getattr(_local, 'pending', None)
+    if pending is not None:
+        index, deltas = pending
+        if index < len(callbacks) and callbacks[index][1] is deltas and callbacks[index][0] == set(connection.savepoint_ids):
+            return deltas
+    deltas = _Deltas()
+    transaction.on_commit(deltas)
+    _local.pending = (len(callbacks) - 1, deltas)
+    return deltas
+
+
+def _queue(dno, deltas):
+    if connection.in_atomic_block:
+        _pending_deltas().add(dno, deltas)
+    else:
+        immediate = _Deltas()
+        immediate.add(dno, deltas)
+        immediate()
+
+
+def _unapplied(dno, name):
+    """本事务里已累加、提交后才写入的增量；重算出的绝对值要先减掉，提交后加回来正好等于重算值"""
+    if not connection.in_atomic_block:
+        return 0
+    return sum(
+        func.deltas.get(dno, {}).get(name, 0)
+        for _, func, _ in connection.run_on_commit if isinstance(func, _Deltas)
+    )
+
+
+def _bump(**deltas):
+    _queue(None, deltas)
+
+
+def _bump_depart(dno, **deltas):
+    if dno is None:
+        return
+    _queue(dno, deltas)
+
+
+def depart_of_class(classno):
+    return cl.objects.filter(pk=classno).values_list('dno_id', flat=True).first()
+
+
+def depart_of_student(sno):
+    return student.objects.filter(pk=sno).values_list('classno__dno_id', flat=True).first()
+
+
+# ==================== 全量重建 ====================
+
+def _student_counts():
+    return dict(
+        student.objects.order_by().values_list('classno__dno_id').annotate(n=Count('sno'))
+    )
+
+
+def _enrolled_counts():
+    return dict(
+        sc.objects.order_by().values_list('sno__classno__dno_id').annotate(n=Count('sno', distinct=True))
+    )
+
+
+def _grade_totals():
+    totals = sc.objects.filter(grade__isnull=False).aggregate(n=Count('grade'), s=Sum('grade'))
+    return totals['n'] or 0, totals['s'] or 0
+
+
+@transaction.atomic
+def rebuild():
+    # 锁住快照行：并发的全量重建排队执行，不会互相删掉对方刚建好的 departstat
+    dashstat.objects.get_or_create(pk=SNAPSHOT_ID)
+    dashstat.objects.select_for_update().get(pk=SNAPSHOT_ID)
+    graded_count, grade_sum = _grade_totals()
+    totals = {
+        'student_total': student.objects.count(),
+        'course_total': course.objects.count(),
+        'class_total': cl.objects.count(),
+        'depart_total': depart.objects.count(),
+        'graded_count': graded_count,
+        'grade_sum': grade_sum,
+    }
+    dashstat.objects.filter(pk=SNAPSHOT_ID).update(
+        **{name: value - _unapplied(None, name) for name, value in totals.items()}
+    )
+
+    students = _student_counts()
+    enrolled = _enrolled_counts()
+    departstat.objects.all().delete()
+    departstat.objects.bulk_create([
+        departstat(
+            dno_id=dno,
+            students=students.get(dno, 0) - _unapplied(dno, 'students'),
+            enrolled=enrolled.get(dno, 0) - _unapplied(dno, 'enrolled'),
+        )
+        for dno in depart.objects.values_list('dno', flat=True)
+    ])
+
+
+def refresh_students():
+    """批量导入学生后：重算学生总数和各系部人数"""
+    students = _student_counts()
+    with transaction.atomic():
+        dashstat.objects.filter(pk=SNAPSHOT_ID).update(
+            student_total=sum(students.values()) - _unapplied(None, 'student_total'),
+        )
+        for stat in departstat.objects.select_for_update():
+            stat.students = students.get(stat.dno_id, 0) - _unapplied(stat.dno_id, 'students')
+            stat.save(update_fields=['students'])
+
+
+def refresh_sc():
+    """批量选课 / 批量录入成绩后：重算成绩合计和各系部选课人数"""
+    graded_count, grade_sum = _grade_totals()
+    enrolled = _enrolled_counts()
+    with transaction.atomic():
+        dashstat.objects.filter(pk=SNAPSHOT_ID).update(
+            graded_count=graded_count - _unapplied(None, 'graded_count'),
+            grade_sum=grade_sum - _unapplied(None, 'grade_sum'),
+        )
+        for stat in departstat.objects.select_for_update():
+            stat.enrolled = enrolled.get(stat.dno_id, 0) - _unapplied(stat.dno_id, 'enrolled')
+            stat.save(update_fields=['enrolled'])
+
+
+def refresh_depart(dno):
+    """某个系部的人数需要整体重算时（例如班级换了系部）"""
+    if dno is None:
+        return
+    departstat.objects.filter(pk=dno).update(
+        students=student.objects.filter(classno__dno_id=dno).count() - _unapplied(dno, 'students'),
+        enrolled=sc.objects.filter(sno__classno__dno_id=dno).values('sno').distinct().count() - _unapplied(dno, 'enrolled'),
+    )
+
+
+# ==================== 增量维护 ====================
+
+def student_added(instance):
+    _bump(student_total=1)
+    _bump_depart(depart_of_class(instance.classno_id), students=1)
+
+
+def student_moved(instance, old_classno):
+    old_dno = depart_of_class(old_classno)
+    new_dno = depart_of_class(instance.classno_id)
+    if old_dno == new_dno:
+        return
+    has_sc = int(sc.objects.filter(sno_id=instance.pk).exists())
+    _bump_depart(old_dno, students=-1, enrolled=-has_sc)
+    _bump_depart(new_dno, students=1, enrolled=has_sc)
+
+
+def student_removed(instance):
+    # 该生的选课记录先于学生被级联删除，enrolled 已在 sc_removed 中处理
+    _bump(student_total=-1)
+    _bump_depart(depart_of_class(instance.classno_id), students=-1)
+
+
+def sc_added(instance):
+    if instance.grade is not None:
+        _bump(graded_count=1, grade_sum=instance.grade)
+    if sc.objects.filter(sno_id=instance.sno_id).count() == 1:
+        _bump_depart(depart_of_student(instance.sno_id), enrolled=1)
+
+
+def sc_regraded(instance, old_grade):
+    new_grade = instance.grade
+    if new_grade is not None:
+        new_grade = float(new_grade)
+    sc_regraded_many([(old_grade, new_grade)])
+
+
+def sc_regraded_many(changes):
+    """changes 为 (旧成绩, 新成绩) 列表，合并成一次 UPDATE"""
+    changes = [(old, new) for old, new in changes if old != new]
+    if not changes:
+        return
+    _bump(
+        graded_count=sum((new is not None) - (old is not None) for old, new in changes),
+        grade_sum=sum((new or 0) - (old or 0) for old, new in changes),
+    )
+
+
+def students_enrolled(snos):
+    """批量选课中第一次有选课记录的学生，按系部合并成每系一次 UPDATE"""
+    if not snos:
+        return
+    counts = student.objects.filter(sno__in=snos).order_by().values_list('classno__dno_id').annotate(n=Count('sno'))
+    for dno, n in counts:
+        _bump_depart(dno, enrolled=n)
+
+
+# 级联删除时同一学生的多条选课记录先被一起删掉，再逐条发 post_delete；
+# 按删除源（origin）记下已扣减过的学生，避免重复扣减
+_unenrolled = weakref.WeakKeyDictionary()
+
+
+def sc_removed(instance, origin=None):
+    if instance.grade is not None:
+        _bump(graded_count=-1, grade_sum=-instance.grade)
+    if sc.objects.filter(sno_id=instance.sno_id).exists():
+        return
+    if origin is not None:
+        done = _unenrolled.setdefault(origin, set())
+        if instance.sno_id in done:
+            return
+        done.add(instance.sno_id)
+    _bump_depart(depart_of_student(instance.sno_id), enrolled=-1)
+
+
+def class_added():
+    _bump(class_total=1)
+
+
+def class_removed():
+    _bump(class_total=-1)
+
+
+def depart_added(instance):
+    _bump(depart_total=1)
+    departstat.objects.get_or_create(dno_id=instance.pk)
+
+
+def depart_removed():
+    _bump(depart_total=-1)
+
+
+def course_added():
+    _bump(course_total=1)
+
+
+def course_removed():
+    _bump(course_total=-1)
+
+
+# ==================== 读取 ====================
+
+def snapshot():
+    """仪表盘读取入口；快照不存在时先全量重建"""
+    snap = dashstat.objects.filter(pk=SNAPSHOT_ID).first()
+    if snap is None:
+        rebuild()
+        snap = dashstat.objects.get(pk=SNAPSHOT_ID)
+    departs = list(departstat.objects.select_related('dno'))
+    return snap, departs
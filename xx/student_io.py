@@ -0,0 +1,275 @@
+"""
+学生数据批量导入导出：
+导入以只读模式流式读取 Excel，按批校验并用 bulk_create 写入；
+导出用 values_list + iterator 分块读取，逐行写出 XLSX / CSV / NDJSON。
+"""
+import csv
+import json
+
+from django.db import DatabaseError, transaction
+from openpyxl import Workbook, load_workbook
+
+from .models import cl, student
+from .search import match
+from .signals import students_bulk_changed, students_bulk_created
+
+STUDENT_HEADERS = [
+    'sno', 'sname', 'sex', 'native', 'age',
+    'classno', 'semester', 'home', 'telephone'
+]
+IMPORT_BATCH_SIZE = 2000
+EXPORT_CHUNK_SIZE = 2000
+# 导出列与导入表头一一对应，classno 直接取外键列，无需关联 cl
+EXPORT_COLUMNS = [
+    'sno', 'sname', 'sex', 'native', 'age',
+    'classno_id', 'semester', 'home', 'telephone'
+]
+
+SEX_VALUES = {'boy': 'boy', 'girl': 'girl', '男': 'boy', '女': 'girl'}
+
+
+class ImportFormatError(Exception):
+    """表头等整体格式问题，整份文件不导入"""
+
+
+class ImportResult:
+    def __init__(self):
+        self.success = 0
+        self.errors = []
+        self.rows = 0
+
+
+def _text(value):
+    if value is None:
+        return ''
+    # Excel 中的纯数字学号 / 电话会被读成 float
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _int_or_none(value, label):
+    if value is None or value == '':
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{label}必须是整数')
+    if not number.is_integer():
+        raise ValueError(f'{label}必须是整数')
+    return int(number)
+
+
+_MAX_LENGTH = {
+    f.attname: f.max_length
+    for f in student._meta.concrete_fields
+    if getattr(f, 'max_length', None)
+}
+
+
+def _build_student(data, class_set):
+    """把一行数据转成 student 对象，数据不合法时抛 ValueError"""
+    sno = _text(data.get('sno'))
+    sname = _text(data.get('sname'))
+    classno = _text(data.get('classno'))
+    if not sno:
+        raise ValueError('学号不能为空')
+    if not sname:
+        raise ValueError('姓名不能为空')
+    if classno not in class_set:
+        raise ValueError('班级不存在')
+
+    sex = _text(data.get('sex')) or 'girl'
+    if sex not in SEX_VALUES:
+        raise ValueError(f'性别不合法：{sex}')
+
+    values = {
+        'sno': sno,
+        'sname': sname,
+        'sex': SEX_VALUES[sex],
+        'native': _text(data.get('native')),
+        'age': _int_or_none(data.get('age'), '年龄'),
+        'classno_id': classno,
+        'semester': _int_or_none(data.get('semester'), '学期'),
+        'home': _text(data.get('home')),
+        'telephone': _text(data.get('telephone')),
+    }
+    for name, max_length in _MAX_LENGTH.items():
+        value = values.get(name)
+        if isinstance(value, str) and len(value) > max_length:
+            raise ValueError(f'{name} 超过最大长度 {max_length}')
+    return student(**values)
+
+
+def _flush(batch, class_set, seen, result):
+    snos = [_text(data.get('sno')) for _, data in batch]
+    # 一次查询检查整批学号
+    existing = set(student.objects.filter(sno__in=snos).values_list('sno', flat=True))
+
+    valid = []
+    for (idx, data), sno in zip(batch, snos):
+        try:
+            if sno in existing or sno in seen:
+                raise ValueError('学号已存在')
+            obj = _build_student(data, class_set)
+        except ValueError as e:
+            result.errors.append(f"第{idx}行（学号 {sno or '未知'}）：{e}")
+            continue
+        seen.add(sno)
+        valid.append((idx, obj))
+
+    if not valid:
+        return
+
+    try:
+        with transaction.atomic():
+            created = student.objects.bulk_create([obj for _, obj in valid])
+            students_bulk_created(created)
+        result.success += len(valid)
+    except DatabaseError:
+        # 整批失败时逐行重试，保留部分成功和逐行错误信息
+        for idx, obj in valid:
+            try:
+                with transaction.atomic():
+                    obj.save(force_insert=True)
+                result.success += 1
+            except DatabaseError as e:
+                result.errors.append(f"第{idx}行（学号 {obj.sno}）：{e}")
+
+
+def _flush_batch(batch, class_set, seen, result, checkpoint):
+    if checkpoint is None:
+        _flush(batch, class_set, seen, result)
+        return
+    # 写入和续跑位置一起提交：中断后从这里继续，已导入的行不会被当成“学号已存在”再报一次
+    with transaction.atomic():
+        _flush(batch, class_set, seen, result)
+        checkpoint(result)
+
+
+def import_students(file, batch_size=IMPORT_BATCH_SIZE, progress=None, start_row=0, checkpoint=None):
+    """
+    导入学生，返回 ImportResult。
+    progress(rows) 每处理完一批调用一次，rows 为已读取的数据行数。
+    start_row > 0 时跳过前 start_row 条数据行（续跑：这些行上次已处理并提交），返回的 rows 包含跳过的行。
+    checkpoint(result) 在每批写入的同一事务内调用，用来记录续跑位置。
+    """
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        headers = list(next(rows, ()))
+        while headers and headers[-1] is None:
+            headers.pop()
+        if headers != STUDENT_HEADERS:
+            raise ImportFormatError('Excel 表头格式不正确，应为：' + ', '.join(STUDENT_HEADERS))
+
+        class_set = set(cl.objects.values_list('classno', flat=True))
+        seen = set()
+        result = ImportResult()
+        batch = []
+
+        for idx, row in enumerate(rows, start=2):
+            data = dict(zip(headers, row))
+            # 跳过空行
+            if not data.get('sno'):
+                continue
+            result.rows += 1
+            if result.rows <= start_row:
+                continue
+            batch.append((idx, data))
+            if len(batch) >= batch_size:
+                _flush_batch(batch, class_set, seen, result, checkpoint)
+                batch = []
+                if progress:
+                    progress(result.rows)
+
+        if batch:
+            _flush_batch(batch, class_set, seen, result, checkpoint)
+            if progress:
+                progress(result.rows)
+    finally:
+        wb.close()
+
+    if result.success:
+        students_bulk_changed()
+    return result
+
+
+# ==================== 筛选 / 排序 ====================
+
+# 排序字段白名单（classno 直接用外键列排序，避免为排序多做一次关联）
+ORDER_MAP = {
+    'sno': 'sno',
+    'sname': 'sname',
+    'age': 'age',
+    'classno': 'classno_id',
+    'semester': 'semester',
+}
+
+
+def student_order(params):
+    """返回 (排序字段, 是否降序)"""
+    order = params.get('order', 'sno')
+    direction = params.get('direction', 'asc')
+    return ORDER_MAP.get(order, 'sno'), direction == 'desc'
+
+
+def filter_students(queryset, params):
+    """按学生列表的筛选参数过滤，params 可以是 request.GET 或普通 dict"""
+    sno = (params.get('sno') or '').strip()
+    sname = (params.get('sname') or '').strip()
+    sex = (params.get('sex') or '').strip()
+    classno = (params.get('classno') or '').strip()
+
+    # 学号 / 姓名的模糊查询走 n-gram 索引，见 search.py
+    if sno:
+        queryset = match(queryset, 'sno', sno)
+    if sname:
+        queryset = match(queryset, 'sname', sname)
+    if sex:
+        queryset = queryset.filter(sex=sex)
+    if classno:
+        queryset = queryset.filter(classno__classno=classno)
+    return queryset
+
+
+# ==================== 导出 ====================
+
+def export_rows(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """按导出列逐行产出元组，服务端分块读取，不缓存整个结果集"""
+    return queryset.values_list(*EXPORT_COLUMNS).iterator(chunk_size=chunk_size)
+
+
+def _blank(row):
+    # 表格类格式里空值写成空串（与原 Excel 导出一致）
+    return ['' if value is None else value for value in row]
+
+
+class _Echo:
+    """csv.writer 的伪文件对象：write 直接返回写入内容"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    writer = csv.writer(_Echo())
+    # BOM 让 Excel 正确识别 UTF-8 中文
+    yield '\ufeff' + writer.writerow(STUDENT_HEADERS)
+    for row in rows:
+        yield writer.writerow(_blank(row))
+
+
+def iter_ndjson(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(STUDENT_HEADERS, row)), ensure_ascii=False) + '\n'
+
+
+def write_xlsx(rows, fileobj):
+    """write-only 模式逐行写入，内存占用与行数无关"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('学生信息')
+    ws.append(STUDENT_HEADERS)
+    for row in rows:
+        ws.append(_blank(row))
+    wb.save(fileobj)
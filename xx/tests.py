@@ -1,3 +1,1326 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import Workbook, load_workbook
+
+from . import (
+    ai_client, cache, chat_history, columnar, enrollment, facets, governor, intents, jobs, prompt, result_cache,
+    result_pages, sandbox, search, stats, student_io, transcripts,
+)
+from .code_cache import CodeCache, code_cache, normalize_query
+from .models import chatmsg, cl, course, dashstat, depart, departstat, job, sc, searchgram, student, transcript
+from .pagination import KeysetPaginator, decode_cursor
+
+
+# ==================== 查询计划 ====================
+
+def full_scans(queryset):
+    """
+    对查询执行 EXPLAIN，返回被全表扫描的表名。
+    按索引顺序扫描（SQLite 的 SCAN ... USING INDEX、MySQL 的 type=index）不算全表扫描。
+    """
+    sql, params = queryset.query.sql_with_params()
+    vendor = connection.vendor
+    with connection.cursor() as cursor:
+        if vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            details = [row[-1] for row in cursor.fetchall()]
+            return [
+                d.split()[1] for d in details
+                if d.startswith('SCAN ') and 'USING' not in d and 'SUBQUERY' not in d
+            ]
+        if vendor == 'mysql':
+            cursor.execute(f'EXPLAIN {sql}', params)
+            columns = [c[0] for c in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            return [r['table'] for r in rows if r['type'] == 'ALL']
+        if vendor == 'postgresql':
+            cursor.execute(f'EXPLAIN {sql}', params)
+            return [
+                line.split('Seq Scan on ')[1].split()[0]
+                for (line,) in cursor.fetchall() if 'Seq Scan on ' in line
+            ]
+    raise NotImplementedError(vendor)
+
+
+class QueryPlanTests(TestCase):
+    """各视图主要查询必须走索引；新增查询或改动索引导致全表扫描时测试失败"""
+
+    @classmethod
+    def setUpTestData(cls):
+        departs = depart.objects.bulk_create([
+            depart(dno=f'd{i}', dname=f'系部{i}') for i in range(5)
+        ])
+        classes = cl.objects.bulk_create([
+            cl(classno=f'c{i:02d}', classname=f'班级{i}', dno=departs[i % 5]) for i in range(20)
+        ])
+        students = student.objects.bulk_create([
+            student(
+                sno=f'{i:05d}', sname=f'学生{i}', sex='boy' if i % 2 else 'girl', age=17 + i % 6,
+                classno=classes[i % 20], semester=1 + i % 8, home='', telephone='',
+            )
+            for i in range(400)
+        ])
+        types = [t for t, _ in course._meta.get_field('type').choices]
+        courses = course.objects.bulk_create([
+            course(cno=f'{i:03d}', cname=f'课程{i}', credit=2, semester=1 + i % 8, type=types[i % len(types)])
+            for i in range(60)
+        ])
+        sc.objects.bulk_create([
+            sc(sno=s, cno=courses[(i + k) % 60], grade=None if k == 0 else 40 + (i * 7 + k) % 60)
+            for i, s in enumerate(students) for k in range(6)
+        ])
+        job.objects.bulk_create([
+            job(kind='student_export', status=('pending', 'running', 'done', 'failed')[i % 4])
+            for i in range(40)
+        ])
+        cls.types = types
+
+    def assertIndexed(self, queryset):
+        self.assertEqual(full_scans(queryset), [], str(queryset.query))
+
+    def test_student_list(self):
+        qs = student.objects.filter(classno_id='c03', sex='boy').order_by('sno')[:21]
+        self.assertIndexed(qs)
+
+    def test_student_keyset_pages(self):
+        for field in ('sname', 'age', 'semester'):
+            for descending in (False, True):
+                paginator = KeysetPaginator(student.objects.all(), field, descending)
+                self.assertIndexed(paginator.ordered()[:21])
+                value, pk = decode_cursor(paginator.page().next_cursor)
+                seek = paginator.queryset.filter(paginator._seek(value, pk, descending))
+                self.assertIndexed(seek.order_by(*paginator._ordering(descending))[:21])
+
+    def test_search(self):
+        search.rebuild()
+        self.assertIndexed(search.match(student.objects.all(), 'sname', '学生1'))
+        self.assertIndexed(search.match(student.objects.all(), 'sno', '0012'))
+        self.assertIndexed(search.match(course.objects.all(), 'cname', '课程'))
+
+    def test_student_detail(self):
+        self.assertIndexed(sc.objects.select_related('cno').filter(sno_id='00007'))
+
+    def test_select_course(self):
+        self.assertIndexed(sc.objects.filter(sno_id='00007', cno_id='003'))
+
+    def test_course_list(self):
+        self.assertIndexed(course.objects.filter(type=self.types[0]))
+        self.assertIndexed(course.objects.filter(type=self.types[0], semester=3))
+        self.assertIndexed(course.objects.filter(semester=3))
+
+    def test_course_students(self):
+        records = sc.objects.filter(cno_id='003')
+        self.assertIndexed(records)
+        graded = records.filter(grade__isnull=False)
+        self.assertIndexed(graded)
+        self.assertIndexed(graded.filter(grade__gte=80, grade__lt=90))
+
+    def test_course_grade_stats(self):
+        rows = sc.objects.order_by('cno_id', 'grade').values_list('cno_id', 'grade')
+        self.assertIndexed(rows)
+        self.assertIndexed(rows.filter(cno_id__in=['003', '004']))
+
+    def test_job_claim(self):
+        self.assertIndexed(job.objects.filter(status='pending').order_by('id').values_list('id', flat=True)[:5])
+
+
+# ==================== 学生列表 ====================
+
+class StudentListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('list', password='x')
+        d = depart.objects.create(dno='d1', dname='系部1')
+        classes = [cl.objects.create(classno=f'c{i}', classname=f'班级{i}', dno=d) for i in range(3)]
+        student.objects.bulk_create([
+            student(sno=f'{i:03d}', sname=f'学生{i}', sex='boy' if i % 3 else 'girl', age=18,
+                    classno=classes[i % 2], semester=1)
+            for i in range(10)
+        ])
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def walk(self, paginator, backwards=False):
+        """从第一页向后（或从最后一页向前）逐页翻完，返回按列表顺序排列的学号"""
+        page = paginator.page(last=backwards)
+        pages = [page]
+        while page.has_previous if backwards else page.has_next:
+            page = paginator.page(before=page.prev_cursor) if backwards else paginator.page(after=page.next_cursor)
+            pages.append(page)
+        if backwards:
+            pages.reverse()
+        return [s.sno for page in pages for s in page]
+
+    def test_keyset_pages_across_nulls(self):
+        # 年龄、学期有 NULL，姓名有重复：翻页不重不漏，前后翻得到同样的顺序
+        student.objects.filter(sno__in=['001', '004', '007']).update(age=None)
+        student.objects.filter(sno__in=['002', '003']).update(semester=None)
+        student.objects.filter(sno__in=['005', '006', '008']).update(sname='同名')
+        for field in ('sno', 'sname', 'age', 'semester', 'classno_id'):
+            for descending in (False, True):
+                with self.subTest(field=field, descending=descending):
+                    paginator = KeysetPaginator(student.objects.all(), field, descending, per_page=3)
+                    expected = [s.sno for s in paginator.ordered()]
+                    self.assertEqual(sorted(expected), [f'{i:03d}' for i in range(10)])
+                    self.assertEqual(self.walk(paginator), expected)
+                    self.assertEqual(self.walk(paginator, backwards=True), expected)
+
+    def test_page_cursors(self):
+        # 凑够两页（每页 20 条）
+        student.objects.bulk_create([
+            student(sno=f'{i:03d}', sname=f'学生{i}', sex='boy', age=20, classno_id='c2', semester=2)
+            for i in range(10, 30)
+        ])
+        student.objects.filter(sno__in=['000', '001']).update(age=None)
+        self.client.force_login(self.user)
+        url = reverse('student_list')
+        first = self.client.get(url, {'order': 'age'}).context['page']
+        self.assertEqual([s.sno for s in first][:2], ['000', '001'])
+        second = self.client.get(url, {'order': 'age', 'after': first.next_cursor}).context['page']
+        self.assertTrue(second.has_previous)
+        back = self.client.get(url, {'order': 'age', 'before': second.prev_cursor}).context['page']
+        self.assertEqual([s.sno for s in back], [s.sno for s in first])
+
+    def test_facets(self):
+        student.objects.filter(sno__in=['000', '001']).update(semester=None)
+        self.assertEqual(facets.student_facets(student.objects.all(), {}), {
+            'total': 10, 'sex': {'boy': 6, 'girl': 4}, 'class_count': 2,
+            'departs': {'d1': {'dname': '系部1', 'count': 10}}, 'semesters': {1: 8, None: 2},
+        })
+        girls = student.objects.filter(sex='girl')
+        self.assertEqual(facets.student_facets(girls, {'sex': 'girl'})['sex'], {'boy': 0, 'girl': 4})
+
+    def test_depart_rename(self):
+        self.assertEqual(facets.student_facets(student.objects.all(), {})['departs']['d1']['dname'], '系部1')
+        # 系部名称来自班级映射，改名后缓存的分面也要失效
+        with self.captureOnCommitCallbacks(execute=True):
+            d = depart.objects.get(pk='d1')
+            d.dname = '新系部'
+            d.save()
+        self.assertEqual(facets.student_facets(student.objects.all(), {})['departs']['d1']['dname'], '新系部')
+
+    def test_page_shows_facets(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('student_list'), {'sex': 'boy'})
+        self.assertEqual(
+            (response.context['total_count'], response.context['boy_count'], response.context['class_count']),
+            (6, 6, 2),
+        )
+        self.assertContains(response, '系部1 <strong>6</strong>')
+        self.assertContains(response, '第1学期 <strong>6</strong>')
+
+
+# ==================== 导入导出 ====================
+
+def xlsx(rows, headers=student_io.STUDENT_HEADERS):
+    wb = Workbook()
+    wb.active.append(headers)
+    for row in rows:
+        wb.active.append(row)
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+class StudentImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        d = depart.objects.create(dno='d1', dname='系部1')
+        c = cl.objects.create(classno='c1', classname='班级1', dno=d)
+        student.objects.create(sno='001', sname='张三', sex='boy', age=19, classno=c, semester=1)
+
+    def test_import(self):
+        rows = [
+            ['002', '李四', '男', '北京', 20, 'c1', 1, '', 13800000000.0],
+            [3.0, '王五', 'girl', '', None, 'c1', None, '', ''],    # 数字学号读成 3.0
+            ['001', '重复', 'boy', '', 19, 'c1', 1, '', ''],      # 库里已有
+            ['002', '重复', 'boy', '', 19, 'c1', 1, '', ''],      # 文件里重复
+            ['004', '赵六', 'boy', '', 19, 'c9', 1, '', ''],      # 班级不存在
+            ['005', '钱七', '未知', '', 19, 'c1', 1, '', ''],
+            ['006', '孙八', 'boy', '', 19.5, 'c1', 1, '', ''],
+            [None, None, None, None, None, None, None, None, None],  # 空行跳过
+            ['007', '周九', 'boy', '', 19, 'c1', 1, '', ''],
+        ]
+        progress = []
+        result = student_io.import_students(xlsx(rows), batch_size=3, progress=progress.append)
+        self.assertEqual((result.rows, result.success, len(result.errors)), (8, 3, 5))
+        self.assertEqual(progress, [3, 6, 8])
+        self.assertIn('第4行（学号 001）：学号已存在', result.errors)
+        self.assertIn('第5行（学号 002）：学号已存在', result.errors)
+        self.assertEqual(
+            list(student.objects.order_by('sno').values_list('sno', 'sex', 'telephone')),
+            [('001', 'boy', ''), ('002', 'boy', '13800000000'), ('007', 'boy', ''), ('3', 'girl', '')],
+        )
+        # 批量写入也要建好搜索索引和成绩汇总行
+        self.assertEqual(search.match(student.objects.all(), 'sname', '王五').get().sno, '3')
+        self.assertEqual(transcript.objects.filter(pk__in=['002', '3', '007']).count(), 3)
+
+    def test_job_resumes_from_checkpoint(self):
+        rows = [[sno, f'学生{sno}', 'boy', '', 19, 'c1', 1, '', ''] for sno in ('101', '001', '102', '103', '104')]
+        path = jobs.job_root() / 'uploads' / 'resume.xlsx'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(xlsx(rows).getvalue())
+        self.addCleanup(path.unlink, missing_ok=True)
+        j = job.objects.create(kind='student_import', input_file=str(path), status='running', worker='w1')
+
+        # 第一次运行提交完第一批后中断（worker 被杀），任务重新排队后续跑
+        def interrupt(done):
+            raise RuntimeError('killed')
+        checkpoint = jobs.ImportCheckpoint(j)
+        with self.assertRaises(RuntimeError):
+            student_io.import_students(str(path), batch_size=2, progress=interrupt, checkpoint=checkpoint)
+        checkpoint.close()
+        self.assertEqual(job.objects.get(pk=j.pk).result['checkpoint']['rows'], 2)
+
+        message, data, result_file = jobs.run_student_import(job.objects.get(pk=j.pk), jobs.Progress(j.pk))
+        # 已导入的 101 不会再报“学号已存在”，错误清单里只有库里原有的 001
+        self.assertEqual((data['success'], data['error_count']), (4, 1))
+        self.assertEqual(data['errors'], ['第3行（学号 001）：学号已存在'])
+        with open(result_file, encoding='utf-8-sig') as f:
+            self.assertEqual(f.read().splitlines(), ['错误信息', '第3行（学号 001）：学号已存在'])
+        Path(result_file).unlink()
+        self.assertEqual(student.objects.filter(sno__in=['101', '102', '103', '104']).count(), 4)
+
+    def test_bad_headers(self):
+        with self.assertRaises(student_io.ImportFormatError):
+            student_io.import_students(xlsx([['008', '吴十']], headers=['sno', 'sname']))
+        self.assertEqual(student.objects.count(), 1)
+
+
+class StudentExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('export', password='x')
+        d = depart.objects.create(dno='d1', dname='系部1')
+        c = cl.objects.create(classno='c1', classname='班级1', dno=d)
+        student.objects.bulk_create([
+            student(sno=f'{i:03d}', sname=f'学生{i}', sex='boy' if i % 2 else 'girl', age=18 + i % 3,
+                    native='', classno=c, semester=None if i == 1 else 1, home='', telephone='')
+            for i in range(6)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def export(self, **params):
+        return self.client.get(reverse('student_export_excel'), {'sex': 'boy', 'order': 'age', 'direction': 'desc', **params})
+
+    def test_csv_and_ndjson(self):
+        # 与学生列表同样的筛选和顺序（年龄降序，同龄按学号降序）；NULL 写成空串
+        content = b''.join(self.export(format='csv').streaming_content).decode('utf-8')
+        self.assertEqual(content.splitlines(), [
+            '\ufeff' + ','.join(student_io.STUDENT_HEADERS),
+            '005,学生5,boy,,20,c1,1,,',
+            '001,学生1,boy,,19,c1,,,',
+            '003,学生3,boy,,18,c1,1,,',
+        ])
+        lines = b''.join(self.export(format='ndjson').streaming_content).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['sno'] for line in lines], ['005', '001', '003'])
+        self.assertIsNone(json.loads(lines[1])['semester'])
+
+    def test_xlsx_round_trip(self):
+        content = b''.join(self.export().streaming_content)
+        wb = load_workbook(io.BytesIO(content), read_only=True)
+        rows = list(wb.active.iter_rows(values_only=True))
+        wb.close()
+        self.assertEqual(list(rows[0]), student_io.STUDENT_HEADERS)
+        self.assertEqual([row[0] for row in rows[1:]], ['005', '001', '003'])
+        # 导出的文件可以原样导入
+        boys = student.objects.filter(sex='boy').order_by('sno')
+        before = list(boys.values_list(*student_io.EXPORT_COLUMNS))
+        boys.delete()
+        self.assertEqual(student_io.import_students(io.BytesIO(content)).success, 3)
+        self.assertEqual(list(boys.values_list(*student_io.EXPORT_COLUMNS)), before)
+
+    def test_background_export(self):
+        response = self.export(format='csv', **{'async': '1'})
+        j = job.objects.get(kind='student_export')
+        self.assertRedirects(response, f'/jobs/{j.pk}/', fetch_redirect_response=False)
+        # 后台任务写出的文件与直接下载的内容一致
+        with tempfile.TemporaryDirectory() as root, override_settings(JOB_ROOT=root):
+            message, result, path = jobs.run_student_export(j, jobs.Progress(j.pk))
+            with open(path, encoding='utf-8', newline='') as f:
+                self.assertEqual(f.read(), b''.join(self.export(format='csv').streaming_content).decode('utf-8'))
+        self.assertEqual(result, {'rows': 3})
+        self.assertEqual((job.objects.get(pk=j.pk).total, job.objects.get(pk=j.pk).done), (3, 3))
+
+
+# ==================== 搜索 ====================
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        d = depart.objects.create(dno='d1', dname='系部1')
+        c = cl.objects.create(classno='c1', classname='计科1班', dno=d)
+        student.objects.create(sno='00123', sname='张三丰', sex='boy', age=19, classno=c, semester=1)
+
+    def test_empty_index_falls_back(self):
+        # 升级后索引还没建：不能因为没有 n-gram 命中就返回空结果
+        searchgram.objects.all().delete()
+        self.assertEqual(list(search.match(student.objects.all(), 'sname', '三丰').values_list('sno', flat=True)), ['00123'])
+        self.assertEqual(search.suggest('012')['students'][0]['sno'], '00123')
+
+    def test_indexed(self):
+        self.assertTrue(searchgram.objects.filter(kind='sname').exists())
+        self.assertEqual(search.match(student.objects.all(), 'sname', '三丰').count(), 1)
+        self.assertEqual(search.match(student.objects.all(), 'sname', '李四').count(), 0)
+        self.assertEqual(search.suggest('计科')['classes'], [{'classno': 'c1', 'classname': '计科1班'}])
+
+    def test_sno_trigrams(self):
+        self.assertEqual(set(searchgram.objects.filter(kind='sno').values_list('gram', flat=True)), {'001', '012', '123'})
+        # 一两位数字的 n-gram 没有区分度，直接 icontains，不查索引
+        self.assertNotIn('searchgram', str(student.objects.filter(search.search_q('sno', '12')).query))
+        self.assertIn('searchgram', str(student.objects.filter(search.search_q('sno', '0123')).query))
+        self.assertEqual(search.match(student.objects.all(), 'sno', '0123').get().sno, '00123')
+        self.assertEqual(search.match(student.objects.all(), 'sno', '12').get().sno, '00123')
+        self.assertFalse(search.match(student.objects.all(), 'sno', '0124').exists())
+
+
+# ==================== 后台任务 ====================
+
+class JobTests(TestCase):
+    def setUp(self):
+        self.jobs = job.objects.bulk_create([job(kind='student_export') for _ in range(3)])
+
+    def test_claim(self):
+        first, second = jobs.claim_next('w1'), jobs.claim_next('w2')
+        self.assertEqual((first, second), (self.jobs[0].pk, self.jobs[1].pk))
+        claimed = job.objects.get(pk=first)
+        self.assertEqual((claimed.status, claimed.worker), ('running', 'w1'))
+        self.assertIsNotNone(claimed.heartbeat)
+        # 只续自己的心跳
+        job.objects.update(heartbeat=None)
+        self.assertEqual(jobs.heartbeat('w1'), 1)
+        self.assertIsNone(job.objects.get(pk=second).heartbeat)
+
+    def test_requeue_only_stale(self):
+        live, dead = jobs.claim_next('live'), jobs.claim_next('dead')
+        job.objects.filter(pk=dead).update(heartbeat=timezone.now() - timedelta(seconds=jobs.STALE_AFTER + 1))
+        # 新启动的 worker 不能把存活 worker 正在执行的任务放回队列
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(job.objects.get(pk=live).status, 'running')
+        requeued = job.objects.get(pk=dead)
+        self.assertEqual((requeued.status, requeued.worker, requeued.started), ('pending', '', None))
+
+    def test_purge_uploads(self):
+        uploads = jobs.job_root() / 'uploads'
+        uploads.mkdir(parents=True, exist_ok=True)
+        kept, orphan, fresh = uploads / 'kept.xlsx', uploads / 'orphan.xlsx', uploads / 'fresh.xlsx'
+        for path in (kept, orphan, fresh):
+            path.write_bytes(b'x')
+            self.addCleanup(path.unlink, missing_ok=True)
+        old = time.time() - jobs.STALE_AFTER - 1
+        os.utime(kept, (old, old))
+        os.utime(orphan, (old, old))
+        job.objects.filter(pk=self.jobs[0].pk).update(input_file=str(kept))
+        # 等待中任务引用的文件和刚落盘的文件保留，其余删除
+        jobs.purge_uploads()
+        self.assertEqual((kept.exists(), orphan.exists(), fresh.exists()), (True, False, True))
+
+    def test_finish_requires_ownership(self):
+        job_id = jobs.claim_next('old')
+        job.objects.filter(pk=job_id).update(heartbeat=None)
+        jobs.requeue_stale()
+        self.assertEqual(jobs.claim_next('new'), job_id)
+        # 失联后又恢复的旧 worker 不能覆盖新 worker 的任务
+        self.assertEqual(jobs.finish(job_id, 'old', status='failed'), 0)
+        self.assertEqual(jobs.finish(job_id, 'new', status='done'), 1)
+        self.assertEqual(job.objects.get(pk=job_id).status, 'done')
+
+
+# ==================== 仪表盘统计 ====================
+
+class DashboardStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # 统计增量在事务提交后才写入，测试里执行提交回调
+        with cls.captureOnCommitCallbacks(execute=True):
+            departs = [depart.objects.create(dno=f'd{i}', dname=f'系部{i}') for i in range(3)]
+            classes = [cl.objects.create(classno=f'c{i}', classname=f'班级{i}', dno=departs[i % 2]) for i in range(4)]
+            for i in range(8):
+                student.objects.create(sno=f'{i:03d}', sname=f'学生{i}', sex='boy', age=19, classno=classes[i % 4], semester=1)
+            for i in range(3):
+                course.objects.create(cno=f'C{i}', cname=f'课程{i}', credit=2)
+            for i in range(8):
+                for k in range(i % 3):
+                    sc.objects.create(sno_id=f'{i:03d}', cno_id=f'C{k}', grade=None if k else 60 + i)
+
+    def setUp(self):
+        stats.rebuild()
+
+    def state(self):
+        snap = dashstat.objects.values(
+            'student_total', 'course_total', 'class_total', 'depart_total', 'graded_count', 'grade_sum',
+        ).get(pk=stats.SNAPSHOT_ID)
+        return snap, sorted(departstat.objects.values_list('dno_id', 'students', 'enrolled'))
+
+    def assert_matches_rebuild(self):
+        maintained = self.state()
+        stats.rebuild()
+        self.assertEqual(maintained, self.state())
+
+    def test_single_writes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            s = student.objects.create(sno='100', sname='新生', sex='girl', age=18, classno_id='c0', semester=1)
+            sc.objects.create(sno=s, cno_id='C0', grade=88)
+            # 转到另一个系部的班级，该生的选课人数跟着转
+            s.classno_id = 'c1'
+            s.save()
+            record = sc.objects.get(sno_id='001', cno_id='C0')
+            record.grade = None
+            record.save()
+            record = sc.objects.get(sno_id='002', cno_id='C1')
+            record.grade = 75
+            record.save()
+            sc.objects.get(sno_id='004', cno_id='C0').delete()  # 该生唯一的选课记录
+        self.assert_matches_rebuild()
+
+    def test_cascades(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            student.objects.get(pk='005').delete()
+            course.objects.get(pk='C1').delete()
+            cl.objects.get(pk='c2').delete()
+            depart.objects.create(dno='d9', dname='新系部')
+        self.assert_matches_rebuild()
+        with self.captureOnCommitCallbacks(execute=True):
+            depart.objects.get(pk='d1').delete()
+        self.assert_matches_rebuild()
+
+    def test_class_changes_depart(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            c = cl.objects.get(pk='c0')
+            c.dno_id = 'd2'
+            c.save()
+        self.assert_matches_rebuild()
+
+    def test_deltas_batched_per_transaction(self):
+        before = dashstat.objects.get(pk=stats.SNAPSHOT_ID).course_total
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            for i in range(3):
+                course.objects.create(cno=f'N{i}', cname=f'新课{i}', credit=1)
+            # 回滚的保存点里的增量随回调一起丢弃
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                course.objects.create(cno='N9', cname='回滚', credit=1)
+                raise RuntimeError
+        # 整个事务只有一个统计回调，提交后合并成一次 UPDATE
+        self.assertEqual(sum(isinstance(callback, stats._Deltas) for callback in callbacks), 1)
+        self.assertEqual(dashstat.objects.get(pk=stats.SNAPSHOT_ID).course_total, before + 3)
+        self.assert_matches_rebuild()
+
+    def test_dashboard(self):
+        user = User.objects.create_user('dash', password='x')
+        self.client.force_login(user)
+        dashstat.objects.all().delete()
+        # 快照丢失时先全量重建
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['student_total'], 8)
+        self.assertEqual(response.context['avg_grade'], round(sum(60 + i for i in range(8) if i % 3) / 5, 1))
+
+
+# ==================== 成绩汇总 ====================
+
+class TranscriptTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        d = depart.objects.create(dno='d1', dname='数学系')
+        c = cl.objects.create(classno='c1', classname='数学1班', dno=d)
+        cls.students = [
+            student.objects.create(sno=f'0{i}', sname=f'学生{i}', sex='boy', age=19, classno=c, semester=1)
+            for i in range(3)
+        ]
+        course.objects.create(cno='C01', cname='高等数学', credit=4)
+        course.objects.create(cno='C02', cname='体育', credit=None)
+        course.objects.create(cno='C03', cname='英语', credit=2)
+        for stu in cls.students:
+            for cno, grade in (('C01', 95), ('C02', 70), ('C03', None)):
+                sc.objects.create(sno=stu, cno_id=cno, grade=grade)
+
+    def rows(self):
+        return list(transcript.objects.order_by('pk').values_list('pk', *transcripts.SUMMARY_FIELDS))
+
+    def assert_matches_rebuild(self):
+        maintained = self.rows()
+        transcripts.rebuild()
+        self.assertEqual(maintained, self.rows())
+
+    def test_avg_credit_ignores_missing_credit(self):
+        # 与 Avg('cno__credit') 一致：(4 + 2) / 2，不是 (4 + 0 + 2) / 3
+        self.assertEqual(transcripts.summary('00').avg_credit, 3.0)
+        self.assert_matches_rebuild()
+
+    def test_matches_rebuild_after_changes(self):
+        record = sc.objects.get(sno_id='00', cno_id='C03')
+        record.grade = 50
+        record.save()
+        sc.objects.get(sno_id='01', cno_id='C01').delete()
+        credited = course.objects.get(pk='C02')
+        credited.credit = 1
+        credited.save()
+        self.students[2].delete()
+        self.assert_matches_rebuild()
+        self.assertEqual(transcripts.summary('01').avg_credit, 1.5)
+
+    def test_bulk_added_matches_rebuild(self):
+        sc.objects.filter(sno_id='00', cno_id__in=['C02', 'C03']).delete()
+        transcripts.refresh('00')
+        sc.objects.bulk_create([sc(sno_id='00', cno_id='C02'), sc(sno_id='00', cno_id='C03')])
+        transcripts.courses_added({'00': ('C02', 'C03')})
+        self.assert_matches_rebuild()
+
+
+# ==================== 批量录入成绩 ====================
+
+class GradeEntryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('grades', password='x')
+        d = depart.objects.create(dno='d1', dname='系部1')
+        c = cl.objects.create(classno='c1', classname='班级1', dno=d)
+        for i in range(5):
+            student.objects.create(sno=f'{i:03d}', sname=f'学生{i}', sex='boy', age=19, classno=c, semester=1)
+        course.objects.create(cno='C01', cname='高等数学', credit=4)
+        course.objects.create(cno='C02', cname='英语', credit=2)
+        for i in range(4):
+            sc.objects.create(sno_id=f'{i:03d}', cno_id='C01', grade=70 if i == 0 else None)
+        sc.objects.create(sno_id='004', cno_id='C02', grade=None)
+
+    def setUp(self):
+        cache.get_cache().clear()
+        stats.rebuild()
+        self.client.force_login(self.user)
+        self.url = reverse('course_students', args=['C01'])
+
+    def grades(self):
+        return dict(sc.objects.filter(cno_id='C01').values_list('sno_id', 'grade'))
+
+    def assert_summaries_rebuilt(self):
+        # 批量录入走显式钩子，仪表盘快照和成绩汇总要与全量重建一致
+        dash = list(dashstat.objects.values_list('graded_count', 'grade_sum'))
+        rows = list(transcript.objects.order_by('pk').values_list('pk', *transcripts.SUMMARY_FIELDS))
+        stats.rebuild()
+        transcripts.rebuild()
+        self.assertEqual(dash, list(dashstat.objects.values_list('graded_count', 'grade_sum')))
+        self.assertEqual(rows, list(transcript.objects.order_by('pk').values_list('pk', *transcripts.SUMMARY_FIELDS)))
+
+    def test_json(self):
+        body = [
+            {'sno': '000', 'grade': 70},      # 未变化
+            {'sno': '001', 'grade': '88.5'},
+            {'sno': 2, 'grade': 60},          # 数字学号不补零，对不上选课记录
+            {'sno': '002', 'grade': 101},
+            {'sno': '003', 'grade': True},
+            {'sno': '004', 'grade': 90},      # 没选这门课
+            {'sno': '001', 'grade': 50},      # 重复
+            {'sno': '', 'grade': 50},
+        ]
+        response = self.client.post(self.url, json.dumps(body), content_type='application/json')
+        result = response.json()
+        self.assertEqual((result['updated'], result['unchanged'], result['error_count']), (1, 1, 6))
+        self.assertIn('第4条（学号 002）：成绩必须在0-100之间', result['errors'])
+        self.assertIn('第7条（学号 001）：学号重复', result['errors'])
+        self.assertEqual(self.grades(), {'000': 70, '001': 88.5, '002': None, '003': None})
+        self.assert_summaries_rebuilt()
+
+    def test_bad_json(self):
+        response = self.client.post(self.url, '{"grades": 1}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.json())
+
+    def test_csv_upload_and_grid(self):
+        upload = SimpleUploadedFile('grades.csv', '\ufeff学号,成绩\n001,95\n\n002,59\n'.encode('utf-8'))
+        self.assertRedirects(self.client.post(self.url, {'file': upload}), self.url, fetch_redirect_response=False)
+        self.assertEqual(self.grades(), {'000': 70, '001': 95, '002': 59, '003': None})
+        # 网格表单留空的输入框不修改
+        self.client.post(self.url, {'grade_000': '', 'grade_003': '100'})
+        self.assertEqual(self.grades(), {'000': 70, '001': 95, '002': 59, '003': 100})
+        self.assert_summaries_rebuilt()
+        page = self.client.get(self.url)
+        self.assertEqual((page.context['graded'], page.context['avg']), (4, 81.0))
+
+
+# ==================== 批量选课 ====================
+
+class EnrollmentTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.user = User.objects.create_user('enroll', password='x')
+            d1 = depart.objects.create(dno='d1', dname='系部1')
+            d2 = depart.objects.create(dno='d2', dname='系部2')
+            classes = [cl.objects.create(classno=f'c{i}', classname=f'班级{i}', dno=(d1, d1, d2, d2)[i]) for i in range(4)]
+            for i in range(8):
+                student.objects.create(sno=f'{i:03d}', sname=f'学生{i}', sex='boy', age=19, classno=classes[i % 4], semester=1)
+            course.objects.create(cno='C01', cname='高等数学', credit=4)
+            course.objects.create(cno='C02', cname='体育', credit=None)
+            course.objects.create(cno='C03', cname='英语', credit=2)
+            sc.objects.create(sno_id='000', cno_id='C01', grade=80)
+            sc.objects.create(sno_id='002', cno_id='C03', grade=None)
+
+    def setUp(self):
+        stats.rebuild()
+        # 分块边界也要覆盖到
+        chunk_size = enrollment.STUDENT_CHUNK_SIZE
+        enrollment.STUDENT_CHUNK_SIZE = 2
+        self.addCleanup(setattr, enrollment, 'STUDENT_CHUNK_SIZE', chunk_size)
+
+    def assert_summaries_rebuilt(self):
+        state = lambda: (
+            list(departstat.objects.order_by('pk').values_list('pk', 'students', 'enrolled')),
+            list(transcript.objects.order_by('pk').values_list('pk', *transcripts.SUMMARY_FIELDS)),
+        )
+        maintained = state()
+        stats.rebuild()
+        transcripts.rebuild()
+        self.assertEqual(maintained, state())
+
+    def test_enroll(self):
+        # 系部 d1 = 班级 c0、c1；再加上班级 c2；不存在的课程忽略
+        with self.captureOnCommitCallbacks(execute=True):
+            result = enrollment.enroll(classnos=['c2'], dnos=['d1'], cnos=['C01', 'C02', 'XXX'])
+        self.assertEqual(
+            (result.students, result.courses, result.inserted, result.skipped), (6, 2, 11, 1),
+        )
+        targets = {'000', '001', '002', '004', '005', '006'}
+        self.assertEqual(
+            set(sc.objects.filter(cno_id__in=['C01', 'C02']).values_list('sno_id', 'cno_id')),
+            {(sno, cno) for sno in targets for cno in ('C01', 'C02')},
+        )
+        self.assertEqual(sc.objects.get(sno_id='000', cno_id='C01').grade, 80)
+        self.assert_summaries_rebuilt()
+        # 再选一次全部跳过
+        with self.captureOnCommitCallbacks(execute=True):
+            again = enrollment.enroll(classnos=['c2'], dnos=['d1'], cnos=['C01', 'C02'])
+        self.assertEqual((again.inserted, again.skipped), (0, 12))
+        self.assert_summaries_rebuilt()
+
+    def test_view(self):
+        self.client.force_login(self.user)
+        url = reverse('bulk_enroll')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, json.dumps({'dno': ['d2'], 'cno': ['C03']}), content_type='application/json')
+        # d2 = 班级 c2、c3 的 4 名学生，002 已选 C03
+        self.assertEqual((response.json()['inserted'], response.json()['skipped']), (3, 1))
+        for body in ('[1]', json.dumps({'cno': ['C03']}), json.dumps({'dno': ['d2']})):
+            with self.subTest(body=body):
+                self.assertEqual(self.client.post(url, body, content_type='application/json').status_code, 400)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {'classno': ['c0'], 'cno': ['C02']})
+        self.assertEqual(sc.objects.filter(cno_id='C02').count(), 2)
+        self.assert_summaries_rebuilt()
+
+
+# ==================== 读缓存 ====================
+
+class VersionedCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('cache', password='x')
+        d = depart.objects.create(dno='d1', dname='数学系')
+        c = cl.objects.create(classno='c1', classname='数学1班', dno=d)
+        s = student.objects.create(sno='001', sname='张三', sex='boy', age=19, classno=c, semester=1)
+        sc.objects.create(sno=s, cno=course.objects.create(cno='001', cname='高等数学', credit=4), grade=90)
+
+    def setUp(self):
+        # TestCase 不提交事务，版本号不会随测试数据增加；清掉上次运行留在缓存里的结果
+        cache.get_cache().clear()
+
+    def test_bump_after_commit(self):
+        before = cache.data_version('depart')
+        with self.captureOnCommitCallbacks(execute=True):
+            depart.objects.filter(pk='d1').update(dname='数学科学系')
+            depart.objects.get(pk='d1').save()
+            # 提交前版本号不变，并发请求读到的旧数据仍存在旧版本号下
+            self.assertEqual(cache.data_version('depart'), before)
+        self.assertNotEqual(cache.data_version('depart'), before)
+
+    def test_course_students_follows_depart(self):
+        self.client.force_login(self.user)
+        url = reverse('course_students', args=['001'])
+        self.assertContains(self.client.get(url), '数学系')
+        with self.captureOnCommitCallbacks(execute=True):
+            d = depart.objects.get(pk='d1')
+            d.dname = '数学科学系'
+            d.save()
+        self.assertContains(self.client.get(url), '数学科学系')
+
+    def test_course_students_caches_plain_values(self):
+        self.client.force_login(self.user)
+        url = reverse('course_students', args=['001'])
+        self.client.get(url)
+        # 第二次从缓存读：课程和选课记录都是普通 dict，不是模型实例
+        response = self.client.get(url)
+        self.assertEqual(response.context['course']['type_display'], '公共课')
+        self.assertEqual(response.context['records'], [{
+            'sno': '001', 'sname': '张三', 'sex': '男', 'age': 19, 'classno': 'c1', 'classname': '数学1班',
+            'dno': 'd1', 'dname': '数学系', 'grade': 90,
+        }])
+        self.assertContains(response, '数学1班')
+
+
+# ==================== AI 查询代价控制 ====================
+
+class GovernorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        d = depart.objects.create(dno='d1', dname='系部1')
+        c = cl.objects.create(classno='c1', classname='班级1', dno=d)
+        student.objects.bulk_create([
+            student(sno=f'{i:05d}', sname=f'学生{i}', sex='boy', age=18, classno=c, semester=1)
+            for i in range(governor.MAX_ROWS + 1)
+        ])
+
+    def setUp(self):
+        # 表行数缓存可能是前面的测试在表里只有几行时记下的，按它估计会放行交叉连接
+        governor._table_rows.clear()
+        cache.get_cache().clear()
+
+    def run_code(self, code):
+        from .views import AICodeExecutor
+        return AICodeExecutor().execute_ai_code(code)
+
+    def test_evaluation_over_limit_is_rejected(self):
+        # 不再截断成 MAX_ROWS 行后给出错误的总数
+        for code in (
+            'result = len(student.objects.all())',
+            'result = sum(1 for s in student.objects.all())',
+            'result = sum(1 for s in student.objects.iterator())',
+            'result = list(student.objects.values("sno")[:5000])',
+        ):
+            with self.subTest(code=code):
+                self.assertIn(f'超过 {governor.MAX_ROWS} 行', self.run_code(code)['error'])
+
+    def test_within_limit(self):
+        self.assertEqual(self.run_code('result = student.objects.count()')['data'], governor.MAX_ROWS + 1)
+        self.assertEqual(self.run_code('result = len(student.objects.all()[:10])')['data'], 10)
+        self.assertEqual(self.run_code('result = bool(student.objects.all())')['data'], True)
+        # 作为 result 的查询集分页显示，总数照实给出
+        result = self.run_code('result = student.objects.values("sno")')
+        self.assertEqual(result['count'], governor.MAX_ROWS + 1)
+        self.assertEqual(len(result['rows']), result_pages.PAGE_SIZE)
+
+    def test_evaluation_keeps_queryset_unsliced(self):
+        # 代码里先求值（len）再把同一个查询集作为 result 返回：求值不能把它切片，分页仍走键集
+        queryset = governor.governed(student).objects.filter(sno__lt='00010').values('sno')
+        self.assertEqual(len(queryset), 10)
+        self.assertFalse(queryset.query.is_sliced)
+        self.assertIsNotNone(result_pages._keys(queryset))
+        result = self.run_code('queryset = student.objects.values("sno")\nn = len(queryset[:5])\nresult = queryset')
+        self.assertEqual((result['count'], len(result['rows'])), (governor.MAX_ROWS + 1, result_pages.PAGE_SIZE))
+
+    def test_real_managers_are_hidden(self):
+        for code in (
+            'result = student._default_manager.count()',
+            'result = student.objects.model.objects.count()',
+        ):
+            with self.subTest(code=code):
+                self.assertIn('禁止访问属性', self.run_code(code)['error'])
+        with self.assertRaises(AttributeError):
+            governor.governed(student)._base_manager
+
+    def test_costly_query_is_rejected(self):
+        with governor.guard(), self.assertRaises(governor.QueryCostError):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT COUNT(*) FROM xx_student a, xx_student b, xx_student c, xx_student d')
+
+
+# ==================== AI 助手提示词 ====================
+
+class PromptTests(SimpleTestCase):
+    def test_pruned_schema(self):
+        text = prompt.schema('计算机系有多少女生')
+        # 系部和学生直接提到，给出全部字段；连接它们的班级只有键和名称；选课成绩是学生的相邻模型
+        self.assertIn('native = CharField', text)
+        self.assertIn('dname = CharField', text)
+        self.assertIn('class cl(', text)
+        self.assertNotIn('class course(', text)
+        self.assertIn("choices=[('girl', '女'), ('boy', '男')]", text)
+        self.assertLess(prompt.estimate_tokens(text), prompt.estimate_tokens(prompt.full_schema()))
+
+    def test_unmatched_uses_full_schema(self):
+        self.assertEqual(prompt.schema('帮我写一首诗'), prompt.full_schema())
+        self.assertEqual(prompt.relevant_models('average age')[0], ['student'])
+
+    def test_shared_labels(self):
+        # 多个模型都有的字段：问题提到它时这些模型都要给出全部字段
+        self.assertEqual(prompt.relevant_models('电话')[0], ['student', 'depart'])
+        self.assertEqual(prompt.relevant_models('telephone')[0], ['student', 'depart'])
+        self.assertEqual(prompt.relevant_models('semester')[0], ['student', 'course'])
+
+
+# ==================== AI 助手规则匹配 ====================
+
+class IntentTests(TestCase):
+    CASES = {
+        '查询所有男生信息': 'students_by_sex',
+        '女生人数': 'student_count_by_sex',
+        '统计每个班级的学生人数': 'student_count_by_class',
+        '统计每个系部的班级数量': 'class_count_by_depart',
+        '统计每门课程的平均成绩': 'avg_grade_by_course',
+        '统计课程C01的平均成绩': 'avg_grade_of_course',
+        '高等数学的平均分': 'avg_grade_of_course',
+        '查询学号001的学生信息': 'student_by_sno',
+        '查询学号001的所有成绩': 'student_courses_by_sno',
+        '高吉利的成绩': 'student_courses_by_name',
+        '查询计算机科学系的所有班级': 'classes_of_depart',
+        '计算机科学系的所有女生': 'students_of_depart',
+        '计科2501班的所有学生': 'students_of_class',
+        '查询年龄大于20岁的学生': 'students_by_age',
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        course.objects.create(cno='C01', cname='高等数学')
+
+    def test_rules(self):
+        from .views import CodeValidator
+        for text, name in self.CASES.items():
+            with self.subTest(text=text):
+                matched = intents.match(text)
+                self.assertEqual(matched and matched[0], name)
+                CodeValidator.validate_ast(matched[1])
+
+    def test_entity_names_are_literals(self):
+        _, code = intents.match("计算机')|Q(x=1)科学系的所有学生")
+        self.assertIn(repr("计算机')|q(x=1)科学系"), code)
+
+    def test_unmatched(self):
+        for text in (
+            '每个班的学生', '男生的平均成绩', '统计各系男女比例', '帮我写一首诗',
+            # 不是课程：交给大模型，而不是返回空的平均分
+            '张三的平均成绩', '计算机系学生的平均成绩', '各班级的平均成绩', '课程C999的平均成绩',
+            # “查询”不能拆成“查”+“询男生”
+            '查询男生的成绩', '查询女同学的成绩',
+        ):
+            with self.subTest(text=text):
+                self.assertIsNone(intents.match(text))
+
+    def test_name_strips_people_suffix(self):
+        for text in ('查询张三同学的成绩', '学生张三的成绩', '张三学生的所有成绩'):
+            with self.subTest(text=text):
+                name, code = intents.match(text)
+                self.assertEqual(name, 'student_courses_by_name')
+                self.assertIn("sno__sname='张三')", code)
+
+
+class ColumnarTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        d = depart.objects.create(dno='d1', dname='系部1')
+        c = cl.objects.create(classno='c1', classname='班级1', dno=d)
+        student.objects.create(sno='001', sname='张三', sex='boy', age=19, classno=c, semester=1)
+        student.objects.create(sno='002', sname='李四', sex='girl', age=20, classno=c, semester=1)
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def test_values(self):
+        table = columnar.from_queryset(student.objects.values('sno', 'classno__classname').order_by('sno'))
+        self.assertEqual(table, {'columns': ['sno', 'classno__classname'], 'rows': [('001', '班级1'), ('002', '班级1')]})
+
+    def test_models_and_records(self):
+        table = columnar.from_queryset(student.objects.order_by('sno'))
+        self.assertEqual(table['columns'][:2], ['sno', 'sname'])
+        self.assertIn('classno_id', table['columns'])
+        self.assertEqual(columnar.from_records(list(student.objects.order_by('sno'))), {
+            'columns': table['columns'], 'rows': [list(row) for row in table['rows']],
+        })
+        self.assertIsNone(columnar.from_records([{'a': 1}, {'b': 2}]))
+
+    def test_reply(self):
+        from .views import AICodeExecutor, format_execution_result
+        result = AICodeExecutor().execute_ai_code("result = student.objects.filter(sex='girl').values('sno', 'sname')")
+        self.assertEqual(
+            format_execution_result(result),
+            '[{"type":"queryset","count":1,"columns":["sno","sname"],"rows":[["002","李四"]]}]',
+        )
+
+
+class ResultPageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        d = depart.objects.create(dno='d1', dname='系部1')
+        c = cl.objects.create(classno='c1', classname='班级1', dno=d)
+        student.objects.bulk_create([
+            student(sno=f'{i:03d}', sname=f'学生{i % 7}', sex='boy', age=None if i % 5 == 0 else 18 + i % 4,
+                    classno=c, semester=1)
+            for i in range(23)
+        ])
+
+    def pages(self, queryset):
+        rows, cursor = [], None
+        while True:
+            pager = result_pages.Pager(queryset, cursor, per_page=5)
+            rows += list(pager)
+            if not pager.next:
+                return rows
+            cursor = pager.next
+
+    def test_keyset(self):
+        queryset = student.objects.order_by('-age', 'sname').values('sno', 'age')
+        self.assertIsNotNone(result_pages._keys(queryset))
+        expected = [
+            (s.sno, s.age)
+            for s in sorted(student.objects.all(), key=lambda s: (s.age is None, -(s.age or 0), s.sname, s.sno))
+        ]
+        self.assertEqual(self.pages(queryset), expected)
+
+    def test_offset(self):
+        queryset = student.objects.values('sname').annotate(n=Count('sno'))
+        self.assertIsNone(result_pages._keys(queryset))
+        self.assertEqual(self.pages(queryset), list(queryset.order_by('sname').values_list('sname', 'n')))
+
+
+class ChatHistoryTests(SimpleTestCase):
+    def test_compact_reply(self):
+        reply = json.dumps([{
+            'type': 'queryset', 'count': 500, 'columns': ['sno'], 'rows': [[f'{i:03d}'] for i in range(100)],
+            'handle': 'h', 'next': 'c',
+        }])
+        step = json.loads(chat_history.compact_reply(reply))[0]
+        self.assertEqual(step, {
+            'type': 'queryset', 'count': 500, 'columns': ['sno'],
+            'rows': [[f'{i:03d}'] for i in range(chat_history.COMPACT_ROWS)],
+        })
+        self.assertEqual(chat_history.compact_reply('短回复'), '短回复')
+        self.assertLess(len(chat_history.compact_reply('长' * 10000)), chat_history.COMPACT_CHARS + 20)
+
+
+# ==================== AI 代码缓存 ====================
+
+class CodeCacheTests(SimpleTestCase):
+    def test_normalize(self):
+        self.assertEqual(normalize_query(' 查询所有\t男生？'), '查询所有 男生')
+        self.assertEqual(normalize_query('ＡＢＣ 学生!'), 'abc 学生')
+
+    def test_get_put(self):
+        codes = CodeCache(capacity=2)
+        self.assertIsNone(codes.get('p', 'q1'))
+        codes.put('p', 'q1', 'result = 1')
+        self.assertEqual(codes.get('p', 'Q1。'), 'result = 1')
+        # 提示词不同（指纹不同）不命中
+        self.assertIsNone(codes.get('p2', 'q1'))
+        codes.discard('p', 'q1')
+        self.assertIsNone(codes.get('p', 'q1'))
+        self.assertEqual((codes.stats()['hit'], codes.stats()['miss']), (1, 3))
+
+    def test_lru_and_ttl(self):
+        codes = CodeCache(capacity=2)
+        codes.put('p', 'q1', 'result = 1')
+        codes.put('p', 'q2', 'result = 2')
+        codes.get('p', 'q1')
+        codes.put('p', 'q3', 'result = 3')
+        self.assertIsNone(codes.get('p', 'q2'))
+        self.assertEqual(codes.get('p', 'q1'), 'result = 1')
+        self.assertEqual(codes.stats()['evictions'], 1)
+
+        expiring = CodeCache(ttl=0)
+        expiring.put('p', 'q1', 'result = 1')
+        self.assertIsNone(expiring.get('p', 'q1'))
+        self.assertEqual(expiring.stats()['expired'], 1)
+
+    def test_saved_time(self):
+        codes = CodeCache()
+        codes.record_llm(2.0)
+        codes.record_llm(4.0)
+        codes.put('p', 'q1', 'result = 1')
+        codes.get('p', 'q1')
+        stats = codes.stats()
+        self.assertEqual((stats['avg_llm_ms'], stats['saved_ms'], stats['hit_rate']), (3000.0, 3000.0, 1.0))
+
+    def test_remember_code(self):
+        from .views import CODE_GENERATION_PROMPT, remember_code
+        code_cache.clear()
+        self.addCleanup(code_cache.clear)
+        remember_code('q1', 'result = 1', {'error': '执行失败'}, 'llm')
+        self.assertIsNone(code_cache.get(CODE_GENERATION_PROMPT, 'q1'))
+        remember_code('q1', 'result = 1', {'type': 'int', 'data': 1}, 'llm')
+        self.assertEqual(code_cache.get(CODE_GENERATION_PROMPT, 'q1'), 'result = 1')
+        # 命中缓存的代码执行成功时保留，出错时移除
+        remember_code('q1', 'result = 1', {'type': 'int', 'data': 1}, 'cache')
+        self.assertEqual(code_cache.get(CODE_GENERATION_PROMPT, 'q1'), 'result = 1')
+        remember_code('q1', 'result = 1', {'error': '执行失败'}, 'cache')
+        self.assertIsNone(code_cache.get(CODE_GENERATION_PROMPT, 'q1'))
+
+
+# ==================== AI 执行结果缓存 ====================
+
+class ResultCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        d = depart.objects.create(dno='d1', dname='系部1')
+        c = cl.objects.create(classno='c1', classname='班级1', dno=d)
+        cl.objects.create(classno='c2', classname='班级2', dno=depart.objects.create(dno='d2', dname='系部2'))
+        student.objects.create(sno='001', sname='张三', sex='boy', age=19, classno=c, semester=1)
+        student.objects.create(sno='002', sname='李四', sex='girl', age=20, classno=c, semester=1)
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def run_code(self, code):
+        from .views import AICodeExecutor
+        return AICodeExecutor().execute_ai_code(code)
+
+    def test_tables(self):
+        self.assertEqual(result_cache.tables(['student'], ['classno__dno__dname']), ['cl', 'depart', 'student'])
+        self.assertEqual(result_cache.tables(['sc'], ['sno__sname', 'cno__cname']), ['course', 'sc', 'student'])
+        self.assertEqual(result_cache.tables(['cl'], ['student__sname']), ['cl', 'student'])
+        self.assertEqual(
+            result_cache.normalize_code('result = student.objects.filter(sex="boy")  # 男生'),
+            "result = student.objects.filter(sex='boy')",
+        )
+
+    def test_invalidation(self):
+        code = "result = student.objects.filter(classno__dno__dname='系部1').count()"
+        self.assertEqual(self.run_code(code), {'type': 'int', 'data': 2})
+        # QuerySet.update 不发信号，版本号不变：写法不同的同一段代码仍返回缓存的结果
+        student.objects.filter(sno='002').update(classno='c2')
+        self.assertEqual(self.run_code(code.replace("'", '"') + '  # 同一段代码'), {'type': 'int', 'data': 2})
+        # 无关的表有写入不影响
+        with self.captureOnCommitCallbacks(execute=True):
+            course.objects.create(cno='C01', cname='高等数学', credit=4)
+        self.assertEqual(self.run_code(code), {'type': 'int', 'data': 2})
+        # 经字段路径关联到的 depart 有写入，缓存失效
+        with self.captureOnCommitCallbacks(execute=True):
+            depart.objects.get(dno='d1').save()
+        self.assertEqual(self.run_code(code), {'type': 'int', 'data': 1})
+
+    def test_errors_not_cached(self):
+        code = "result = student.objects.get(sno='003')"
+        self.assertIn('error', self.run_code(code))
+        self.assertIsNone(result_cache.lookup(code, ['student'], ['sno'])[1])
+
+
+# ==================== 沙箱 ====================
+
+class SandboxTests(SimpleTestCase):
+    """子进程用 spawn 重新 django.setup()，看不到测试数据库，这里只执行不查库的代码"""
+
+    def run_code(self, pool, code):
+        return sandbox._result(pool.iter_execute(code))
+
+    def make_pool(self, **kwargs):
+        pool = sandbox.SandboxPool(size=1, **kwargs)
+        self.addCleanup(lambda: [worker.kill() for worker in list(pool._workers)])
+        return pool
+
+    def test_timeout_and_recycle(self):
+        pool = self.make_pool(timeout=1, max_tasks=2)
+        self.assertEqual(self.run_code(pool, 'result = 6 * 7'), {'type': 'int', 'data': 42})
+        started = time.monotonic()
+        self.assertIn('执行超时', self.run_code(pool, 'result = sum(range(10 ** 10))')['error'])
+        self.assertLess(time.monotonic() - started, 3)
+        # 超时的子进程被换掉，新进程执行满 max_tasks 次后再换
+        for i in range(2):
+            self.assertEqual(self.run_code(pool, f'result = {i}'), {'type': 'int', 'data': i})
+        metrics = pool.metrics()
+        self.assertEqual((metrics['tasks'], metrics['timeouts'], metrics['recycled']), (4, 1, 1))
+        self.assertEqual(metrics['workers'], 1)
+
+    def test_memory_limit(self):
+        pool = self.make_pool(timeout=5, max_rss_mb=1)
+        self.assertIn('内存占用超过', self.run_code(pool, 'result = 1')['error'])
+        self.assertEqual(pool.metrics()['memory_kills'], 1)
+
+
+# ==================== 大模型客户端 ====================
+
+class StandInLLM(BaseHTTPRequestHandler):
+    """
+    OpenAI 兼容的本地替身：/<上游名>/v1/chat/completions，上游名 slow 等 2 秒、fail 返回 500，
+    code 回复一段代码，其余回复内容为上游名
+    """
+    protocol_version = 'HTTP/1.1'
+    CODE = "```python\nresult = cl.objects.count()\n```"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        name = self.path.split('/')[1]
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if name == 'slow':
+            time.sleep(2)
+        if name == 'fail':
+            return self.send(500, b'upstream error', 'text/plain')
+        content = self.CODE if name == 'code' else name
+        if not body.get('stream'):
+            return self.send(200, json.dumps({'choices': [{'message': {'content': content}}]}).encode(), 'application/json')
+        events = [{'choices': [{'delta': {'content': content[i:i + 8]}}]} for i in range(0, len(content), 8)]
+        self.send(200, ''.join(f'data: {json.dumps(e)}\n\n' for e in events).encode() + b'data: [DONE]\n\n',
+                  'text/event-stream')
+
+    def send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StandInLLMMixin:
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInLLM)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def endpoints(self, *names):
+        return [ai_client.Endpoint(name, f'http://127.0.0.1:{self.server.server_port}/{name}', 'k', 'm') for name in names]
+
+
+class LLMClientTests(StandInLLMMixin, SimpleTestCase):
+    def run_async(self, coro):
+        async def main():
+            try:
+                return await coro
+            finally:
+                await ai_client.aclose()
+        return asyncio.run(main())
+
+    async def collect(self, endpoints):
+        return ''.join([text async for text in ai_client.astream_ai_response([], endpoints)])
+
+    def test_failover(self):
+        endpoints = self.endpoints('fail', 'fast')
+        self.assertEqual(self.run_async(ai_client.aget_ai_response([], endpoints)), 'fast')
+        self.assertEqual(self.run_async(self.collect(endpoints)), 'fast')
+        self.assertEqual(endpoints[0].stats()['errors'], 2)
+        with self.assertRaises(RuntimeError):
+            self.run_async(ai_client.aget_ai_response([], endpoints[:1]))
+
+    def test_hedge(self):
+        slow, fast = endpoints = self.endpoints('slow', 'fast')
+        for kind in slow.latency:
+            for _ in range(ai_client.MIN_SAMPLES):
+                slow.latency[kind].observe(0.01)
+        # 最近耗时都很短，等 AI_HEDGE_MIN_DELAY 后就向 fast 对冲
+        for call in (ai_client.aget_ai_response([], endpoints), self.collect(endpoints)):
+            started = time.monotonic()
+            self.assertEqual(self.run_async(call), 'fast')
+            self.assertLess(time.monotonic() - started, 1.5)
+        self.assertEqual(slow.stats()['cancelled'], 2)
+        self.assertEqual(fast.stats()['hedges'], 2)
+        self.assertEqual(fast.stats()['latency']['stream']['count'], 1)
+
+    def test_circuit_breaker(self):
+        failing, fast = endpoints = self.endpoints('fail', 'fast')
+        failing.breaker = ai_client.CircuitBreaker(failures=2, reset=0.2)
+        for _ in range(3):
+            self.assertEqual(self.run_async(self.collect(endpoints)), 'fast')
+        # 第 2 次失败后熔断，第 3 次不再请求 fail
+        self.assertEqual((failing.stats()['requests'], failing.breaker.state), (2, 'open'))
+        time.sleep(0.25)
+        self.assertEqual(failing.breaker.state, 'half_open')
+        self.assertEqual(self.run_async(ai_client.aget_ai_response([], endpoints)), 'fast')
+        self.assertEqual((failing.stats()['requests'], failing.breaker.state), (3, 'open'))
+        self.assertEqual(fast.stats()['latency']['reply']['buckets']['le_inf'], 1)
+
+
+# ==================== 流式对话 ====================
+
+class ChatStreamTests(StandInLLMMixin, TransactionTestCase):
+    """事件流里的查询在线程池线程中执行，看不到未提交的数据，所以用 TransactionTestCase；沙箱子进程看不到测试库，改在本进程执行"""
+
+    def setUp(self):
+        d = depart.objects.create(dno='d1', dname='系部1')
+        c = cl.objects.create(classno='c1', classname='班级1', dno=d)
+        student.objects.create(sno='001', sname='张三', sex='boy', age=19, classno=c, semester=1)
+        student.objects.create(sno='002', sname='李四', sex='girl', age=20, classno=c, semester=1)
+        self.user = User.objects.create_user('u', password='p')
+        self.async_client.force_login(self.user)
+        cache.get_cache().clear()
+        code_cache.clear()
+        size = sandbox.pool.size
+        sandbox.pool.size = 0
+        self.addCleanup(setattr, sandbox.pool, 'size', size)
+        endpoints = ai_client.ENDPOINTS
+        self.addCleanup(setattr, ai_client, 'ENDPOINTS', endpoints)
+
+    def stream(self, message):
+        """返回 [(事件名, 数据), ...]"""
+        async def main():
+            try:
+                response = await self.async_client.post(reverse('chat_stream'), {'message': message})
+                self.assertEqual(response['Content-Type'], 'text/event-stream')
+                return b''.join([chunk async for chunk in response.streaming_content]).decode()
+            finally:
+                await ai_client.aclose()
+
+        events = []
+        for block in asyncio.run(main()).strip().split('\n\n'):
+            event, data = block.split('\n')
+            events.append((event.removeprefix('event: '), json.loads(data.removeprefix('data: '))))
+        return events
+
+    def saved(self):
+        return list(chatmsg.objects.filter(user=self.user).order_by('id').values_list('role', 'content'))
+
+    def test_rule(self):
+        chats = lambda: prompt.stats()['chat_ms'].get('rule', {}).get('count', 0)
+        before = chats()
+        events = self.stream('查询所有女生')
+        # 整次对话的耗时按代码来源计入统计
+        self.assertEqual(chats(), before + 1)
+        self.assertEqual([event for event, _ in events], ['code', 'columns', 'rows', 'done'])
+        self.assertEqual(events[0][1]['source'], 'rule')
+        self.assertEqual(events[1][1]['columns'][:2], ['sno', 'sname'])
+        self.assertEqual([row[:2] for row in events[2][1]['rows']], [['002', '李四']])
+        reply = events[-1][1]['reply']
+        self.assertIn('李四', reply)
+        self.assertEqual(self.saved(), [('user', '查询所有女生'), ('assistant', reply)])
+
+    def test_llm(self):
+        ai_client.ENDPOINTS = self.endpoints('code')
+        events = self.stream('一共有几个班级')
+        tokens = [data['text'] for event, data in events if event == 'token']
+        self.assertGreater(len(tokens), 1)
+        self.assertEqual(''.join(tokens), StandInLLM.CODE)
+        self.assertEqual(events[len(tokens)], ('code', {'code': 'result = cl.objects.count()', 'source': 'llm'}))
+        self.assertEqual(events[-1][0], 'done')
+        self.assertEqual(self.saved()[-1][1], events[-1][1]['reply'])
+
+    def test_cached_code(self):
+        ai_client.ENDPOINTS = self.endpoints('code')
+        self.stream('一共有几个班级')
+        # 规范化后是同一个问题，直接用缓存的代码，不再请求大模型
+        events = self.stream('一共有几个班级？')
+        self.assertEqual(events[0], ('code', {'code': 'result = cl.objects.count()', 'source': 'cache'}))
+        self.assertEqual(ai_client.ENDPOINTS[0].stats()['requests'], 1)
+
+    def test_llm_failure(self):
+        ai_client.ENDPOINTS = self.endpoints('fail')
+        events = self.stream('一共有几个班级')
+        self.assertEqual([event for event, _ in events], ['done'])
+        self.assertTrue(events[0][1]['reply'].startswith('处理失败'))
+        self.assertEqual(self.saved()[-1], ('assistant', events[0][1]['reply']))
+
+    def test_bad_request(self):
+        url = reverse('chat_stream')
+        self.assertEqual(asyncio.run(self.async_client.get(url)).status_code, 405)
+        self.assertEqual(asyncio.run(self.async_client.post(url, {'message': ' '})).status_code, 400)
+        self.assertEqual(self.saved(), [])
@@ -0,0 +1,153 @@
+"""
+学生成绩汇总（transcript 表）：每个学生一行，学生详情 / 选课页直接读这一行，不再实时聚合 sc。
+选课记录增删、成绩修改时由 signals.py 在同一事务里重算该生的一行；
+课程学分变化时重算选了该课的学生；`python manage.py rebuild_transcripts` 可全量重建。
+"""
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.query import QuerySet
+
+from .models import cl, course, depart, sc, student, transcript
+
+PASS_GRADE = 60
+# 绩点：(最低分, 绩点)，从高到低匹配
+GRADE_POINTS = (
+    (90, 4.0),
+    (80, 3.0),
+    (70, 2.0),
+    (60, 1.0),
+)
+SUMMARY_FIELDS = (
+    'course_count', 'credit_total', 'credited_count', 'graded_count', 'graded_credit',
+    'passed_credit', 'grade_sum', 'grade_point_credit',
+)
+BATCH_SIZE = 2000
+
+
+def _summaries(records):
+    """按学生分组一次算出汇总字段，records 为 sc 查询集"""
+    credit = Coalesce(F('cno__credit'), Value(0.0), output_field=FloatField())
+    point = Case(
+        *[When(grade__gte=lower, then=Value(p)) for lower, p in GRADE_POINTS],
+        default=Value(0.0), output_field=FloatField(),
+    )
+    graded = Q(grade__isnull=False)
+    return (
+        records.order_by().values('sno_id').annotate(
+            course_count=Count('id'),
+            credit_total=Sum(credit, default=0.0),
+            credited_count=Count('cno__credit'),
+            graded_count=Count('grade'),
+            graded_credit=Sum(credit, filter=graded, default=0.0),
+            passed_credit=Sum(credit, filter=Q(grade__gte=PASS_GRADE), default=0.0),
+            grade_sum=Sum('grade', default=0.0),
+            grade_point_credit=Sum(point * credit, filter=graded, default=0.0),
+        )
+    )
+
+
+def _row(sno, values=None):
+    values = values or {}
+    return transcript(sno_id=sno, **{name: values.get(name, 0) for name in SUMMARY_FIELDS})
+
+
+def _build(snos):
+    """为一批学生现算汇总，返回未保存的 transcript 对象"""
+    found = {row['sno_id']: row for row in _summaries(sc.objects.filter(sno_id__in=snos))}
+    return [_row(sno, found.get(sno)) for sno in snos]
+
+
+def _chunks(snos):
+    chunk = []
+    for sno in snos:
+        chunk.append(sno)
+        if len(chunk) >= BATCH_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def refresh(sno):
+    """重算一个学生；只更新已有的行，不会在学生被删除的过程中把行又建回来"""
+    # 分组查询不能用 first()：它会按主键排序，把 id 也加进 GROUP BY
+    values = next(iter(_summaries(sc.objects.filter(sno_id=sno))), {})
+    transcript.objects.filter(pk=sno).update(**{name: values.get(name, 0) for name in SUMMARY_FIELDS})
+
+
+def refresh_many(snos):
+    """
+    重算一批学生（课程学分变化、批量录入成绩后）。
+    整行删掉重插：8 个字段的 bulk_update 要为每行拼 CASE 表达式，批量时反而更慢。
+    """
+    for chunk in _chunks(dict.fromkeys(snos)):
+        rows = _build(chunk)
+        with transaction.atomic():
+            transcript.objects.filter(pk__in=chunk).delete()
+            transcript.objects.bulk_create(rows)
+
+
+def create_for(snos):
+    """新学生建空行（单条保存和批量导入都调用）"""
+    transcript.objects.bulk_create([_row(sno) for sno in snos], ignore_conflicts=True)
+
+
+@transaction.atomic
+def rebuild():
+    """全量重建，返回行数"""
+    transcript.objects.all().delete()
+    total = 0
+    snos = student.objects.order_by('sno').values_list('sno', flat=True).iterator(chunk_size=BATCH_SIZE)
+    for chunk in _chunks(snos):
+        total += len(transcript.objects.bulk_create(_build(chunk)))
+    return total
+
+
+# ==================== 信号调用 ====================
+
+def student_removed_with(origin):
+    """删除学生 / 班级 / 系部时级联删掉的选课记录：学生本身也会被删，无需重算"""
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return model in (student, cl, depart)
+
+
+def sc_changed(instance, origin=None):
+    if origin is not None and student_removed_with(origin):
+        return
+    refresh(instance.sno_id)
+
+
+def courses_added(added):
+    """
+    批量选课：added 为 {学号: 新增课程号元组}。新记录没有成绩，只影响课程数、总学分和有学分的课程数，
+    按“新增了哪些课程”分组，每组一次 F() 增量 UPDATE，不再逐个学生重算。
+    """
+    credits = dict(course.objects.filter(
+        cno__in={cno for cnos in added.values() for cno in cnos}
+    ).values_list('cno', 'credit'))
+    groups = {}
+    for sno, cnos in added.items():
+        groups.setdefault(cnos, []).append(sno)
+    for cnos, snos in groups.items():
+        transcript.objects.filter(pk__in=snos).update(
+            course_count=F('course_count') + len(cnos),
+            credit_total=F('credit_total') + sum(credits.get(cno) or 0 for cno in cnos),
+            credited_count=F('credited_count') + sum(credits.get(cno) is not None for cno in cnos),
+        )
+
+
+def credit_changed(cno):
+    refresh_many(sc.objects.filter(cno_id=cno).values_list('sno_id', flat=True))
+
+
+# ==================== 读取 ====================
+
+def summary(sno):
+    """读取一个学生的汇总；历史数据没有这一行时现算并补上"""
+    row = transcript.objects.filter(pk=sno).first()
+    if row is None:
+        create_for([sno])
+        refresh(sno)
+        row = transcript.objects.get(pk=sno)
+    return row
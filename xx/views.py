@@ -1,30 +1,46 @@
 # ============ 标准库 ============
 import ast
+import asyncio
 import builtins
 import json
+import os
 import re
-from datetime import datetime, date
+import tempfile
+import time
+from datetime import datetime
 
-import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.models import User
-from django.db import transaction
+from django.db import IntegrityError, close_old_connections, transaction
 from django.db.models import Q, Avg, Sum, Count, Max, Min
 from django.db.models.query import QuerySet
-from django.http import HttpResponse
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 # ============ Django ============
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views import View
 from django.views.generic import ListView, DetailView
-# ============ 第三方库 ============
-from openpyxl import load_workbook, Workbook
-
 # ============ 本地模块 ============
-from .models import student, cl, depart, course, sc
+from . import chat_history, columnar, governor, grades, intents, result_cache, result_pages, sandbox, search, stats, transcripts
+from . import prompt as prompt_schema
+from . import ai_client
+from .ai_client import aget_ai_response, astream_ai_response
+from .cache import VersionedCacheMixin, cache_stats, cached
+from .code_cache import code_cache
+from .enrollment import enroll
+from .facets import class_options, student_facets
+from .grade_entry import GradeFormatError, apply_grades, read_grid, read_json, read_upload
+from .jobs import job_status, save_upload, submit
+from .models import student, cl, depart, course, sc, job
+from .pagination import KeysetPaginator
+from .student_io import (
+    ImportFormatError, export_rows, filter_students, import_students, iter_csv, iter_ndjson,
+    student_order, write_xlsx,
+)
 
 # ==================== 用户认证模块 ====================
 class UserLoginView(View):
@@ -120,57 +136,60 @@ class UserPasswordView(LoginRequiredMixin, View):
 
 # ==================== 学生管理模块 ====================
 
-class StudentListView(LoginRequiredMixin, ListView):
+class StudentFilterMixin:
+    """学生列表与导出共用的筛选、排序参数处理"""
+
+    def get_order(self):
+        return student_order(self.request.GET)
+
+    def filter_students(self, queryset):
+        return filter_students(queryset, self.request.GET)
+
+    def get_paginator(self, queryset, per_page=20):
+        order_field, descending = self.get_order()
+        return KeysetPaginator(queryset, order_field, descending, per_page)
+
+
+class StudentListView(LoginRequiredMixin, StudentFilterMixin, ListView):
     """学生列表"""
     model = student
     template_name = 'student_list.html'
     context_object_name = 'students'
+    page_size = 20
 
     def get_queryset(self):
-        queryset = student.objects.select_related('classno', 'classno__dno')
-
-        # 筛选条件
-        sno = self.request.GET.get('sno', '').strip()
-        sname = self.request.GET.get('sname', '').strip()
-        sex = self.request.GET.get('sex', '').strip()
-        classno = self.request.GET.get('classno', '').strip()
-
-        if sno:
-            queryset = queryset.filter(sno__icontains=sno)
-        if sname:
-            queryset = queryset.filter(sname__icontains=sname)
-        if sex:
-            queryset = queryset.filter(sex=sex)
-        if classno:
-            queryset = queryset.filter(classno__classno=classno)
+        queryset = self.filter_students(
+            student.objects.select_related('classno', 'classno__dno')
+        )
 
         # 排序
-        order = self.request.GET.get('order', 'sno')
-        direction = self.request.GET.get('direction', 'asc')
-
-        # 排序字段白名单
-        order_map = {
-            'sno': 'sno',
-            'sname': 'sname',
-            'age': 'age',
-            'classno': 'classno__classno',
-            'semester': 'semester',
-        }
-
-        order_field = order_map.get(order, 'sno')
-        if direction == 'desc':
+        order_field, descending = self.get_order()
+        if descending:
             order_field = '-' + order_field
 
         return queryset.order_by(order_field)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        queryset = self.get_queryset()
+        queryset = self.object_list
 
-        context['classes'] = cl.objects.all()
-        context['boy_count'] = queryset.filter(sex='boy').count()
-        context['girl_count'] = queryset.filter(sex='girl').count()
-        context['class_count'] = queryset.values('classno').distinct().count()
+        # 键集分页：只取当前页，翻页代价与页码无关
+        page = self.get_paginator(queryset, self.page_size).page(
+            after=self.request.GET.get('after'),
+            before=self.request.GET.get('before'),
+            last=self.request.GET.get('last') == '1',
+        )
+        context['students'] = page.object_list
+        context['page'] = page
+
+        # 分面计数：一次聚合查询，按筛选条件缓存
+        facets = student_facets(queryset, self.request.GET)
+        context['facets'] = facets
+        context['total_count'] = facets['total']
+        context['classes'] = class_options()
+        context['boy_count'] = facets['sex']['boy']
+        context['girl_count'] = facets['sex']['girl']
+        context['class_count'] = facets['class_count']
         context['order'] = self.request.GET.get('order', 'sno')
         context['direction'] = self.request.GET.get('direction', 'asc')
 
@@ -296,47 +315,38 @@ class StudentDeleteView(LoginRequiredMixin, View):
         return redirect('/students/')
 
 
-class StudentDetailView(LoginRequiredMixin, DetailView):
+class StudentDetailView(LoginRequiredMixin, VersionedCacheMixin, DetailView):
     """学生详情"""
     model = student
     template_name = 'student_detail.html'
     context_object_name = 'stu'
     pk_url_kwarg = 'sno'
+    cache_depends = ('student', 'cl', 'depart', 'course', 'sc')
 
     def get_object(self):
-        return get_object_or_404(student, sno=self.kwargs['sno'])
+        return get_object_or_404(student.objects.select_related('classno__dno'), sno=self.kwargs['sno'])
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        stu = self.get_object()
-
-        records = sc.objects.select_related('cno').filter(sno=stu)
-        graded_records = records.filter(grade__isnull=False)
-
-        # ✅ 统一逻辑：学分和平均分都统计已评分课程
-        total_credit = graded_records.aggregate(
-            total=Sum('cno__credit')
-        )['total'] or 0
-
-        avg_grade = graded_records.aggregate(
-            avg=Avg('grade')
-        )['avg']
-
-        # 及格课程学分（如需要单独统计）
-        passed_credit = graded_records.filter(
-            grade__gte=60
-        ).aggregate(
-            total=Sum('cno__credit')
-        )['total'] or 0
-
-        context['courses'] = records
-        context['total_credit'] = round(total_credit, 1)
-        context['passed_credit'] = round(passed_credit, 1)  # ✅ 新增及格学分
-        context['avg_grade'] = round(avg_grade, 1) if avg_grade else None
-        context['graded_count'] = graded_records.count()
-
+        context.update(self.cached(self.build_summary))
         return context
 
+    def build_summary(self):
+        stu = self.object
+        # 通过反向管理器取记录，r.sno 直接指向 stu，模板里不会再逐条查学生
+        records = stu.sc_set.select_related('cno')
+        # 学分 / 平均分等汇总读 transcript 表的一行，统一只统计已评分课程
+        summary = transcripts.summary(stu.sno)
+
+        return {
+            'courses': list(records),
+            'total_credit': round(summary.graded_credit, 1),
+            'passed_credit': round(summary.passed_credit, 1),  # ✅ 新增及格学分
+            'avg_grade': summary.avg_grade,
+            'graded_count': summary.graded_count,
+            'gpa': summary.gpa,
+        }
+
 
 class StudentImportExcelView(LoginRequiredMixin, View):
     """Excel批量导入学生"""
@@ -356,124 +366,120 @@ class StudentImportExcelView(LoginRequiredMixin, View):
             messages.error(request, '仅支持 .xlsx 文件')
             return redirect('/students/import/excel/')
 
-        try:
-            wb = load_workbook(file)
-            ws = wb.active
-
-            headers = [cell.value for cell in ws[1]]
-            required_headers = [
-                'sno', 'sname', 'sex', 'native', 'age',
-                'classno', 'semester', 'home', 'telephone'
-            ]
-
-            if headers != required_headers:
-                messages.error(request, 'Excel 表头格式不正确，应为：' + ', '.join(required_headers))
-                return redirect('/students/import/excel/')
-
-            success = 0
-            errors = []
-
-            # ✅ 策略：允许部分成功，每条记录单独事务
-            for idx, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
-                try:
-                    data = dict(zip(headers, row))
-
-                    # 跳过空行
-                    if not data.get('sno'):
-                        continue
-
-                    with transaction.atomic():
-                        # 检查学号是否已存在
-                        if student.objects.filter(sno=data['sno']).exists():
-                            raise ValueError(f"学号已存在")
-
-                        class_obj = cl.objects.get(classno=data['classno'])
-
-                        student.objects.create(
-                            sno=data['sno'],
-                            sname=data['sname'],
-                            sex=data.get('sex') or 'girl',
-                            native=data.get('native') or '',
-                            age=data.get('age') or None,
-                            classno=class_obj,
-                            semester=data.get('semester') or None,
-                            home=data.get('home') or '',
-                            telephone=data.get('telephone') or '',
-                        )
-                        success += 1
-
-                except Exception as e:
-                    errors.append(f"第{idx}行（学号 {data.get('sno', '未知')}）：{str(e)}")
-
-            if errors:
-                error_msg = '；'.join(errors[:5])  # 只显示前5条错误
-                if len(errors) > 5:
-                    error_msg += f'...（共{len(errors)}条错误）'
-                messages.warning(request, f'成功导入 {success} 条，失败 {len(errors)} 条。{error_msg}')
-            else:
-                messages.success(request, f'成功导入 {success} 条学生')
-
-            return redirect('/students/')
+        # 后台模式：文件落盘后交给 runjobs worker，页面跳转到任务进度页
+        if request.POST.get('async'):
+            j = submit('student_import', request.user, input_file=save_upload(file))
+            return redirect(f'/jobs/{j.pk}/')
 
+        try:
+            result = import_students(file)
+        except ImportFormatError as e:
+            messages.error(request, str(e))
+            return redirect('/students/import/excel/')
         except Exception as e:
             messages.error(request, f'导入失败：{str(e)}')
             return redirect('/students/import/excel/')
 
+        errors = result.errors
+        if errors:
+            error_msg = '；'.join(errors[:5])  # 只显示前5条错误
+            if len(errors) > 5:
+                error_msg += f'...（共{len(errors)}条错误）'
+            messages.warning(request, f'成功导入 {result.success} 条，失败 {len(errors)} 条。{error_msg}')
+        else:
+            messages.success(request, f'成功导入 {result.success} 条学生')
 
-class StudentExportExcelView(LoginRequiredMixin, View):
-    """导出学生Excel"""
+        return redirect('/students/')
 
-    def get(self, request):
-        wb = Workbook()
-        ws = wb.active
-        ws.title = '学生信息'
 
-        headers = [
-            'sno', 'sname', 'sex', 'native', 'age',
-            'classno', 'semester', 'home', 'telephone'
-        ]
-        ws.append(headers)
-
-        for stu in student.objects.select_related('classno').all():
-            ws.append([
-                stu.sno,
-                stu.sname,
-                stu.sex,
-                stu.native or '',
-                stu.age or '',
-                stu.classno.classno,
-                stu.semester or '',
-                stu.home or '',
-                stu.telephone or ''
-            ])
-
-        response = HttpResponse(
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+class StudentExportExcelView(LoginRequiredMixin, StudentFilterMixin, View):
+    """导出学生（xlsx / csv / ndjson），筛选与排序参数与学生列表一致"""
+
+    def get(self, request):
+        fmt = request.GET.get('format', 'xlsx')
+        if request.GET.get('async') == '1':
+            params = {k: v for k, v in request.GET.items() if k not in ('async', 'after', 'before', 'last')}
+            j = submit('student_export', request.user, params=params)
+            return redirect(f'/jobs/{j.pk}/')
+
+        queryset = self.get_paginator(self.filter_students(student.objects.all())).ordered()
+        rows = export_rows(queryset)
+        filename = f'students_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
+
+        if fmt == 'csv':
+            response = StreamingHttpResponse(iter_csv(rows), content_type='text/csv; charset=utf-8')
+            response['Content-Disposition'] = f'attachment; filename={filename}.csv'
+            return response
+
+        if fmt == 'ndjson':
+            response = StreamingHttpResponse(iter_ndjson(rows), content_type='application/x-ndjson; charset=utf-8')
+            response['Content-Disposition'] = f'attachment; filename={filename}.ndjson'
+            return response
+
+        # xlsx 是 zip 格式，只能先写到临时文件再分块发送
+        tmp = tempfile.TemporaryFile()
+        write_xlsx(rows, tmp)
+        tmp.seek(0)
+        return FileResponse(
+            tmp,
+            as_attachment=True,
+            filename=f'{filename}.xlsx',
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
         )
-        response[
-            'Content-Disposition'] = f'attachment; filename=students_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-        wb.save(response)
-        return response
+
+
+# ==================== 后台任务模块 ====================
+
+class JobDetailView(LoginRequiredMixin, View):
+    """后台任务进度页"""
+    template_name = 'job_detail.html'
+
+    def get(self, request, pk):
+        j = get_object_or_404(job, pk=pk, owner=request.user)
+        return render(request, self.template_name, {'job': j, 'status': job_status(j)})
+
+
+class JobStatusView(LoginRequiredMixin, View):
+    """后台任务进度（JSON，供页面轮询）"""
+
+    def get(self, request, pk):
+        j = get_object_or_404(job, pk=pk, owner=request.user)
+        return JsonResponse(job_status(j), json_dumps_params={'ensure_ascii': False})
+
+
+class JobDownloadView(LoginRequiredMixin, View):
+    """下载后台任务的结果文件"""
+
+    def get(self, request, pk):
+        j = get_object_or_404(job, pk=pk, owner=request.user, status='done')
+        if not j.result_file or not os.path.exists(j.result_file):
+            raise Http404('结果文件不存在')
+        return FileResponse(open(j.result_file, 'rb'), as_attachment=True, filename=os.path.basename(j.result_file))
 
 
 # ==================== 班级管理模块 ====================
 
-class ClassListView(LoginRequiredMixin, ListView):
+class ClassListView(LoginRequiredMixin, VersionedCacheMixin, ListView):
     """班级列表"""
     model = cl
     template_name = 'class_list.html'
     context_object_name = 'classes'
+    cache_depends = ('cl', 'depart', 'student')
 
     def get_queryset(self):
-        return cl.objects.select_related('dno').annotate(
-            student_count=Count('student', distinct=True)
-        ).order_by('classno')
+        return self.cached(lambda: list(
+            cl.objects.select_related('dno').annotate(
+                student_count=Count('student', distinct=True)
+            ).order_by('classno')
+        ), 'classes')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['student_count'] = student.objects.count()
-        context['depart_count'] = depart.objects.count()
-        context['class_count'] = self.get_queryset().count()
+        context.update(self.cached(lambda: {
+            'student_count': student.objects.count(),
+            'depart_count': depart.objects.count(),
+        }, 'counts'))
+        context['class_count'] = len(self.object_list)
         return context
 
 
@@ -585,12 +591,15 @@ class ClassDeleteView(LoginRequiredMixin, View):
 
 # ==================== 系部管理模块 ====================
 
-class DepartListView(LoginRequiredMixin, ListView):
+class DepartListView(LoginRequiredMixin, VersionedCacheMixin, ListView):
     """系部列表"""
     model = depart
     template_name = 'depart_list.html'
     context_object_name = 'departs'
-    ordering = ['dno']
+    cache_depends = ('depart',)
+
+    def get_queryset(self):
+        return self.cached(lambda: list(depart.objects.order_by('dno')))
 
 
 class DepartAddView(LoginRequiredMixin, View):
@@ -659,13 +668,18 @@ class DepartDeleteView(LoginRequiredMixin, View):
 
 # ==================== 课程管理模块 ====================
 
-class CourseListView(LoginRequiredMixin, ListView):
+class CourseListView(LoginRequiredMixin, VersionedCacheMixin, ListView):
     """课程列表"""
     model = course
     template_name = 'course_list.html'
     context_object_name = 'courses'
+    cache_depends = ('course',)
+    cache_params = ('cname', 'type', 'semester', 'order')
 
     def get_queryset(self):
+        return self.cached(lambda: list(self.build_queryset()))
+
+    def build_queryset(self):
         queryset = course.objects.all()
 
         cname = self.request.GET.get('cname', '').strip()
@@ -674,7 +688,7 @@ class CourseListView(LoginRequiredMixin, ListView):
         order = self.request.GET.get('order', 'cno')
 
         if cname:
-            queryset = queryset.filter(cname__icontains=cname)
+            queryset = search.match(queryset, 'cname', cname)
         if type_:
             queryset = queryset.filter(type=type_)
         if semester:
@@ -779,15 +793,15 @@ class SelectCourseView(LoginRequiredMixin, View):
             messages.error(request, '请选择课程')
             return redirect(f'/select/{sno}/')
 
-        # ✅ 检查是否重复选课
-        if sc.objects.filter(sno=stu, cno_id=cno).exists():
-            messages.error(request, '已选过该课程')
-            return redirect(f'/select/{sno}/')
-
         try:
             course_obj = course.objects.get(cno=cno)
-            sc.objects.create(sno=stu, cno=course_obj)
+            # ✅ 重复选课由 (sno, cno) 唯一约束拦截，不再先查后插
+            with transaction.atomic():
+                sc.objects.create(sno=stu, cno=course_obj)
             messages.success(request, '选课成功')
+        except IntegrityError:
+            messages.error(request, '已选过该课程')
+            return redirect(f'/select/{sno}/')
         except course.DoesNotExist:
             messages.error(request, '课程不存在')
         except Exception as e:
@@ -796,30 +810,65 @@ class SelectCourseView(LoginRequiredMixin, View):
         return redirect(f'/sc/{sno}/')
 
 
+class BulkEnrollView(LoginRequiredMixin, View):
+    """整班 / 整系批量选课；JSON 请求体 {"classno": [...], "dno": [...], "cno": [...]} 时返回 JSON"""
+    template_name = 'bulk_enroll.html'
+
+    def get(self, request):
+        return render(request, self.template_name, {
+            'classes': class_options(),
+            'departs': depart.objects.order_by('dno'),
+            'courses': course.objects.order_by('cno'),
+        })
+
+    def post(self, request):
+        as_json = request.content_type == 'application/json'
+        if as_json:
+            try:
+                data = json.loads(request.body)
+                params = {k: [str(v) for v in data.get(k, [])] for k in ('classno', 'dno', 'cno')}
+            except (ValueError, AttributeError, TypeError):
+                return JsonResponse({'error': 'JSON 格式错误'}, status=400)
+        else:
+            params = {k: request.POST.getlist(k) for k in ('classno', 'dno', 'cno')}
+
+        error = None
+        if not params['classno'] and not params['dno']:
+            error = '请至少选择一个班级或系部'
+        elif not params['cno']:
+            error = '请至少选择一门课程'
+        if error:
+            if as_json:
+                return JsonResponse({'error': error}, status=400)
+            messages.error(request, error)
+            return redirect('/enroll/')
+
+        result = enroll(params['classno'], params['dno'], params['cno'])
+        if as_json:
+            return JsonResponse(result.as_dict())
+        messages.success(
+            request,
+            f'{result.students} 名学生 × {result.courses} 门课程：新增选课 {result.inserted} 条，'
+            f'已选跳过 {result.skipped} 条，用时 {result.as_dict()["elapsed_ms"]} 毫秒'
+        )
+        return redirect('/enroll/')
+
+
 class StudentCourseView(LoginRequiredMixin, View):
     """学生选课列表"""
     template_name = 'student_course.html'
 
     def get(self, request, sno):
         stu = get_object_or_404(student, sno=sno)
-        records = sc.objects.select_related('cno').filter(sno=stu)
-
-        # ✅ 只统计已评分课程的学分
-        graded_records = records.filter(grade__isnull=False)
-
-        total_credit = graded_records.aggregate(
-            total=Sum('cno__credit')
-        )['total'] or 0
-
-        avg_credit = records.aggregate(
-            avg=Avg('cno__credit')
-        )['avg'] or 0
+        records = stu.sc_set.select_related('cno')
+        summary = transcripts.summary(stu.sno)
 
         return render(request, self.template_name, {
             'stu': stu,
             'records': records,
-            'total_credit': round(total_credit, 1),
-            'avg_credit': round(avg_credit, 1),
+            # ✅ 只统计已评分课程的学分
+            'total_credit': round(summary.graded_credit, 1),
+            'avg_credit': summary.avg_credit,
         })
 
 
@@ -862,37 +911,34 @@ class DashboardView(LoginRequiredMixin, View):
     template_name = 'dashboard.html'
 
     def get(self, request):
+        # 统计数据来自增量维护的快照表，不再实时聚合
+        snap, departs = stats.snapshot()
+
         # 系部学生人数统计
-        depart_stat = student.objects.values(
-            'classno__dno__dname'
-        ).annotate(
-            total=Count('sno')
-        ).order_by('-total')
+        depart_stat = [
+            {'classno__dno__dname': d.dno.dname, 'total': d.students}
+            for d in sorted(departs, key=lambda d: -d.students) if d.students
+        ]
 
         # 系部课程选课人数统计
-        depart_course_stat = sc.objects.values(
-            'sno__classno__dno__dname'
-        ).annotate(
-            total=Count('sno', distinct=True)
-        ).order_by('-total')
+        depart_course_stat = [
+            {'sno__classno__dno__dname': d.dno.dname, 'total': d.enrolled}
+            for d in sorted(departs, key=lambda d: -d.enrolled) if d.enrolled
+        ]
 
         # 平均成绩
-        avg_grade = sc.objects.filter(
-            grade__isnull=False
-        ).aggregate(
-            avg=Avg('grade')
-        )['avg']
+        avg_grade = snap.grade_sum / snap.graded_count if snap.graded_count else None
 
-        # 最近选课记录
+        # 最近选课记录（主键倒序，走主键索引）
         recent_sc = sc.objects.select_related(
-            'sno', 'cno'
+            'sno', 'sno__classno', 'cno'
         ).order_by('-id')[:10]
 
         return render(request, self.template_name, {
-            'student_total': student.objects.count(),
-            'course_total': course.objects.count(),
-            'class_total': cl.objects.count(),
-            'depart_total': depart.objects.count(),
+            'student_total': snap.student_total,
+            'course_total': snap.course_total,
+            'class_total': snap.class_total,
+            'depart_total': snap.depart_total,
             'avg_grade': round(avg_grade, 1) if avg_grade else None,
             'depart_stat': depart_stat,
             'depart_course_stat': depart_course_stat,
@@ -900,43 +946,130 @@ class DashboardView(LoginRequiredMixin, View):
         })
 
 
-class CourseStudentsView(LoginRequiredMixin, View):
-    """课程选课学生列表及成绩统计"""
+class CourseStudentsView(LoginRequiredMixin, VersionedCacheMixin, View):
+    """课程选课学生列表及成绩统计；POST 批量录入成绩"""
     template_name = 'course_students.html'
+    cache_depends = ('course', 'sc', 'student', 'cl', 'depart')
 
     def get(self, request, cno):
-        c = get_object_or_404(course, cno=cno)
-        records = sc.objects.select_related('sno', 'sno__classno').filter(cno=c)
-
-        # 统计已评分课程
-        graded_records = records.filter(grade__isnull=False)
+        return render(request, self.template_name, self.cached(lambda: self.build_context(cno)))
 
-        stats = graded_records.aggregate(
-            avg=Avg('grade'),
-            max_grade=Max('grade'),
-            min_grade=Min('grade'),
-            graded=Count('grade')
+    def post(self, request, cno):
+        """
+        批量录入成绩，三种输入：
+        JSON 请求体 [{"sno": ..., "grade": ...}]（返回 JSON）、上传 CSV / XLSX（sno, grade 两列）、页面网格表单。
+        """
+        c = get_object_or_404(course, cno=cno)
+        as_json = request.content_type == 'application/json'
+        try:
+            if as_json:
+                entries = read_json(request.body)
+            elif request.FILES.get('file'):
+                entries = read_upload(request.FILES['file'])
+            else:
+                entries = read_grid(request.POST)
+        except GradeFormatError as e:
+            if as_json:
+                return JsonResponse({'error': str(e)}, status=400)
+            messages.error(request, str(e))
+            return redirect(f'/courses/{cno}/students/')
+
+        result = apply_grades(c, entries)
+        if as_json:
+            return JsonResponse(result.as_dict())
+
+        summary = f'更新 {result.updated} 条，未变化 {result.unchanged} 条，用时 {result.as_dict()["elapsed_ms"]} 毫秒'
+        errors = result.errors
+        if errors:
+            error_msg = '；'.join(errors[:5])  # 只显示前5条错误
+            if len(errors) > 5:
+                error_msg += f'...（共{len(errors)}条错误）'
+            messages.warning(request, f'{summary}，失败 {len(errors)} 条。{error_msg}')
+        else:
+            messages.success(request, summary)
+        return redirect(f'/courses/{cno}/students/')
+
+    def build_context(self, cno):
+        # 缓存里只放普通的值（dict / 数字 / 字符串），不放模型实例
+        c = get_object_or_404(course.objects.values('cno', 'cname', 'type', 'credit', 'lecture'), cno=cno)
+        c['type_display'] = dict(course._meta.get_field('type').choices).get(c['type'], c['type'])
+        sex_display = dict(student._meta.get_field('sex').choices)
+        columns = ('sno', 'sname', 'sex', 'age', 'classno', 'classname', 'dno', 'dname', 'grade')
+        rows = sc.objects.filter(cno_id=cno).values_list(
+            'sno_id', 'sno__sname', 'sno__sex', 'sno__age', 'sno__classno_id', 'sno__classno__classname',
+            'sno__classno__dno_id', 'sno__classno__dno__dname', 'grade',
         )
+        records = [dict(zip(columns, row)) for row in rows]
+        for r in records:
+            r['sex'] = sex_display.get(r['sex'], r['sex'])
 
-        # 成绩分布
-        excellent = graded_records.filter(grade__gte=90).count()
-        good = graded_records.filter(grade__gte=80, grade__lt=90).count()
-        passed = graded_records.filter(grade__gte=60, grade__lt=80).count()
-        failed = graded_records.filter(grade__lt=60).count()
-
-        return render(request, self.template_name, {
+        # 成绩统计直接在已取出的记录上计算，不再逐段 count()
+        dist = grades.distribution(r['grade'] for r in records)
+        return {
             'course': c,
             'records': records,
-            'excellent': excellent,
-            'good': good,
-            'passed': passed,
-            'failed': failed,
-            'avg': round(stats['avg'], 1) if stats['avg'] else None,
-            'max_grade': stats['max_grade'],
-            'min_grade': stats['min_grade'],
-            'graded': stats['graded'],
-            'total': records.count(),
+            'dist': dist,
+            **dist['counts'],
+            'avg': dist['avg'],
+            'max_grade': dist['max'],
+            'min_grade': dist['min'],
+            'graded': dist['graded'],
+            'total': dist['total'],
+        }
+
+
+class CourseGradeStatsView(LoginRequiredMixin, View):
+    """
+    多门课程成绩分布（JSON）：?cno=001&cno=002 或 ?cno=001,002，不传则统计全部课程；
+    ?buckets=90,75,60 自定义分数线。
+    """
+
+    def get(self, request):
+        cnos = sorted({
+            cno.strip() for value in request.GET.getlist('cno') for cno in value.split(',') if cno.strip()
         })
+        edges = request.GET.get('buckets', '').strip()
+        try:
+            buckets = grades.make_buckets(edges.split(',')) if edges else grades.GRADE_BUCKETS
+        except ValueError:
+            return JsonResponse({'error': 'buckets 应为逗号分隔的分数线，例如 90,80,60'}, status=400)
+
+        courses = cached(
+            'CourseGradeStatsView', ('course', 'sc'),
+            lambda: grades.course_distributions(cnos, buckets),
+            key_parts=(cnos, buckets),
+        )
+        return JsonResponse({
+            'buckets': [{'key': key, 'lower': lower} for key, lower in buckets],
+            'courses': courses,
+        })
+
+
+class CacheStatsView(LoginRequiredMixin, View):
+    """各视图缓存命中率"""
+
+    def get(self, request):
+        names = [
+            'ClassListView', 'CourseListView', 'DepartListView',
+            'CourseStudentsView', 'StudentDetailView', 'CourseGradeStatsView',
+            result_cache.CACHE_NAME,
+        ]
+        result = cache_stats(names)
+        # AI 助手的代码缓存和规则匹配统计在进程内，是当前进程的数字
+        result['ai_code'] = code_cache.stats()
+        result['ai_rules'] = intents.stats()
+        result['ai_prompt'] = prompt_schema.stats()
+        return JsonResponse(result)
+
+
+class SearchSuggestView(LoginRequiredMixin, View):
+    """输入联想：?q=关键字&kind=student|course|class（不传 kind 时三类都查）"""
+
+    def get(self, request):
+        q = request.GET.get('q', '').strip()
+        kind = request.GET.get('kind', '').strip()
+        kinds = (kind,) if kind in search.SUGGEST_KINDS else search.SUGGEST_KINDS
+        return JsonResponse({'q': q, **search.suggest(q, kinds)})
 
 
 # ==================== AI助手模块 ====================
@@ -975,12 +1108,32 @@ class CodeValidator:
 
     @staticmethod
     def validate_ast(code: str) -> bool:
+        CodeValidator.inspect(code)
+        return True
+
+    @staticmethod
+    def inspect(code: str):
+        """
+        校验代码，同时收集引用到的名字和查询字符串（字段路径、属性名），
+        返回 (名字集合, 字段路径集合)，供结果缓存确定依赖的表。
+        """
         try:
             tree = ast.parse(code)
         except SyntaxError as e:
             raise SecurityError(f'代码语法错误: {e}')
 
+        names = set()
+        lookups = set()
         for node in ast.walk(tree):
+            if isinstance(node, ast.Name):
+                names.add(node.id)
+            elif isinstance(node, ast.Attribute):
+                lookups.add(node.attr)
+            elif isinstance(node, ast.keyword) and node.arg:
+                lookups.add(node.arg)
+            elif isinstance(node, ast.Constant) and isinstance(node.value, str):
+                lookups.add(node.value)
+
             # 1) 禁止 import / from
             if isinstance(node, (ast.Import, ast.ImportFrom)):
                 raise SecurityError('禁止使用 import / from')
@@ -997,10 +1150,13 @@ class CodeValidator:
             if isinstance(node, (ast.For, ast.While)):
                 raise SecurityError('禁止使用循环语句')
 
-            # 5) 禁止访问任何 dunder 属性（防 __class__/__subclasses__/__mro__ 等逃逸链）
+            # 5) 禁止访问任何 dunder 属性（防 __class__/__subclasses__/__mro__ 等逃逸链）；
+            #    单下划线属性和 .model 能拿到真实模型 / 管理器，绕过行数限制（见 governor.py），同样禁止
             if isinstance(node, ast.Attribute):
                 if isinstance(node.attr, str) and node.attr.startswith('__'):
                     raise SecurityError('禁止访问双下划线属性')
+                if isinstance(node.attr, str) and (node.attr.startswith('_') or node.attr == 'model'):
+                    raise SecurityError(f'禁止访问属性: {node.attr}')
 
             # 6) 禁止直接引用某些危险名字（尤其是 __builtins__）
             if isinstance(node, ast.Name):
@@ -1023,7 +1179,10 @@ class CodeValidator:
                     if isinstance(attr, str) and attr.startswith('__'):
                         raise SecurityError('禁止调用双下划线方法')
 
-        return True
+        return names, lookups
+
+
+ROW_BATCH_SIZE = 20  # 流式输出时每批送出的行数
 
 
 class AICodeExecutor:
@@ -1041,19 +1200,88 @@ class AICodeExecutor:
         }
 
     def execute_ai_code(self, code_string: str, context=None):
+        result = None
+        for kind, payload in self.iter_ai_code(code_string, context):
+            if kind == 'result':
+                result = payload
+        return result
+
+    def iter_ai_code(self, code_string: str, context=None):
+        """
+        逐步执行：结果是查询集时先产出 ('columns', 列名)，再按批产出 ('rows', 行元组列表)，
+        最后产出 ('result', 结果)，与 execute_ai_code 的返回值相同。
+        """
         try:
-            self._validate_code_safety(code_string)
+            names, lookups = self._validate_code_safety(code_string)
+            # 外部传入的 context 会影响结果，这种调用不走缓存
+            key = None
+            if not context:
+                key, cached_result = result_cache.lookup(code_string, names, lookups)
+                if cached_result is not None:
+                    yield 'result', cached_result
+                    return
             exec_globals = self._create_safe_environment()
             if context:
                 exec_globals.update(context)
 
-            # 执行 AI 代码（必须产出 result 变量）
-            exec(code_string, exec_globals)
-            result = exec_globals.get('result')
-            return self._serialize_result(result)
+            # 执行期间每条查询都经过代价检查（见 governor.py）
+            with governor.guard():
+                # 执行 AI 代码（必须产出 result 变量）
+                exec(code_string, exec_globals)
+                result = exec_globals.get('result')
+                if isinstance(result, QuerySet) and columnar.supports(result):
+                    # 行先于 count() 送出；超过一页时带上下一页游标（见 result_pages.py）
+                    pager = result_pages.Pager(result)
+                    columns = pager.columns
+                    yield 'columns', columns
+                    data = []
+                    batch = []
+                    for row in pager:
+                        batch.append(row)
+                        if len(batch) >= ROW_BATCH_SIZE:
+                            data.extend(batch)
+                            yield 'rows', batch
+                            batch = []
+                    if batch:
+                        data.extend(batch)
+                        yield 'rows', batch
+                    serialized = {'type': 'queryset', 'columns': columns, 'rows': data}
+                    serialized.update(self._count(result, data))
+                    if pager.next:
+                        serialized['next'] = pager.next
+                else:
+                    serialized = self._serialize_result(result)
+            if key is not None:
+                result_cache.store(key, serialized)
+            yield 'result', serialized
+
+        except Exception as e:
+            yield 'result', {'error': f'执行失败: {str(e)}'}
 
+    def iter_page(self, code_string, cursor):
+        """
+        结果句柄的后续页：代码在登记句柄之前已经校验过（句柄只在服务端保存代码），这里直接执行。
+        产出 ('result', {'columns', 'rows', 'next'})。
+        """
+        try:
+            exec_globals = self._create_safe_environment()
+            with governor.guard():
+                exec(code_string, exec_globals)
+                result = exec_globals.get('result')
+                if not (isinstance(result, QuerySet) and columnar.supports(result)):
+                    raise ValueError('结果不是查询集，无法翻页')
+                pager = result_pages.Pager(result, cursor)
+                rows = list(pager)
+            yield 'result', {'columns': pager.columns, 'rows': rows, 'next': pager.next}
         except Exception as e:
-            return {'error': f'执行失败: {str(e)}'}
+            yield 'result', {'error': f'执行失败: {str(e)}'}
+
+    def _count(self, queryset, data):
+        """不足一页时行数就是总数，不再查 count()；数量很大时给估计值"""
+        if len(data) < result_pages.PAGE_SIZE:
+            return {'count': len(data)}
+        total, exact = governor.count(queryset)
+        return {'count': total} if exact else {'count': total, 'count_exact': False}
 
     def _validate_code_safety(self, code: str):
         # 额外做一层快速字符串过滤（AST 才是主防线）
@@ -1069,7 +1297,7 @@ class AICodeExecutor:
             if re.search(pattern, code, re.IGNORECASE):
                 raise SecurityError(f'检测到不安全代码: {pattern}')
 
-        CodeValidator.validate_ast(code)
+        return CodeValidator.inspect(code)
 
     def _create_safe_environment(self):
         # 关键：显式设置 __builtins__，否则 exec 会注入完整 builtins
@@ -1083,37 +1311,42 @@ class AICodeExecutor:
 
             # ORM 可用对象/聚合函数
             'Q': Q, 'Avg': Avg, 'Sum': Sum, 'Count': Count, 'Max': Max, 'Min': Min,
-            'student': student,
-            'cl': cl,
-            'depart': depart,
-            'course': course,
-            'sc': sc,
+            # 模型的 objects 换成自动加 LIMIT 的 GovernedQuerySet
+            'student': governor.governed(student),
+            'cl': governor.governed(cl),
+            'depart': governor.governed(depart),
+            'course': governor.governed(course),
+            'sc': governor.governed(sc),
         }
         return env
 
+    def _table(self, data):
+        """返回 {'columns', 'rows'}，无法按表格处理时返回 {'data'}"""
+        if isinstance(data, QuerySet):
+            data = data[:100]
+            if columnar.supports(data):
+                return columnar.from_queryset(data)
+            data = list(data)
+        return columnar.from_records(data) or {'data': data}
+
     def _serialize_result(self, result):
         if result is None:
             return {'type': 'none', 'data': '无结果'}
 
         # multi 表格结构
         if isinstance(result, list) and all(isinstance(r, dict) and 'title' in r and 'data' in r for r in result):
-            serialized = []
-            for r in result:
-                if isinstance(r['data'], QuerySet):
-                    r['data'] = list(r['data'][:100])
-                r['data'] = make_json_safe(r['data'])
-                serialized.append(r)
-            return {'type': 'multi', 'data': serialized}
+            return {'type': 'multi', 'data': [{'title': r['title'], **self._table(r['data'])} for r in result]}
 
         # queryset
         if isinstance(result, QuerySet):
-            data = list(result[:100])
-            data = make_json_safe(data)
-            return {'type': 'queryset', 'count': result.count(), 'data': data}
+            table = self._table(result)
+            return {'type': 'queryset', **table, **self._count(result, table.get('rows', table.get('data')))}
 
-        # 常见结构
-        if isinstance(result, (list, dict, tuple)):
-            return {'type': type(result).__name__, 'data': make_json_safe(result)}
+        # 常见结构：同构的字典 / 模型实例列表按表格（列式）返回，其余原样交给 columnar.dumps
+        if isinstance(result, (list, tuple)):
+            return {'type': type(result).__name__, **self._table(result)}
+        if isinstance(result, dict):
+            return {'type': 'dict', 'data': result}
 
         if isinstance(result, (str, int, float, bool)):
             return {'type': type(result).__name__, 'data': result}
@@ -1122,48 +1355,8 @@ class AICodeExecutor:
 
 CODE_GENERATION_PROMPT = """
 你是一个Django ORM代码生成专家。根据用户需求生成可执行的Python代码。
-可用的模型：
-class depart(models.Model):
-    dno = models.CharField(max_length=6, primary_key=True,null=False)
-    dname = models.CharField(max_length=10, null=False)
-    telephone = models.CharField(max_length=6,)
-
-class cl(models.Model):
-    classno = models.CharField(max_length=6,primary_key=True,)
-    classname = models.CharField(max_length=10,null=False)
-    dno = models.ForeignKey(depart, on_delete=models.CASCADE)
-class student(models.Model):
-    stusex = (
-        ('girl', '女'),
-        ('boy', '男'),
-    )
-    sno = models.CharField(max_length=10, primary_key=True,null=False)
-    sname = models.CharField(max_length=10, null=False)
-    sex = models.CharField(max_length=4,choices=stusex, default='girl')
-    native = models.CharField(max_length=20,)
-    age = models.IntegerField(null=True)
-    classno = models.ForeignKey(cl, on_delete=models.CASCADE)
-    entime = models.DateTimeField(null=True,auto_now=True)
-    semester = models.IntegerField(null=True)
-    home = models.CharField(max_length=40,)
-    telephone = models.CharField(max_length=20, )
-class course(models.Model):
-    coutype = (
-        ('crc', '公共课'),
-        ('bcim', '专业基础课'),
-        ('spc', '专业课'),
-        ('ocos', '选修课')
-    )
-    cno = models.CharField(max_length=3, primary_key=True,null=False)
-    cname = models.CharField(max_length=20, null=False)
-    lecture = models.FloatField(null=True)
-    semester = models.IntegerField(null=True)
-    credit = models.FloatField(null=True)
-    type = models.CharField(max_length=10,null = True,choices=coutype,default='crc')
-class sc(models.Model):
-    sno = models.ForeignKey(student, on_delete=models.CASCADE)
-    cno = models.ForeignKey(course, on_delete=models.CASCADE)
-    grade = models.FloatField(null=True)
+可用的模型（只列出与本需求相关的模型和字段）：
+{schema}
 生成要求：
 如果返回多个模型的数据，请使用列表，每个元素包含 title 和 data
 严格按照上面给出的模型以及字段名来进行编写代码，不允许假设，不允许更改。
@@ -1175,13 +1368,9 @@ class sc(models.Model):
 6. 不允许出现 import / from / print / try / except
 7. 不允许定义函数或类
 8. 可以直接使用：student, cl, depart, course, sc, Q, Count, Avg, Sum
+9. 数量、总和、平均值用 count() / aggregate() / annotate() 在数据库中计算，不要取出记录后在 Python 里数或求和
 10.你可以使用跨表的多表查询
-11.course 模型 type 字段合法取值：
-- "crc" → 公共课
-- "bcim" → 专业基础课
-- "spc" → 专业课
-- "ocos" → 选修课
-前者是具体的值，后者是前者的含义
+11.choices 中每一项的前者是字段里存的值，后者是它的含义，查询时用前者
 示例：
 用户：查询所有男生信息
 代码：
@@ -1190,57 +1379,10 @@ result = student.objects.filter(sex='boy').values('sno', 'sname', 'age')
 代码：
 result = list(student.objects.values('classno__classname').annotate(count=Count('sno')))
 
-现在请为以下需求生成代码：
-用户需求：{user_query}
+现在请为用户消息中的需求生成代码。
 """
 
 
-def get_ai_response(messages):
-    url = f"{settings.AI_BASE_URL}/v1/chat/completions"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {settings.AI_API_KEY}",
-    }
-    payload = {
-        "model": settings.AI_MODEL,  # 比如 'deepseek-chat'
-        "messages": messages
-    }
-
-    try:
-        response = requests.post(
-            url,
-            headers=headers,
-            json=payload,
-            timeout=30,
-        )
-
-        print("=== AI HTTP 状态码 ===")
-        print(response.status_code)
-        print("=== AI 原始文本响应 ===")
-        print(response.text[:1000])
-        print("======================")
-
-        if response.status_code == 401:
-            raise RuntimeError(
-                "AI接口返回 401 未认证：请检查 DeepSeek API Key 是否配置正确、是否带在 Authorization 头里。"
-            )
-
-        if not response.ok:
-            raise RuntimeError(
-                f"AI接口返回非成功状态码 {response.status_code}，内容: {response.text[:200]}"
-            )
-
-        data = response.json()
-        print("=== AI 解析后的 JSON ===")
-        print(data)
-        print("======================")
-
-        return data["choices"][0]["message"]["content"]
-
-    except Exception as e:
-        raise RuntimeError(f"AI调用失败: {str(e)}")
-
-
 def extract_code_from_response(text: str) -> str:
     """
     优先提取 ```...``` 内的代码；兼容 ```python / ```py / ``` 以及 \r\n。
@@ -1275,107 +1417,270 @@ def extract_code_from_response(text: str) -> str:
 
 def format_execution_result(result):
     if 'error' in result:
-        return json.dumps([{"error": result['error']}], ensure_ascii=False)
+        return columnar.dumps([{"error": result['error']}])
     if result.get('type') == 'multi' and isinstance(result.get('data'), list):
-        formatted_data = []
-        for tbl in result['data']:
-            if isinstance(tbl, dict) and 'title' in tbl and 'data' in tbl:
-                formatted_data.append({
-                    'title': tbl['title'],
-                    'data': tbl['data']
-                })
-        return json.dumps([{
-            'type': 'multi',
-            'data': formatted_data
-        }], ensure_ascii=False)
-    if result.get('type') == 'queryset' and isinstance(result.get('data'), list):
-        return json.dumps([{
-            'type': 'queryset',
-            'count': result.get('count', len(result['data'])),
-            'data': result['data']
-        }], ensure_ascii=False)
-    if result.get('type') in ('list', 'dict', 'tuple'):
-        return json.dumps([{
-            'type': result['type'],
-            'data': result['data']
-        }], ensure_ascii=False)
-    if result.get('type') in ('str', 'int', 'float', 'bool'):
-        return json.dumps([{
-            'type': result['type'],
-            'data': result['data']
-        }], ensure_ascii=False)
-    return json.dumps([{
+        formatted_data = [
+            {k: tbl[k] for k in ('title', 'columns', 'rows', 'data') if k in tbl}
+            for tbl in result['data']
+            if isinstance(tbl, dict) and 'title' in tbl
+        ]
+        return columnar.dumps([{'type': 'multi', 'data': formatted_data}])
+    if result.get('type') in ('queryset', 'list', 'tuple', 'dict', 'str', 'int', 'float', 'bool'):
+        # 表格为 columns + rows（列式），其余为 data；queryset 另带 count / count_exact，有下一页时带 handle / next
+        return columnar.dumps([{
+            k: result[k]
+            for k in ('type', 'count', 'count_exact', 'columns', 'rows', 'data', 'handle', 'next') if k in result
+        }])
+    return columnar.dumps([{
         'type': 'other',
         'data': str(result.get('data'))
-    }], ensure_ascii=False)
+    }])
+
+
+def generated_code(ai_response):
+    code = extract_code_from_response(ai_response)
+    if 'cno__cname' in code:
+        code = code.replace(
+            'values(\'cno__cname\')',
+            'values_list(\'cno__cname\', flat=True)'
+        )
+    return code
+
+
+def chat_result_reply(code, execution_result):
+    if 'error' in execution_result:
+        return f"执行错误:\n{execution_result['error']}\n\n生成的代码:\n```python\n{code}\n```"
+    return format_execution_result(execution_result)
+
+
+def generation_messages(user_input):
+    # 模型结构按问题裁剪；统计里与带全部模型的提示词比较
+    prompt = CODE_GENERATION_PROMPT.format(schema=prompt_schema.schema(user_input))
+    prompt_schema.record(prompt, CODE_GENERATION_PROMPT.format(schema=prompt_schema.full_schema()))
+    return [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": user_input}
+    ]
+
+
+def remember_code(user_input, code, execution_result, source):
+    """大模型新生成且执行成功的代码放进缓存；命中缓存的代码执行失败则移除"""
+    if 'error' in execution_result:
+        if source == 'cache':
+            code_cache.discard(CODE_GENERATION_PROMPT, user_input)
+    elif source == 'llm':
+        code_cache.put(CODE_GENERATION_PROMPT, user_input, code)
+
+
+def attach_handle(execution_result, code, user_id):
+    """结果还有下一页时登记结果句柄，“加载更多”凭句柄取后续行"""
+    if execution_result.get('next'):
+        return {**execution_result, 'handle': result_pages.create_handle(code, user_id)}
+    return execution_result
+
+
+def execute_code(user_input, code, source, user_id):
+    """执行代码，返回给用户的回复文本（同步，会访问数据库）"""
+    execution_result = sandbox.execute(code)
+    remember_code(user_input, code, execution_result, source)
+    return chat_result_reply(code, attach_handle(execution_result, code, user_id))
+
+
+def local_code(user_input):
+    """不请求大模型就能得到的代码：规则匹配，其次是代码缓存；返回 (代码, 来源) 或 (None, None)"""
+    matched = intents.match(user_input)
+    if matched:
+        return matched[1], 'rule'
+    code = code_cache.get(CODE_GENERATION_PROMPT, user_input)
+    if code is not None:
+        return code, 'cache'
+    return None, None
 
 
-def make_json_safe(obj):
-    if isinstance(obj, dict):
-        return {k: make_json_safe(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [make_json_safe(v) for v in obj]
-    elif isinstance(obj, tuple):
-        return tuple(make_json_safe(v) for v in obj)
-    elif isinstance(obj, (datetime, date)):
-        return obj.strftime('%Y-%m-%d %H:%M:%S')
-    elif hasattr(obj, '__dict__'):
-        return {k: make_json_safe(v) for k, v in obj.__dict__.items() if not k.startswith('_')}
-    else:
-        return obj
+async def agenerate_code(user_input):
+    """返回 (代码, 来源, AI 原始回复)，来源为 rule / cache / llm"""
+    code, source = await sync_to_async(_run_in_worker, thread_sensitive=False)(local_code, user_input)
+    if code is not None:
+        return code, source, None
+    started = time.perf_counter()
+    ai_response = await aget_ai_response(generation_messages(user_input))
+    code_cache.record_llm(time.perf_counter() - started)
+    return generated_code(ai_response), 'llm', ai_response
+
+
+def _run_in_worker(func, *args):
+    # 在线程池里执行 ORM：和请求线程一样，前后按 CONN_MAX_AGE 清理过期连接
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+async def _aiter_in_worker(func, *args):
+    """
+    在线程池的一个线程里跑同步生成器，逐项交给事件循环；
+    生成器里的查询游标不能跨线程，所以不能用 sync_to_async 逐次调用 next()。
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    done = object()
+
+    def produce():
+        close_old_connections()
+        try:
+            for item in func(*args):
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            close_old_connections()
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    worker = loop.run_in_executor(None, produce)
+    while (item := await queue.get()) is not done:
+        if isinstance(item, Exception):
+            raise item
+        yield item
+    await worker
+
+
+async def achat_reply(user_input, user_id):
+    """
+    一次对话：异步等待 AI 回复（不占线程），生成的代码放到线程池里执行。
+    thread_sensitive=False：各请求的查询并行执行，不在同一个线程上排队。
+    """
+    ai_response = source = None
+    started = time.perf_counter()
+    try:
+        code, source, ai_response = await agenerate_code(user_input)
+        return await sync_to_async(_run_in_worker, thread_sensitive=False)(
+            execute_code, user_input, code, source, user_id,
+        )
+    except Exception as e:
+        return f"处理失败:\n{str(e)}\n\nAI回复:\n{ai_response or '无'}"
+    finally:
+        prompt_schema.record_chat(source, time.perf_counter() - started)
 
 
 @login_required
-def chat_view(request):
+async def chat_view(request):
+    """
+    AI 对话（异步视图，在 ASGI 下运行时等待 AI 回复不占用工作线程）。
+    对话记录存在 chatmsg 表（见 chat_history.py），页面只渲染当前对话最近一页。
+    """
+    user = await request.auser()
     if request.GET.get("clear") == "1":
-        request.session["chat_messages"] = [
-            {
-                "role": "system",
-                "content": """你是一个Django ORM代码生成助手。根据用户需求生成可直接执行的Python代码。
-    代码应该简洁、安全，并且将结果赋值给变量`result`。
-    可用的模型：student, cl, depart, course, sc。
-    使用Django ORM进行查询，不要使用原始SQL。"""
-            },
-            {
-                "role": "assistant",
-                "content": "你好我是你的AI助手，我可以帮助你完成查询工作！"
-            }
-        ]
-        request.session.modified = True
+        await chat_history.start_conversation(user.pk)
         return redirect("/chat/")
-    if "chat_messages" not in request.session:
-        request.session["chat_messages"] = [{
-            "role": "system",
-            "content": """你是一个Django ORM代码生成助手。根据用户需求生成可直接执行的Python代码。
-代码应该简洁、安全，并且将结果赋值给变量`result`。
-可用的模型：student, cl, depart, course, sc。
-使用Django ORM进行查询，不要使用原始SQL。"""
-        }]
-    executor = AICodeExecutor()
+    await chat_history.import_session(request.session, user.pk)
+    conversation = await chat_history.current_conversation(user.pk)
     if request.method == "POST":
         user_input = request.POST.get("message", "").strip()
-        if not user_input:
-            return render(request, "chat.html", {"messages": request.session["chat_messages"]})
-        request.session["chat_messages"].append({"role": "user", "content": user_input})
+        if user_input:
+            reply = await achat_reply(user_input, user.pk)
+            await chat_history.append(user.pk, conversation, user_input, reply)
+    chat, has_more = await chat_history.page(user.pk, conversation)
+    # 模板会读取 request.user 等（同步访问数据库），整体放到线程里渲染
+    return await sync_to_async(render)(request, "chat.html", {
+        "messages": chat, "conversation": conversation, "has_more": has_more,
+    })
+
+
+@login_required
+async def chat_history_view(request):
+    """GET /chat/history/?conversation=&before=：更早的一页对话记录"""
+    user = await request.auser()
+    try:
+        conversation = int(request.GET.get("conversation", ""))
+        before = int(request.GET.get("before", ""))
+    except ValueError:
+        return JsonResponse({'error': '参数错误'}, status=400)
+    rows, has_more = await chat_history.page(user.pk, conversation, before)
+    return JsonResponse({
+        'messages': [{'id': m.id, 'role': m.role, 'content': m.content} for m in rows],
+        'has_more': has_more,
+    })
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {columnar.dumps(data)}\n\n"
+
+
+@login_required
+async def chat_stream_view(request):
+    """
+    POST /chat/stream/：以 SSE 流式返回一次对话。
+    事件依次为 token（模型输出片段）、code（提取出的代码）、columns / rows（查询结果的列名和分批的行）、
+    done（最终回复，与页面刷新后看到的一致）。
+    """
+    if request.method != "POST":
+        return JsonResponse({'error': '仅支持 POST'}, status=405)
+    user_input = request.POST.get("message", "").strip()
+    if not user_input:
+        return JsonResponse({'error': '消息不能为空'}, status=400)
+    user = await request.auser()
+    conversation = await chat_history.current_conversation(user.pk)
+
+    async def events():
+        parts = []
+        source = None
+        chat_started = time.perf_counter()
         try:
-            prompt = CODE_GENERATION_PROMPT.format(user_query=user_input)
-            ai_response = get_ai_response([
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": user_input}
-            ])
-            code = extract_code_from_response(ai_response)
-            if 'cno__cname' in code:
-                code = code.replace(
-                    'values(\'cno__cname\')',
-                    'values_list(\'cno__cname\', flat=True)'
-                )
-            execution_result = executor.execute_ai_code(code)
-            if 'error' in execution_result:
-                reply = f"执行错误:\n{execution_result['error']}\n\n生成的代码:\n```python\n{code}\n```"
-            else:
-                reply = format_execution_result(execution_result)
+            code, source = await sync_to_async(_run_in_worker, thread_sensitive=False)(local_code, user_input)
+            if code is None:
+                source = 'llm'
+                started = time.perf_counter()
+                async for text in astream_ai_response(generation_messages(user_input)):
+                    parts.append(text)
+                    yield sse_event('token', {'text': text})
+                code_cache.record_llm(time.perf_counter() - started)
+                code = generated_code(''.join(parts))
+            yield sse_event('code', {'code': code, 'source': source})
+            execution_result = None
+            async for kind, payload in _aiter_in_worker(sandbox.iter_execute, code):
+                if kind == 'columns':
+                    yield sse_event('columns', {'columns': payload})
+                elif kind == 'rows':
+                    yield sse_event('rows', {'rows': payload})
+                else:
+                    execution_result = payload
+            remember_code(user_input, code, execution_result, source)
+            reply = chat_result_reply(code, attach_handle(execution_result, code, user.pk))
         except Exception as e:
-            reply = f"处理失败:\n{str(e)}\n\nAI回复:\n{ai_response if 'ai_response' in locals() else '无'}"
-        request.session["chat_messages"].append({"role": "assistant", "content": reply})
-        request.session.modified = True
-    return render(request, "chat.html", {"messages": request.session["chat_messages"]})
+            reply = f"处理失败:\n{str(e)}\n\nAI回复:\n{''.join(parts) or '无'}"
+        prompt_schema.record_chat(source, time.perf_counter() - chat_started)
+        await chat_history.append(user.pk, conversation, user_input, reply)
+        yield sse_event('done', {'reply': reply})
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # 让 nginx 不缓冲，逐条转发
+    return response
+
+
+class SandboxStatsView(LoginRequiredMixin, View):
+    """AI 代码沙箱进程池的排队和耗时指标（当前 web 进程）"""
+
+    def get(self, request):
+        return JsonResponse(sandbox.pool.metrics())
+
+
+class LLMStatsView(LoginRequiredMixin, View):
+    """各大模型上游的请求数、错误、对冲、熔断状态和耗时直方图（当前 web 进程）"""
+
+    def get(self, request):
+        return JsonResponse(ai_client.stats())
+
+
+class ChatResultPageView(LoginRequiredMixin, View):
+    """GET /chat/result/<句柄>/?cursor=...：AI 查询结果的下一页（不请求大模型）"""
+
+    def get(self, request, handle):
+        code = result_pages.handle_code(handle, request.user.pk)
+        if code is None:
+            return JsonResponse({'error': '结果已过期，请重新提问'}, status=404)
+        result = sandbox.page(code, request.GET.get('cursor'))
+        if 'error' in result:
+            return JsonResponse(result, status=400)
+        return HttpResponse(columnar.dumps(result), content_type='application/json')